@@ -18,6 +18,7 @@ from typing import Iterable
 import ast
 import asyncio
 import colorsys
+import contextlib
 import datetime
 import glob
 import hashlib
@@ -25,10 +26,10 @@ import io
 import json
 import os
 import re
+import shutil
 import subprocess
 import sys
 import tarfile
-import time
 import traceback
 import typing
 import urllib.parse
@@ -88,6 +89,7 @@ def db_tables_graph(kind: typing.Literal["full", "modules"]) -> None:
         frozenset({"external"}): "#FF55FF",
         frozenset({"extraction"}): "#0000FF",
         frozenset({"extraction", "sandbox"}): "#5555FF",
+        frozenset({"llm_cache"}): "#888888",
         frozenset({"textbooks"}): "#FFFF00",
     }
 
@@ -642,9 +644,26 @@ def load_fixtures(truncate: bool, fixture: Iterable[str]) -> None:
 
 
 @main.command()
-@click.option("--pause", type=float, default=1.0)
 @click.option("--max-retries", type=int, default=6)
-def run_submission_daemon(pause: float, max_retries: int) -> None:
+@click.option("--extraction-concurrency", type=click.IntRange(min=0), default=1)
+@click.option("--preprocessing-processes", type=click.IntRange(min=1), default=1)
+@click.option("--classification-concurrency", type=click.IntRange(min=0, max=1), default=1)
+@click.option("--adaptation-concurrency", type=click.IntRange(min=0), default=1)
+@click.option("--textbook-export-concurrency", type=click.IntRange(min=0), default=1)
+@click.option("--adaptation-batches/--no-adaptation-batches", default=False)
+@click.option("--adaptation-batch-max-size", type=click.IntRange(min=1), default=1000)
+@click.option("--adaptation-batch-poll-interval", type=float, default=60.0)
+def run_submission_daemon(
+    max_retries: int,
+    extraction_concurrency: int,
+    preprocessing_processes: int,
+    classification_concurrency: int,
+    adaptation_concurrency: int,
+    textbook_export_concurrency: int,
+    adaptation_batches: bool,
+    adaptation_batch_max_size: int,
+    adaptation_batch_poll_interval: float,
+) -> None:
     import requests
 
     from . import adaptation
@@ -652,72 +671,192 @@ def run_submission_daemon(pause: float, max_retries: int) -> None:
     from . import database_utils
     from . import extraction
     from . import logs
+    from . import pending_work
+    from . import rate_limits
+    from .api_router import export
     from .retry import RetryableError
 
-    engine = database_utils.create_engine(settings.DATABASE_URL)
+    # Each worker holds a connection while its task is in flight (pending rows are claimed with
+    # 'SELECT ... FOR UPDATE SKIP LOCKED' and stay locked until the task is committed).
+    # One more connection is used to listen for pending work notifications.
+    engine = database_utils.create_engine(
+        settings.DATABASE_URL,
+        pool_size=extraction_concurrency
+        + classification_concurrency
+        + adaptation_concurrency
+        + textbook_export_concurrency
+        + (1 if adaptation_batches else 0)
+        + 1,
+    )
 
-    default_pause = pause
+    # Wake-ups are normally triggered by notifications; this is a safety net in case some are missed
+    idle_pause = 60
 
-    async def daemon() -> None:
-        logs.log("Starting")
-        last_time = time.monotonic()
-        current_retries = 0
+    listener = pending_work.Listener(engine)
+
+    async def extract_next() -> bool:
+        with database_utils.Session(engine) as session:
+            extraction_task = extraction.submission.submit_next_extraction(max_retries, session)
+            if extraction_task is None:
+                return False
+            else:
+                await extraction_task
+                session.commit()
+                return True
+
+    def classify_next_sync() -> bool:
+        with database_utils.Session(engine) as session:
+            done_something = classification.submission.execute_next_classification_chunk(session)
+            session.commit()
+            return done_something
+
+    async def classify_next() -> bool:
+        # Classification is CPU-bound: run it in a thread to keep LLM calls flowing meanwhile
+        return await asyncio.to_thread(classify_next_sync)
+
+    async def adapt_next() -> bool:
+        with database_utils.Session(engine) as session:
+            adaptation_task = adaptation.submission.submit_next_adaptation(
+                max_retries, session, leave_batchable=adaptation_batches
+            )
+            if adaptation_task is None:
+                return False
+            else:
+                await adaptation_task
+                session.commit()
+                return True
+
+    async def batch_adaptations_next() -> bool:
+        # Collecting finished batches first frees their adaptations sooner
+        with database_utils.Session(engine) as session:
+            poll_task = adaptation.submission.poll_next_adaptation_llm_batch(
+                session, datetime.timedelta(seconds=adaptation_batch_poll_interval)
+            )
+            if poll_task is not None:
+                await poll_task
+                session.commit()
+                return True
+        with database_utils.Session(engine) as session:
+            batch_task = adaptation.submission.submit_next_adaptation_llm_batch(session, adaptation_batch_max_size)
+            if batch_task is None:
+                return False
+            else:
+                await batch_task
+                session.commit()
+                return True
+
+    def export_next_sync() -> bool:
+        with database_utils.Session(engine) as session:
+            done_something = export.execute_next_textbook_export(session)
+            session.commit()
+            return done_something
+
+    async def export_next() -> bool:
+        # Rendering exports loads many files synchronously: run it in a thread to keep LLM calls flowing meanwhile
+        return await asyncio.to_thread(export_next_sync)
+
+    async def worker(
+        name: str, do_next: typing.Callable[[], typing.Awaitable[bool]], max_pause: float = idle_pause
+    ) -> None:
+        logs.log(f"Starting worker {name}")
+        wake_up = listener.make_wake_up_event()
         while True:
+            # Clear before looking for work, so that work created meanwhile is not missed
+            wake_up.clear()
             done_something = False
-            can_retry = current_retries < max_retries
             try:
-                if time.monotonic() >= last_time + 60:
-                    last_time = time.monotonic()
-                    if settings.SUBMISSION_DAEMON_PULSE_MONITORING_URL is not None:
-                        logs.log("Calling pulse monitoring URL")
-                        requests.post(settings.SUBMISSION_DAEMON_PULSE_MONITORING_URL)
-
-                with database_utils.Session(engine) as session:
-                    # Do only one thing (extract XOR classify XOR adapt)
-                    # in each session to commit progress as soon as possible.
-                    extraction_task = extraction.submission.submit_next_extraction(can_retry, session)
-                    if extraction_task is not None:
-                        await extraction_task
-                        done_something = True
-                    if not done_something:
-                        done_something = classification.submission.execute_next_classification_chunk(session)
-                    if not done_something:
-                        adaptation_task = adaptation.submission.submit_next_adaptation(can_retry, session)
-                        if adaptation_task is not None:
-                            await adaptation_task
-                            done_something = True
-                    session.commit()
+                # Do only one thing in each session to commit progress as soon as possible.
+                done_something = await do_next()
             except RetryableError:
+                # The rate limiter now throttles the model concerned: look for work for other models right away
                 assert not done_something
-                current_retries += 1
+                continue
             except Exception:  # Pokemon programming: gotta catch 'em all
-                logs.log("UNEXPECTED ERROR reached daemon level")
+                logs.log(f"UNEXPECTED ERROR reached worker {name}")
                 traceback.print_exc()
 
-            if done_something:
-                current_retries = 0
-            else:
-                pause = min(default_pause * (2**current_retries), 60)
-                logs.log(f"Sleeping for {pause}s...")
-                await asyncio.sleep(pause)
+            if not done_something:
+                # Pending work for throttled models is left aside: come back to it when they are available again
+                pause = min(max_pause, rate_limits.limiter.seconds_until_unthrottled() or max_pause)
+                logs.log(f"Worker {name} waiting for pending work...")
+                try:
+                    await asyncio.wait_for(wake_up.wait(), timeout=pause)
+                except TimeoutError:
+                    pass
+
+    async def pulse() -> None:
+        while True:
+            if settings.SUBMISSION_DAEMON_PULSE_MONITORING_URL is not None:
+                logs.log("Calling pulse monitoring URL")
+                try:
+                    await asyncio.to_thread(requests.post, settings.SUBMISSION_DAEMON_PULSE_MONITORING_URL)
+                except Exception:
+                    logs.log("UNEXPECTED ERROR while calling pulse monitoring URL")
+                    traceback.print_exc()
+            await asyncio.sleep(60)
+
+    async def daemon() -> None:
+        logs.log("Starting")
+        if extraction_concurrency > 0:
+            extraction.preprocessing.start(preprocessing_processes)
+        await asyncio.gather(
+            pulse(),
+            listener.run(),
+            *(worker(f"extraction-{i}", extract_next) for i in range(extraction_concurrency)),
+            *(worker(f"classification-{i}", classify_next) for i in range(classification_concurrency)),
+            *(worker(f"adaptation-{i}", adapt_next) for i in range(adaptation_concurrency)),
+            # Batches finish without notifications: poll them at the requested interval, even if it's short
+            *(
+                [worker("adaptation-batches", batch_adaptations_next, min(idle_pause, adaptation_batch_poll_interval))]
+                if adaptation_batches
+                else []
+            ),
+            *(worker(f"textbook-export-{i}", export_next) for i in range(textbook_export_concurrency)),
+        )
 
     asyncio.run(daemon())
 
 
+@main.command()
+@click.option("--port", type=int, default=8001)
+def run_fake_openai_batch_server(port: int) -> None:
+    import uvicorn
+
+    from .adaptation.llm.fake_openai_batches import FakeOpenAiBatchServer
+
+    # Run the submission daemon with 'OPENAI_BASE_URL=http://localhost:<port>/v1' to use this server
+    uvicorn.run(FakeOpenAiBatchServer().app, port=port)
+
+
 parsed_database_url = urllib.parse.urlparse(settings.DATABASE_URL)
 assert parsed_database_url.scheme == "postgresql+psycopg2"
 
 parsed_database_backups_url = urllib.parse.urlparse(settings.DATABASE_BACKUPS_URL)
 
 
+BackupFormat = typing.Literal["sql", "custom", "directory"]
+
+backup_extensions: dict[BackupFormat, str] = {
+    # Plain SQL, for humans and for restoring with 'psql'
+    "sql": ".tar.gz",
+    # pg_dump's compressed archive format, restorable in parallel with 'pg_restore --jobs'
+    "custom": ".dump",
+    # pg_dump's directory format (dumped in parallel), in an uncompressed tarball (its files are compressed)
+    "directory": ".tar",
+}
+
+
 @main.command()
-def backup_database() -> None:
-    import boto3
+@click.option("--format", "format_", type=click.Choice(typing.get_args(BackupFormat)), default="sql")
+@click.option("--jobs", type=click.IntRange(min=1), default=os.cpu_count() or 1, help="For the 'directory' format")
+def backup_database(format_: BackupFormat, jobs: int) -> None:
+    import tempfile
+
     import requests
 
     now = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
     backup_name = f"patty-backup-{now}"
-    archive_name = f"{backup_name}.tar.gz"
+    archive_name = f"{backup_name}{backup_extensions[format_]}"
 
     print(
         f"Backing up database {settings.DATABASE_URL} to {settings.DATABASE_BACKUPS_URL}/{archive_name}",
@@ -728,42 +867,51 @@ def backup_database() -> None:
     assert parsed_database_url.username is not None
     assert parsed_database_url.password is not None
 
-    pg_dump = subprocess.run(
-        [
-            # fmt: off
-            "pg_dump",
-            "--host", parsed_database_url.hostname,
-            "--username", parsed_database_url.username,
-            "--no-password",
-            "--dbname", parsed_database_url.path[1:],
-            "--file", "-",
-            "--create", "--column-inserts", "--quote-all-identifiers",
-            # fmt: on
-        ],
-        env=dict(os.environ, PGPASSWORD=parsed_database_url.password),
-        check=True,
-        capture_output=True,
-    )
-
-    def populate_tarball(tarball: tarfile.TarFile) -> None:
-        info = tarfile.TarInfo(f"{backup_name}/pg_dump.sql")
-        info.size = len(pg_dump.stdout)
-        tarball.addfile(info, io.BytesIO(pg_dump.stdout))
-
-    if parsed_database_backups_url.scheme == "file":
-        with tarfile.open(os.path.join(parsed_database_backups_url.path, archive_name), "w:gz") as tarball:
-            populate_tarball(tarball)
-    elif parsed_database_backups_url.scheme == "s3":
-        s3 = boto3.client("s3")
-        buffer = io.BytesIO()
-        with tarfile.open(fileobj=buffer, mode="w:gz") as tarball:
-            populate_tarball(tarball)
-        buffer.seek(0)
-        s3.upload_fileobj(
-            buffer, parsed_database_backups_url.netloc, f"{parsed_database_backups_url.path[1:]}/{archive_name}"
-        )
-    else:
-        raise NotImplementedError(f"Unsupported database backup URL scheme: {parsed_database_backups_url.scheme}")
+    pg_dump_command = [
+        # fmt: off
+        "pg_dump",
+        "--host", parsed_database_url.hostname,
+        "--username", parsed_database_url.username,
+        "--no-password",
+        "--dbname", parsed_database_url.path[1:],
+        "--quote-all-identifiers",
+        # fmt: on
+    ]
+    pg_dump_env = dict(os.environ, PGPASSWORD=parsed_database_url.password)
+
+    # The dump is never held in memory: it's streamed to the backup, through temporary files when needed
+    with open_backup_for_writing(archive_name) as backup:
+        if format_ == "sql":
+            # A tarball member's size must be known before its contents, so the dump goes to a temporary file first
+            with tempfile.NamedTemporaryFile(suffix=".sql") as pg_dump_file:
+                subprocess.run(
+                    pg_dump_command + ["--file", pg_dump_file.name, "--create", "--column-inserts"],
+                    env=pg_dump_env,
+                    check=True,
+                )
+                with tarfile.open(fileobj=backup, mode="w|gz") as tarball:
+                    tarball.add(pg_dump_file.name, arcname=f"{backup_name}/pg_dump.sql")
+        elif format_ == "custom":
+            pg_dump = subprocess.Popen(
+                pg_dump_command + ["--format", "custom"], env=pg_dump_env, stdout=subprocess.PIPE
+            )
+            assert pg_dump.stdout is not None
+            with pg_dump.stdout:
+                shutil.copyfileobj(pg_dump.stdout, backup)
+            if pg_dump.wait() != 0:
+                raise subprocess.CalledProcessError(pg_dump.returncode, pg_dump.args)
+        elif format_ == "directory":
+            with tempfile.TemporaryDirectory() as temporary_directory:
+                pg_dump_directory = os.path.join(temporary_directory, backup_name)
+                subprocess.run(
+                    pg_dump_command + ["--format", "directory", "--jobs", str(jobs), "--file", pg_dump_directory],
+                    env=pg_dump_env,
+                    check=True,
+                )
+                with tarfile.open(fileobj=backup, mode="w|") as tarball:
+                    tarball.add(pg_dump_directory, arcname=backup_name)
+        else:
+            assert False
 
     if settings.DATABASE_BACKUP_PULSE_MONITORING_URL is not None:
         requests.post(
@@ -775,34 +923,100 @@ def backup_database() -> None:
     )
 
 
+@contextlib.contextmanager
+def open_backup_for_writing(archive_name: str) -> typing.Iterator[typing.BinaryIO]:
+    if parsed_database_backups_url.scheme == "file":
+        with open(os.path.join(parsed_database_backups_url.path, archive_name), "wb") as backup:
+            yield backup
+    elif parsed_database_backups_url.scheme == "s3":
+        import concurrent.futures
+        import threading
+
+        import boto3
+
+        s3 = boto3.client("s3")
+        # 'upload_fileobj' reads the pipe in chunks and sends them as a multipart upload
+        read_fd, write_fd = os.pipe()
+        failed = threading.Event()
+
+        class Reader(io.RawIOBase):
+            def __init__(self, file: typing.BinaryIO) -> None:
+                self.file = file
+
+            def readable(self) -> bool:
+                return True
+
+            def read(self, size: int = -1) -> bytes:
+                data = self.file.read(size)
+                if data == b"" and failed.is_set():
+                    # Make the upload fail instead of completing it with a truncated backup
+                    raise RuntimeError("Backup failed")
+                return data
+
+        def upload() -> None:
+            # Close the reading end when the upload stops, even on error, so that writing fails instead of blocking
+            with open(read_fd, "rb") as reader:
+                s3.upload_fileobj(
+                    Reader(reader),
+                    parsed_database_backups_url.netloc,
+                    f"{parsed_database_backups_url.path[1:]}/{archive_name}",
+                )
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            upload_future = executor.submit(upload)
+            # Unbuffered, so that closing it does not raise a second error after a failed write
+            with open(write_fd, "wb", buffering=0) as writer:
+                try:
+                    yield writer
+                except BrokenPipeError:
+                    upload_future.result()  # Raises the actual error that stopped the upload
+                    raise
+                except BaseException:
+                    failed.set()
+                    raise
+            upload_future.result()
+    else:
+        raise NotImplementedError(f"Unsupported database backup URL scheme: {parsed_database_backups_url.scheme}")
+
+
+@contextlib.contextmanager
+def open_backup_for_reading(parsed_backup_url: urllib.parse.ParseResult) -> typing.Iterator[typing.BinaryIO]:
+    if parsed_backup_url.scheme == "file":
+        with open(parsed_backup_url.path, "rb") as backup:
+            yield backup
+    elif parsed_backup_url.scheme == "s3":
+        import boto3
+
+        s3 = boto3.client("s3")
+        body = s3.get_object(Bucket=parsed_backup_url.netloc, Key=parsed_backup_url.path[1:])["Body"]
+        with contextlib.closing(body):
+            yield typing.cast(typing.BinaryIO, body)
+    else:
+        raise NotImplementedError(f"Unsupported database backup URL scheme: {parsed_backup_url.scheme}")
+
+
 @main.command()
 @click.argument("backup_url", default="s3://jacquev6/patty/prod/backups/patty-backup-20251222-071603.tar.gz")
 @click.option("--yes", is_flag=True)
 @click.option("--patch-according-to-settings", is_flag=True)
-def restore_database(backup_url: str, yes: bool, patch_according_to_settings: bool) -> None:
-    import boto3
+@click.option("--jobs", type=click.IntRange(min=1), default=os.cpu_count() or 1, help="Except for the 'sql' format")
+def restore_database(backup_url: str, yes: bool, patch_according_to_settings: bool, jobs: int) -> None:
+    import tempfile
+
     import sqlalchemy_utils
 
     parsed_backup_url = urllib.parse.urlparse(backup_url)
+    formats = [
+        format_ for (format_, extension) in backup_extensions.items() if parsed_backup_url.path.endswith(extension)
+    ]
+    if len(formats) != 1:
+        raise click.BadParameter(
+            f"unsupported extension (supported extensions: {', '.join(backup_extensions.values())})",
+            param_hint="'BACKUP_URL'",
+        )
+    (format_,) = formats
 
-    if parsed_backup_url.scheme == "file":
-        with tarfile.open(parsed_backup_url.path, "r:gz") as tarball:
-            pg_dump_file = tarball.extractfile(tarball.getnames()[0])
-            assert pg_dump_file is not None
-            pg_dump = pg_dump_file.read()
-    elif parsed_backup_url.scheme == "s3":
-        s3 = boto3.client("s3")
-        buffer = io.BytesIO()
-        s3.download_fileobj(parsed_backup_url.netloc, f"{parsed_backup_url.path[1:]}", buffer)
-        buffer.seek(0)
-        with tarfile.open(fileobj=buffer, mode="r:gz") as tarball:
-            pg_dump_file = tarball.extractfile(tarball.getnames()[0])
-            assert pg_dump_file is not None
-            pg_dump = pg_dump_file.read()
-    else:
-        raise NotImplementedError(f"Unsupported database backup URL scheme: {parsed_database_backups_url.scheme}")
-
-    print(f"Restoring database {settings.DATABASE_URL} from {backup_url} ({len(pg_dump)} bytes)", file=sys.stderr)
+    print(f"Restoring database {settings.DATABASE_URL} from {backup_url} ({format_} format)", file=sys.stderr)
     if not yes:
         print(
             "This will overwrite the current database. Are you sure you want to continue? [y/N]",
@@ -813,6 +1027,61 @@ def restore_database(backup_url: str, yes: bool, patch_according_to_settings: bo
             print("Aborting.", file=sys.stderr)
             return
 
+    # Drop the current database as late as possible, so that a missing or unreadable backup leaves it untouched:
+    # after fetching the backup for 'custom' and 'directory', after opening it for the streamed 'sql' format
+    if format_ == "sql":
+        with open_backup_for_reading(parsed_backup_url) as backup:
+            drop_database_if_exists()
+            restore_sql_database(backup, patch_according_to_settings)
+    else:
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            # 'pg_restore --jobs' needs a seekable file or a directory: stream the backup to disk first
+            with open_backup_for_reading(parsed_backup_url) as backup:
+                if format_ == "custom":
+                    pg_restore_input = os.path.join(temporary_directory, "pg_dump.dump")
+                    with open(pg_restore_input, "wb") as pg_dump_file:
+                        shutil.copyfileobj(backup, pg_dump_file)
+                elif format_ == "directory":
+                    with tarfile.open(fileobj=backup, mode="r|") as tarball:
+                        tarball.extractall(temporary_directory, filter="data")
+                    (pg_restore_input,) = glob.glob(os.path.join(temporary_directory, "*"))
+                else:
+                    assert False
+
+            drop_database_if_exists()
+            sqlalchemy_utils.functions.create_database(settings.DATABASE_URL)
+            assert parsed_database_url.hostname is not None
+            assert parsed_database_url.username is not None
+            assert parsed_database_url.password is not None
+            subprocess.run(
+                [
+                    # fmt: off
+                    "pg_restore",
+                    "--host", parsed_database_url.hostname,
+                    "--username", parsed_database_url.username,
+                    "--no-password",
+                    "--dbname", parsed_database_url.path[1:],
+                    "--jobs", str(jobs),
+                    "--exit-on-error",
+                    # fmt: on
+                ]
+                # The database itself is created above, according to settings; its objects belong to the current user
+                + (["--no-owner"] if patch_according_to_settings else []) + [pg_restore_input],
+                env=dict(os.environ, PGPASSWORD=parsed_database_url.password),
+                check=True,
+            )
+
+
+def drop_database_if_exists() -> None:
+    import sqlalchemy_utils
+
+    if sqlalchemy_utils.functions.database_exists(settings.DATABASE_URL):
+        sqlalchemy_utils.functions.drop_database(settings.DATABASE_URL)
+
+
+def restore_sql_database(backup: typing.BinaryIO, patch_according_to_settings: bool) -> None:
+    import sqlalchemy_utils
+
     placeholder_database_url = settings.DATABASE_URL + "-restore"
     if not sqlalchemy_utils.functions.database_exists(placeholder_database_url):
         sqlalchemy_utils.functions.create_database(placeholder_database_url)
@@ -821,21 +1090,7 @@ def restore_database(backup_url: str, yes: bool, patch_according_to_settings: bo
     assert parsed_placeholder_database_url.username is not None
     assert parsed_placeholder_database_url.password is not None
 
-    if sqlalchemy_utils.functions.database_exists(settings.DATABASE_URL):
-        sqlalchemy_utils.functions.drop_database(settings.DATABASE_URL)
-
-    sql = pg_dump.decode()
-    if patch_according_to_settings:
-        # Comments
-        sql = re.sub(r" Owner: \w+", f" Owner: {parsed_database_url.username}", sql)
-        sql = re.sub(r"-- Name: \w+; Type: DATABASE;", f"-- Name: {parsed_database_url.path[1:]}; Type: DATABASE;", sql)
-        # Postgres commands
-        sql = re.sub(r"connect \"\w+\"", f'connect "{parsed_database_url.path[1:]}"', sql)
-        # Actual SQL
-        sql = re.sub(r" OWNER TO \"\w+\";", f' OWNER TO "{parsed_database_url.username}";', sql)
-        sql = re.sub(r"DATABASE \"\w+\"", f'DATABASE "{parsed_database_url.path[1:]}"', sql)
-
-    subprocess.run(
+    psql = subprocess.Popen(
         [
             # fmt: off
             "psql",
@@ -846,14 +1101,37 @@ def restore_database(backup_url: str, yes: bool, patch_according_to_settings: bo
             # fmt: on
         ],
         env=dict(os.environ, PGPASSWORD=parsed_placeholder_database_url.password),
-        check=True,
-        input=sql,
-        universal_newlines=True,
+        stdin=subprocess.PIPE,
     )
+    assert psql.stdin is not None
+    with psql.stdin, tarfile.open(fileobj=backup, mode="r|gz") as tarball:
+        member = tarball.next()
+        assert member is not None
+        pg_dump_file = tarball.extractfile(member)
+        assert pg_dump_file is not None
+        # Line by line, to keep memory usage constant (all patches below apply within a line)
+        for line in pg_dump_file:
+            if patch_according_to_settings:
+                line = patch_sql_line(line.decode()).encode()
+            psql.stdin.write(line)
+    if psql.wait() != 0:
+        raise subprocess.CalledProcessError(psql.returncode, psql.args)
 
     sqlalchemy_utils.functions.drop_database(placeholder_database_url)
 
 
+def patch_sql_line(line: str) -> str:
+    # Comments
+    line = re.sub(r" Owner: \w+", f" Owner: {parsed_database_url.username}", line)
+    line = re.sub(r"-- Name: \w+; Type: DATABASE;", f"-- Name: {parsed_database_url.path[1:]}; Type: DATABASE;", line)
+    # Postgres commands
+    line = re.sub(r"connect \"\w+\"", f'connect "{parsed_database_url.path[1:]}"', line)
+    # Actual SQL
+    line = re.sub(r" OWNER TO \"\w+\";", f' OWNER TO "{parsed_database_url.username}";', line)
+    line = re.sub(r"DATABASE \"\w+\"", f'DATABASE "{parsed_database_url.path[1:]}"', line)
+    return line
+
+
 @main.command()
 @click.option("--dry-run", is_flag=True)
 def migrate_data(dry_run: bool) -> None:
@@ -869,5 +1147,19 @@ def migrate_data(dry_run: bool) -> None:
             session.commit()
 
 
+@main.command()
+@click.option("--older-than-days", type=click.IntRange(min=1), default=30)
+def delete_old_textbook_exports(older_than_days: int) -> None:
+    from . import database_utils
+    from .api_router import export
+
+    database_engine = database_utils.create_engine(settings.DATABASE_URL)
+    with database_utils.make_session(database_engine) as session:
+        before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=older_than_days)
+        deleted_count = export.delete_old_textbook_exports(session, before)
+        session.commit()
+    print(f"Deleted {deleted_count} textbook exports created before {before}")
+
+
 if __name__ == "__main__":
     main()
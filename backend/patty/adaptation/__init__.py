@@ -22,7 +22,10 @@ from . import submission as submission
 from .orm_models import (
     AdaptableExercise as AdaptableExercise,
     Adaptation as Adaptation,
+    AdaptationAdjustment as AdaptationAdjustment,
     AdaptationCreation as AdaptationCreation,
+    AdaptationLlmBatch as AdaptationLlmBatch,
+    AdaptationLlmConversation as AdaptationLlmConversation,
     AdaptationSettings as AdaptationSettings,
     ExerciseClass as ExerciseClass,
 )
@@ -17,11 +17,13 @@
 from __future__ import annotations
 
 from typing import Any, Literal, Iterable
+import threading
 import time
 import typing
 import unittest
 
 from polyfactory.factories.pydantic_factory import ModelFactory
+import cachetools
 import pydantic.alias_generators
 
 from ..api_utils import ApiModel
@@ -373,6 +375,14 @@ class Components(BaseModel):
     reference: ReferenceComponents
 
 
+# Building these types (and their JSON schemas, see 'llm.make_schema') is expensive, and they only depend on 'components'.
+# Returning the same type for equal components also lets 'llm.make_schema' cache the schema.
+# Routes run in FastAPI's thread pool, and 'LRUCache' is not thread-safe, hence the lock.
+@cachetools.cached(
+    cache=cachetools.LRUCache[str, type[Exercise]](maxsize=64),
+    key=lambda components: components.model_dump_json(),
+    lock=threading.Lock(),
+)
 def make_partial_exercise_type(components: Components) -> type[Exercise]:
     # Typing dynamic types is a nightmare, so this function is mostly untyped
     # and relies on a final cast of its return value.
@@ -495,6 +505,13 @@ class MakePartialExerciseTypeTestCase(unittest.TestCase):
         except pydantic.ValidationError as e:
             self.fail(f"Validation failed for {instance}: {e}")
 
+    def test_cached(self) -> None:
+        components = self.ComponentsFactory.build()
+        self.assertIs(
+            make_partial_exercise_type(components),
+            make_partial_exercise_type(Components.model_validate(components.model_dump())),
+        )
+
     FullPartialExercise = make_partial_exercise_type(
         Components(
             instruction=InstructionComponents(
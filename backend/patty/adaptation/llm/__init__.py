@@ -19,7 +19,10 @@ from typing import Any
 import pydantic
 from .base import (
     AssistantMessage as AssistantMessage,
+    BatchRequest as BatchRequest,
+    BatchResponse as BatchResponse,
     CompletionResponse as CompletionResponse,
+    FailedBatchRequestLlmException as FailedBatchRequestLlmException,
     InvalidJsonAssistantMessage as InvalidJsonAssistantMessage,
     InvalidJsonLlmException as InvalidJsonLlmException,
     JsonFromTextResponseFormat as JsonFromTextResponseFormat,
@@ -40,6 +43,9 @@ from .schema import make_schema as make_schema
 
 ConcreteModel = DummyModel | MistralAiModel | OpenAiModel | GeminiModel
 
+# Providers whose models implement 'submit_batch' and 'retrieve_batch'
+batchable_providers = frozenset({"openai"})
+
 
 def validate(obj: Any) -> ConcreteModel:
     return pydantic.RootModel[ConcreteModel].model_validate(obj).root
@@ -20,6 +20,8 @@ import json
 
 import pydantic
 
+from ... import llm_cache
+from ... import rate_limits
 from ...any_json import JsonDict
 
 
@@ -68,6 +70,19 @@ class JsonSchemaResponseFormat[T](pydantic.BaseModel):
     response_type: type[T]
 
 
+class BatchRequest[T](pydantic.BaseModel):
+    messages: list[
+        SystemMessage | UserMessage | AssistantMessage[T] | InvalidJsonAssistantMessage | NotJsonAssistantMessage
+    ]
+    response_format: JsonFromTextResponseFormat[T] | JsonObjectResponseFormat[T] | JsonSchemaResponseFormat[T]
+
+
+class BatchResponse(pydantic.BaseModel):
+    raw_conversation: JsonDict
+    # None when the provider failed to process the request
+    response: str | None
+
+
 class LlmException(RuntimeError):
     def __init__(self, *args: object, raw_conversation: JsonDict) -> None:
         super().__init__(*args)
@@ -86,6 +101,11 @@ class NotJsonLlmException(LlmException):
         self.text = text
 
 
+class FailedBatchRequestLlmException(LlmException):
+    def __init__(self, raw_conversation: JsonDict) -> None:
+        super().__init__("Batch request failed", raw_conversation=raw_conversation)
+
+
 def try_hard_to_json_loads(s: str) -> Any:
     preprocessed = s.strip()
     if preprocessed.startswith("```json") and preprocessed.endswith("```"):
@@ -97,6 +117,10 @@ def try_hard_to_json_loads(s: str) -> Any:
 
 
 class Model(abc.ABC, pydantic.BaseModel):
+    # Narrowed to literals by each concrete model
+    provider: str
+    name: str
+
     async def complete(
         self,
         /,
@@ -105,8 +129,52 @@ class Model(abc.ABC, pydantic.BaseModel):
         ],
         response_format: JsonFromTextResponseFormat[T] | JsonObjectResponseFormat[T] | JsonSchemaResponseFormat[T],
     ) -> CompletionResponse[T]:
-        (raw_conversation, response) = await self.do_complete(messages, response_format)
+        cache = llm_cache.responses_cache
+        if cache is None:
+            cached = None
+        else:
+            cache_key = llm_cache.make_key(
+                self.model_dump(mode="json"),
+                [message.model_dump(mode="json") for message in messages],
+                type(response_format).__name__,
+                response_format.response_type.model_json_schema(),
+            )
+            cached = await cache.get(cache_key)
+
+        if cached is None:
+            async with rate_limits.limiter.slot(self.provider, self.name):
+                (raw_conversation, response) = await self.do_complete(messages, response_format)
+        else:
+            # Recorded in the adaptation's raw conversations, to tell cached responses apart
+            raw_conversation = cached.value["raw_conversation"] | {
+                "cache_hit": {"key": cached.key, "stored_at": cached.stored_at.isoformat()}
+            }
+            response = cached.value["response"]
+
+        completion_response = self.__parse_response(raw_conversation, response, response_format)
+
+        # Only valid responses are cached, so that retrying after an error calls the provider again
+        if cache is not None and cached is None:
+            await cache.store(cache_key, {"raw_conversation": raw_conversation, "response": response})
+
+        return completion_response
+
+    def complete_from_batch(
+        self,
+        batch_response: BatchResponse,
+        response_format: JsonFromTextResponseFormat[T] | JsonObjectResponseFormat[T] | JsonSchemaResponseFormat[T],
+    ) -> CompletionResponse[T]:
+        if batch_response.response is None:
+            raise FailedBatchRequestLlmException(batch_response.raw_conversation)
+        else:
+            return self.__parse_response(batch_response.raw_conversation, batch_response.response, response_format)
 
+    def __parse_response(
+        self,
+        raw_conversation: JsonDict,
+        response: str,
+        response_format: JsonFromTextResponseFormat[T] | JsonObjectResponseFormat[T] | JsonSchemaResponseFormat[T],
+    ) -> CompletionResponse[T]:
         try:
             parsed_content = try_hard_to_json_loads(response)
         except json.JSONDecodeError:
@@ -129,3 +197,15 @@ class Model(abc.ABC, pydantic.BaseModel):
         ],
         response_format: JsonFromTextResponseFormat[T] | JsonObjectResponseFormat[T] | JsonSchemaResponseFormat[T],
     ) -> tuple[JsonDict, str]: ...
+
+    # Providers with asynchronous batch endpoints override these two methods (see 'batchable_providers')
+
+    async def submit_batch(self, requests: dict[str, BatchRequest[T]]) -> str:
+        raise NotImplementedError(f"Provider {self.__class__.__name__} does not support batches")
+
+    # Returns None while the batch is in progress.
+    # Requests missing from the returned dict were not processed (e.g. the batch expired) and should be resubmitted.
+    async def retrieve_batch(
+        self, batch_id: str, requests: dict[str, BatchRequest[T]]
+    ) -> dict[str, BatchResponse] | None:
+        raise NotImplementedError(f"Provider {self.__class__.__name__} does not support batches")
@@ -0,0 +1,268 @@
+# MALIN Platform https://malin.cahiersfantastiques.fr/
+# Copyright 2025 Vincent Jacques <vincent@vincent-jacques.net>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# A local stand-in for the OpenAI Files and Batches APIs, to exercise batch submission without network nor costs.
+# Point the OpenAI client at it with 'OPENAI_BASE_URL=http://localhost:<port>/v1' (see 'run-fake-openai-batch-server'),
+# or plug 'FakeOpenAiBatchServer.app' into an 'httpx.ASGITransport' in tests.
+# Requests are answered like 'DummyModel' answers them, based on the content of their last message.
+# Additionally, "Batch expired" makes the whole batch expire, leaving that request unprocessed.
+
+import email.message
+import email.policy
+import itertools
+import json
+import time
+import unittest
+import unittest.mock
+
+import fastapi
+import httpx
+import openai
+
+from ...any_json import JsonDict
+from .base import (
+    AssistantMessage,
+    BatchRequest,
+    InvalidJsonAssistantMessage,
+    JsonObjectResponseFormat,
+    JsonSchemaResponseFormat,
+    NotJsonAssistantMessage,
+    SystemMessage,
+    UserMessage,
+)
+from .dummy import DummyModel
+
+
+class FakeOpenAiBatchServer:
+    def __init__(self, *, polls_before_completion: int = 0) -> None:
+        self.polls_before_completion = polls_before_completion
+        self.ids = itertools.count(1)
+        self.files: dict[str, tuple[JsonDict, bytes]] = {}
+        self.batches: dict[str, tuple[JsonDict, int]] = {}
+
+        self.app = fastapi.FastAPI()
+        self.app.add_api_route("/v1/files", self.post_file, methods=["POST"])
+        self.app.add_api_route("/v1/files/{file_id}/content", self.get_file_content, methods=["GET"])
+        self.app.add_api_route("/v1/batches", self.post_batch, methods=["POST"])
+        self.app.add_api_route("/v1/batches/{batch_id}", self.get_batch, methods=["GET"])
+
+    async def post_file(self, request: fastapi.Request) -> JsonDict:
+        # Parse 'multipart/form-data' by hand: FastAPI's 'UploadFile' requires 'python-multipart'
+        message = email.message_from_bytes(
+            f"Content-Type: {request.headers['content-type']}\r\n\r\n".encode() + await request.body(),
+            policy=email.policy.HTTP,
+        )
+        assert isinstance(message, email.message.EmailMessage)
+        fields: dict[str, tuple[str | None, bytes]] = {}
+        for part in message.iter_parts():
+            assert isinstance(part, email.message.EmailMessage)
+            payload = part.get_payload(decode=True)
+            assert isinstance(payload, bytes)
+            fields[str(part.get_param("name", header="content-disposition"))] = (part.get_filename(), payload)
+        (filename, content) = fields["file"]
+        return self.add_file(filename or "file", fields["purpose"][1].decode(), content)
+
+    def add_file(self, filename: str, purpose: str, content: bytes) -> JsonDict:
+        file_object: JsonDict = dict(
+            id=f"file-{next(self.ids)}",
+            object="file",
+            bytes=len(content),
+            created_at=int(time.time()),
+            filename=filename,
+            purpose=purpose,
+            status="processed",
+        )
+        self.files[file_object["id"]] = (file_object, content)
+        return file_object
+
+    async def get_file_content(self, file_id: str) -> fastapi.Response:
+        if file_id not in self.files:
+            raise fastapi.HTTPException(status_code=404)
+        return fastapi.Response(content=self.files[file_id][1], media_type="application/octet-stream")
+
+    async def post_batch(self, request: fastapi.Request) -> JsonDict:
+        body = await request.json()
+        if body["input_file_id"] not in self.files:
+            raise fastapi.HTTPException(status_code=404)
+        batch: JsonDict = dict(
+            id=f"batch_{next(self.ids)}",
+            object="batch",
+            endpoint=body["endpoint"],
+            input_file_id=body["input_file_id"],
+            completion_window=body["completion_window"],
+            created_at=int(time.time()),
+            status="in_progress",
+            output_file_id=None,
+            error_file_id=None,
+            errors=None,
+        )
+        self.batches[batch["id"]] = (batch, self.polls_before_completion)
+        return batch
+
+    async def get_batch(self, batch_id: str) -> JsonDict:
+        if batch_id not in self.batches:
+            raise fastapi.HTTPException(status_code=404)
+        (batch, polls_before_completion) = self.batches[batch_id]
+        if batch["status"] == "in_progress":
+            if polls_before_completion > 0:
+                self.batches[batch_id] = (batch, polls_before_completion - 1)
+            else:
+                await self.process_batch(batch)
+        return batch
+
+    async def process_batch(self, batch: JsonDict) -> None:
+        from .. import adapted
+
+        model = DummyModel(provider="dummy", name="dummy-1")
+        status = "completed"
+        output_lines: list[str] = []
+        error_lines: list[str] = []
+        for line in self.files[batch["input_file_id"]][1].decode().splitlines():
+            request = json.loads(line)
+            messages: list[
+                SystemMessage
+                | UserMessage
+                | AssistantMessage[adapted.Exercise]
+                | InvalidJsonAssistantMessage
+                | NotJsonAssistantMessage
+            ] = [
+                (
+                    UserMessage(content=message["content"])
+                    if message["role"] == "user"
+                    else SystemMessage(content=message["content"])
+                )
+                for message in request["body"]["messages"]
+            ]
+            result: JsonDict = dict(id=f"batch_req_{next(self.ids)}", custom_id=request["custom_id"], error=None)
+            if messages[-1].content == "Batch expired":
+                status = "expired"
+                result["response"] = None
+                result["error"] = dict(code="batch_expired", message="This request could not be executed in time.")
+                error_lines.append(json.dumps(result) + "\n")
+                continue
+            try:
+                (_, content) = await model.do_complete(
+                    messages, JsonSchemaResponseFormat(response_type=adapted.Exercise)
+                )
+            except Exception as error:
+                result["response"] = dict(
+                    status_code=500,
+                    request_id=result["id"],
+                    body=dict(error=dict(message=str(error), type="server_error")),
+                )
+                error_lines.append(json.dumps(result) + "\n")
+            else:
+                result["response"] = dict(
+                    status_code=200,
+                    request_id=result["id"],
+                    body=dict(
+                        id=f"chatcmpl-{next(self.ids)}",
+                        object="chat.completion",
+                        created=int(time.time()),
+                        model=request["body"]["model"],
+                        choices=[
+                            dict(
+                                index=0,
+                                message=dict(role="assistant", content=content, refusal=None),
+                                finish_reason="stop",
+                                logprobs=None,
+                            )
+                        ],
+                    ),
+                )
+                output_lines.append(json.dumps(result) + "\n")
+
+        batch["status"] = status
+        if output_lines:
+            batch["output_file_id"] = self.add_file(
+                "batch_output.jsonl", "batch_output", "".join(output_lines).encode()
+            )["id"]
+        if error_lines:
+            batch["error_file_id"] = self.add_file("batch_errors.jsonl", "batch_output", "".join(error_lines).encode())[
+                "id"
+            ]
+
+    def make_client(self) -> openai.AsyncOpenAI:
+        return openai.AsyncOpenAI(
+            api_key="fake",
+            base_url="http://fake-openai/v1",
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app)),
+        )
+
+
+class FakeOpenAiBatchServerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_batch(self) -> None:
+        from .. import adapted
+        from . import openai as openai_model
+
+        server = FakeOpenAiBatchServer(polls_before_completion=1)
+        self.enterContext(unittest.mock.patch.object(openai_model, "client", server.make_client()))
+
+        model = openai_model.OpenAiModel(provider="openai", name="gpt-4o-2024-08-06")
+        response_format = JsonObjectResponseFormat(response_type=adapted.Exercise)
+        requests = {
+            custom_id: BatchRequest(
+                messages=[SystemMessage(content="Blah blah blah."), UserMessage(content=content)],
+                response_format=response_format,
+            )
+            for (custom_id, content) in [
+                ("success", "Adapt this exercise."),
+                ("not-json", "Not JSON"),
+                ("unknown-error", "Unknown error"),
+            ]
+        }
+
+        batch_id = await model.submit_batch(requests)
+        self.assertIsNone(await model.retrieve_batch(batch_id, requests))
+        responses = await model.retrieve_batch(batch_id, requests)
+        assert responses is not None
+        self.assertEqual(sorted(responses.keys()), ["not-json", "success", "unknown-error"])
+
+        self.assertEqual(responses["success"].raw_conversation["method"], "openai.AsyncOpenAI.batches.create")
+        self.assertEqual(responses["success"].raw_conversation["batch_id"], batch_id)
+        self.assertEqual(
+            responses["success"].raw_conversation["messages"],
+            [{"role": "developer", "content": "Blah blah blah."}, {"role": "user", "content": "Adapt this exercise."}],
+        )
+        self.assertEqual(responses["success"].raw_conversation["response_format"], {"type": "json_object"})
+        completion = model.complete_from_batch(responses["success"], response_format)
+        self.assertIsInstance(completion.message.content, adapted.Exercise)
+
+        self.assertEqual(responses["not-json"].response, "This is not JSON.")
+
+        self.assertIsNone(responses["unknown-error"].response)
+        self.assertEqual(responses["unknown-error"].raw_conversation["response"]["status_code"], 500)
+
+    async def test_expired_batch(self) -> None:
+        from .. import adapted
+        from . import openai as openai_model
+
+        server = FakeOpenAiBatchServer()
+        self.enterContext(unittest.mock.patch.object(openai_model, "client", server.make_client()))
+
+        model = openai_model.OpenAiModel(provider="openai", name="gpt-4o-2024-08-06")
+        requests = {
+            custom_id: BatchRequest(
+                messages=[UserMessage(content=content)],
+                response_format=JsonSchemaResponseFormat(response_type=adapted.Exercise),
+            )
+            for (custom_id, content) in [("processed", "Adapt this exercise."), ("expired", "Batch expired")]
+        }
+
+        batch_id = await model.submit_batch(requests)
+        responses = await model.retrieve_batch(batch_id, requests)
+        assert responses is not None
+        self.assertEqual(list(responses.keys()), ["processed"])
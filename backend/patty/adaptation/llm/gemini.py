@@ -24,6 +24,7 @@ import google.genai.errors
 import pydantic
 
 from ... import logs
+from ... import rate_limits
 from ... import settings
 from ...any_json import JsonDict
 from ...retry import RetryableError
@@ -77,7 +78,7 @@ class GeminiModel(Model):
             assert False
 
         try:
-            response = client.models.generate_content(
+            response = await client.aio.models.generate_content(
                 model=self.name,
                 contents=typing.cast(list[google.genai.types.ContentUnion], contents),
                 config=google.genai.types.GenerateContentConfig(
@@ -87,7 +88,7 @@ class GeminiModel(Model):
         except google.genai.errors.ClientError as e:
             if e.code == 429:
                 logs.log(f"Gemini rate limit exceeded {e}")
-                raise RetryableError()
+                raise RetryableError(retry_after=rate_limits.parse_google_retry_delay(e.details))
             else:
                 raise
         else:
@@ -21,8 +21,11 @@ import unittest
 import mistralai
 import pydantic
 
+from ... import logs
+from ... import rate_limits
 from ... import settings
 from ...any_json import JsonDict
+from ...retry import RetryableError
 from ...test_utils import costs_money
 from .base import (
     AssistantMessage,
@@ -65,7 +68,20 @@ class MistralAiModel(Model):
     ) -> tuple[JsonDict, str]:
         messages = list(self.__make_messages(messages_))
         response_format = self.__make_response_format(response_format_)
-        response = await client.chat.complete_async(model=self.name, messages=messages, response_format=response_format)
+        try:
+            response = await client.chat.complete_async(
+                model=self.name, messages=messages, response_format=response_format
+            )
+        except mistralai.models.SDKError as e:
+            if e.status_code == 429:
+                logs.log(f"MistralAI rate limit exceeded {e}")
+                raise RetryableError(
+                    retry_after=(
+                        None if e.raw_response is None else rate_limits.parse_retry_after(e.raw_response.headers)
+                    )
+                )
+            else:
+                raise
         raw_conversation = dict(
             method="mistralai.Mistral.chat.complete_async",
             messages=[m.model_dump() for m in messages],
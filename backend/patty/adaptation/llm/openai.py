@@ -23,11 +23,16 @@ import openai.types.chat
 import openai.types.shared_params
 import pydantic
 
+from ... import logs
+from ... import rate_limits
 from ... import settings
 from ...any_json import JsonDict
+from ...retry import RetryableError
 from ...test_utils import costs_money
 from .base import (
     AssistantMessage,
+    BatchRequest,
+    BatchResponse,
     InvalidJsonAssistantMessage,
     JsonFromTextResponseFormat,
     JsonObjectResponseFormat,
@@ -65,10 +70,14 @@ class OpenAiModel(Model):
         response_format: JsonFromTextResponseFormat[T] | JsonObjectResponseFormat[T] | JsonSchemaResponseFormat[T],
     ) -> tuple[JsonDict, str]:
         messages = list(self.__make_messages(messages_))
-        if isinstance(response_format, JsonSchemaResponseFormat):
-            return await self.__do_complete__json_schema(messages, response_format.response_type)
-        else:
-            return await self.__do_complete__generic(messages, response_format)
+        try:
+            if isinstance(response_format, JsonSchemaResponseFormat):
+                return await self.__do_complete__json_schema(messages, response_format.response_type)
+            else:
+                return await self.__do_complete__generic(messages, response_format)
+        except openai.RateLimitError as e:
+            logs.log(f"OpenAI rate limit exceeded {e}")
+            raise RetryableError(retry_after=rate_limits.parse_retry_after(e.response.headers))
 
     async def __do_complete__json_schema(
         self, messages: list[openai.types.chat.ChatCompletionMessageParam], response_format: type[T]
@@ -113,6 +122,100 @@ class OpenAiModel(Model):
         assert isinstance(response.choices[0].message.content, str)
         return (raw_conversation, response.choices[0].message.content)
 
+    async def submit_batch(self, requests: dict[str, BatchRequest[T]]) -> str:
+        lines = []
+        for custom_id, request in requests.items():
+            body = dict(
+                model=self.name,
+                messages=list(self.__make_messages(request.messages)),
+                response_format=self.__make_batch_response_format(request.response_format),
+            )
+            lines.append(
+                json.dumps(dict(custom_id=custom_id, method="POST", url="/v1/chat/completions", body=body)) + "\n"
+            )
+        input_file = await client.files.create(file=("batch.jsonl", "".join(lines).encode()), purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+        )
+        return batch.id
+
+    async def retrieve_batch(
+        self, batch_id: str, requests: dict[str, BatchRequest[T]]
+    ) -> dict[str, BatchResponse] | None:
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status not in ("completed", "expired", "cancelled", "failed"):
+            return None
+
+        responses: dict[str, BatchResponse] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            content = await client.files.content(file_id)
+            for line in content.text.splitlines():
+                result = json.loads(line)
+                request = requests.get(result["custom_id"])
+                if request is None:
+                    continue
+                error = result.get("error")
+                if error is not None and error.get("code") == "batch_expired":
+                    # Not processed: leave it out so that it's resubmitted
+                    continue
+                raw_conversation = self.__make_batch_raw_conversation(batch_id, request)
+                if error is None and result["response"]["status_code"] == 200:
+                    raw_conversation["response"] = result["response"]["body"]
+                    message_content = result["response"]["body"]["choices"][0]["message"]["content"]
+                    assert isinstance(message_content, str)
+                    responses[result["custom_id"]] = BatchResponse(
+                        raw_conversation=raw_conversation, response=message_content
+                    )
+                else:
+                    raw_conversation["response"] = result["response"]
+                    raw_conversation["error"] = error
+                    responses[result["custom_id"]] = BatchResponse(raw_conversation=raw_conversation, response=None)
+
+        if batch.status == "failed":
+            # The whole input file was rejected: resubmitting it as is would fail again
+            for custom_id, request in requests.items():
+                if custom_id not in responses:
+                    raw_conversation = self.__make_batch_raw_conversation(batch_id, request)
+                    raw_conversation["error"] = None if batch.errors is None else batch.errors.model_dump()
+                    responses[custom_id] = BatchResponse(raw_conversation=raw_conversation, response=None)
+
+        return responses
+
+    def __make_batch_raw_conversation(self, batch_id: str, request: BatchRequest[T]) -> JsonDict:
+        response_format = request.response_format
+        return dict(
+            method="openai.AsyncOpenAI.batches.create",
+            batch_id=batch_id,
+            messages=list(self.__make_messages(request.messages)),
+            response_format=(
+                dict(
+                    kind="type",
+                    name=response_format.response_type.__name__,
+                    schema=make_schema(response_format.response_type),
+                )
+                if isinstance(response_format, JsonSchemaResponseFormat)
+                else self.__make_response_format(response_format)
+            ),
+        )
+
+    def __make_batch_response_format(
+        self, response_format: JsonFromTextResponseFormat[T] | JsonObjectResponseFormat[T] | JsonSchemaResponseFormat[T]
+    ) -> openai.types.chat.completion_create_params.ResponseFormat:
+        if isinstance(response_format, JsonSchemaResponseFormat):
+            # Batches cannot go through 'client.beta.chat.completions.parse': send the strict JSON schema it would send
+            return openai.types.shared_params.response_format_json_schema.ResponseFormatJSONSchema(
+                type="json_schema",
+                json_schema=openai.types.shared_params.response_format_json_schema.JSONSchema(
+                    schema=make_schema(response_format.response_type),
+                    name=response_format.response_type.__name__,
+                    strict=True,
+                ),
+            )
+        else:
+            return self.__make_response_format(response_format)
+
     def __make_messages(
         self,
         messages: Iterable[
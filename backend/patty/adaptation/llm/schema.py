@@ -14,9 +14,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import copy
+import threading
 import typing
+import unittest
 
-import openai.lib._parsing._completions
+import cachetools
 import pydantic
 
 from ...any_json import JsonDict
@@ -26,7 +29,95 @@ CustomPydanticModel = typing.TypeVar("CustomPydanticModel", bound=pydantic.BaseM
 
 
 def make_schema(model: type[CustomPydanticModel]) -> JsonDict:
-    response_format_param = openai.lib._parsing._completions.type_to_response_format_param(model)
-    assert isinstance(response_format_param, dict)
-    assert response_format_param["type"] == "json_schema"
-    return response_format_param["json_schema"]["schema"]
+    # Copy because callers may modify the schema they get
+    return copy.deepcopy(make_cached_schema(model))
+
+
+@cachetools.cached(cache=cachetools.LRUCache[type[pydantic.BaseModel], JsonDict](maxsize=64), lock=threading.Lock())
+def make_cached_schema(model: type[pydantic.BaseModel]) -> JsonDict:
+    schema = model.model_json_schema()
+    return make_strict(schema, root=schema)
+
+
+def make_strict(schema: JsonDict, *, root: JsonDict) -> JsonDict:
+    # Structured outputs require closed objects whose properties are all required, and no '$ref' with siblings.
+    # This is the conversion the OpenAI SDK applies to the types it's given as 'response_format',
+    # re-implemented here because the SDK only exposes it privately.
+    for definitions_key in ["$defs", "definitions"]:
+        for definition in schema.get(definitions_key, {}).values():
+            make_strict(definition, root=root)
+
+    if schema.get("type") == "object" and "additionalProperties" not in schema:
+        schema["additionalProperties"] = False
+
+    properties = schema.get("properties")
+    if isinstance(properties, dict):
+        schema["required"] = list(properties.keys())
+        schema["properties"] = {key: make_strict(value, root=root) for (key, value) in properties.items()}
+
+    items = schema.get("items")
+    if isinstance(items, dict):
+        schema["items"] = make_strict(items, root=root)
+
+    any_of = schema.get("anyOf")
+    if isinstance(any_of, list):
+        schema["anyOf"] = [make_strict(variant, root=root) for variant in any_of]
+
+    all_of = schema.get("allOf")
+    if isinstance(all_of, list):
+        if len(all_of) == 1:
+            schema.update(make_strict(all_of[0], root=root))
+            schema.pop("allOf")
+        else:
+            schema["allOf"] = [make_strict(entry, root=root) for entry in all_of]
+
+    # Fields are nullable anyway
+    if "default" in schema and schema["default"] is None:
+        schema.pop("default")
+
+    ref = schema.get("$ref")
+    if ref is not None and len(schema) > 1:
+        assert isinstance(ref, str) and ref.startswith("#/"), ref
+        resolved: JsonDict = root
+        for key in ref[2:].split("/"):
+            resolved = resolved[key]
+        # Keys next to the '$ref' take precedence over the referenced ones
+        schema.update({**resolved, **schema})
+        schema.pop("$ref")
+        return make_strict(schema, root=root)
+
+    return schema
+
+
+class MakeSchemaTestCase(unittest.TestCase):
+    def test_strict(self) -> None:
+        class Inner(pydantic.BaseModel):
+            text: str
+
+        class Outer(pydantic.BaseModel):
+            inner: Inner = pydantic.Field(description="Some inner")
+            inners: list[Inner]
+            maybe: int | None = None
+
+        inner_schema = {
+            "properties": {"text": {"title": "Text", "type": "string"}},
+            "required": ["text"],
+            "title": "Inner",
+            "type": "object",
+            "additionalProperties": False,
+        }
+        self.assertEqual(
+            make_schema(Outer),
+            {
+                "$defs": {"Inner": inner_schema},
+                "properties": {
+                    "inner": {"description": "Some inner", **inner_schema},
+                    "inners": {"items": {"$ref": "#/$defs/Inner"}, "title": "Inners", "type": "array"},
+                    "maybe": {"anyOf": [{"type": "integer"}, {"type": "null"}], "title": "Maybe"},
+                },
+                "required": ["inner", "inners", "maybe"],
+                "title": "Outer",
+                "type": "object",
+                "additionalProperties": False,
+            },
+        )
@@ -26,8 +26,8 @@ from . import adapted
 from . import assistant_responses
 from . import llm
 from . import strategy
-from ..any_json import JsonDict, JsonList
-from ..database_utils import CreatedByUserMixin, OrmBase, OrderBy, annotate_new_tables
+from ..any_json import JsonDict, JsonList, JsonType
+from ..database_utils import CreatedByUserMixin, OrmBase, OrderBy, ParsedJsonCacheMixin, annotate_new_tables
 from ..exercises import Exercise, ExerciseCreation, ExerciseLocation
 from ..logs import TimingData
 
@@ -58,10 +58,20 @@ class AdaptableExercise(Exercise):
     instruction_hint_example_text: orm.Mapped[str | None]
     statement_text: orm.Mapped[str | None]
 
-    unordered_adaptations: orm.Mapped[list[Adaptation]] = orm.relationship(back_populates="exercise")
+    unordered_adaptations: orm.Mapped[list[Adaptation]] = orm.relationship(
+        foreign_keys=lambda: [Adaptation.exercise_id], back_populates="exercise"
+    )
 
-    @property
-    def latest_adaptation(self) -> Adaptation | None:
+    # Denormalized from 'unordered_adaptations' and 'ordered_classifications' by 'update_latest_adaptations',
+    # so that lists and exports can load it directly instead of scanning all adaptations of each exercise
+    latest_adaptation_id: orm.Mapped[int | None] = orm.mapped_column(
+        sql.ForeignKey("adaptations.id", use_alter=True), index=True
+    )
+    latest_adaptation: orm.Mapped[Adaptation | None] = orm.relationship(
+        foreign_keys=[latest_adaptation_id], remote_side=lambda: [Adaptation.id], post_update=True
+    )
+
+    def find_latest_adaptation(self) -> Adaptation | None:
         if self.latest_classification is None:
             matching_adaptations = self.unordered_adaptations
         else:
@@ -164,8 +174,12 @@ class AdaptationSettings(OrmBase, CreatedByUserMixin):
         self._response_specification = value.model_dump()
 
 
-class Adaptation(OrmBase):
+class Adaptation(OrmBase, ParsedJsonCacheMixin):
     __tablename__ = "adaptations"
+    __table_args__ = (
+        # For the submission daemon to find pending adaptations in FIFO order
+        sql.Index("ix_adaptations__pending", "id", postgresql_where=sql.text("initial_assistant_response IS NULL")),
+    )
 
     def __init__(
         self,
@@ -187,10 +201,12 @@ class Adaptation(OrmBase):
         self.exercise = exercise
         self.model = model
         self.settings = settings
-        self.raw_llm_conversations = raw_llm_conversations
+        for ordinal, conversation in enumerate(raw_llm_conversations):
+            AdaptationLlmConversation(adaptation=self, ordinal=ordinal, conversation=conversation)
         self.initial_assistant_response = initial_assistant_response
         self.initial_timing = initial_timing
-        self.adjustments = adjustments
+        for ordinal, adjustment in enumerate(adjustments):
+            AdaptationAdjustment(adaptation=self, ordinal=ordinal, adjustment=adjustment)
         self.manual_edit = manual_edit
         self.approved_by = approved_by
         self.approved_at = approved_at
@@ -213,13 +229,34 @@ class Adaptation(OrmBase):
 
     @property
     def model(self) -> llm.ConcreteModel:
-        return llm.validate(self._model)
+        return self.get_parsed_json("model", lambda: llm.validate(self._model))
 
     @model.setter
     def model(self, value: llm.ConcreteModel) -> None:
+        self.forget_parsed_json("model")
         self._model = value.model_dump()
 
-    raw_llm_conversations: orm.Mapped[JsonList] = orm.mapped_column(sql.JSON)
+    # Raw conversations are large and only displayed on the adaptation's own page, so they live in a side table.
+    # Like adjustments, they are appended and popped one row at a time, without loading the previous ones.
+    llm_conversations: orm.Mapped[list[AdaptationLlmConversation]] = orm.relationship(
+        back_populates="adaptation", order_by=lambda: AdaptationLlmConversation.ordinal, cascade="all, delete-orphan"
+    )
+
+    @property
+    def raw_llm_conversations(self) -> JsonList:
+        return [llm_conversation.conversation for llm_conversation in self.llm_conversations]
+
+    def append_raw_llm_conversation(self, conversation: JsonType) -> None:
+        self.__add_row(
+            AdaptationLlmConversation(
+                adaptation=self,
+                ordinal=self.__next_ordinal(AdaptationLlmConversation, "llm_conversations"),
+                conversation=conversation,
+            )
+        )
+
+    def pop_raw_llm_conversation(self) -> None:
+        self.__pop_last(AdaptationLlmConversation, "llm_conversations")
 
     _initial_assistant_response: orm.Mapped[JsonDict | None] = orm.mapped_column("initial_assistant_response", sql.JSON)
 
@@ -228,10 +265,13 @@ class Adaptation(OrmBase):
         if self._initial_assistant_response is None:
             return None
         else:
-            return assistant_responses.validate(self._initial_assistant_response)
+            return self.get_parsed_json(
+                "initial_assistant_response", lambda: assistant_responses.validate(self._initial_assistant_response)
+            )
 
     @initial_assistant_response.setter
     def initial_assistant_response(self, value: assistant_responses.Response | None) -> None:
+        self.forget_parsed_json("initial_assistant_response")
         if value is None:
             self._initial_assistant_response = sql.null()
         else:
@@ -253,27 +293,76 @@ class Adaptation(OrmBase):
         else:
             self._initial_timing = value.model_dump()
 
-    _adjustments: orm.Mapped[JsonList] = orm.mapped_column("adjustments", sql.JSON)
+    # Set when the submission daemon sends the adaptation in a provider batch (see 'run-submission-daemon --adaptation-batches')
+    llm_batch_id: orm.Mapped[int | None] = orm.mapped_column(
+        sql.ForeignKey("adaptation_llm_batches.id"), index=True, default=None
+    )
+    llm_batch: orm.Mapped[AdaptationLlmBatch | None] = orm.relationship(
+        foreign_keys=[llm_batch_id], back_populates="adaptations"
+    )
+
+    ordered_adjustments: orm.Mapped[list[AdaptationAdjustment]] = orm.relationship(
+        back_populates="adaptation", order_by=lambda: AdaptationAdjustment.ordinal, cascade="all, delete-orphan"
+    )
 
     @property
     def adjustments(self) -> list[assistant_responses.Adjustment]:
-        return [assistant_responses.Adjustment.model_validate(adjustment) for adjustment in self._adjustments]
-
-    @adjustments.setter
-    def adjustments(self, value: list[assistant_responses.Adjustment]) -> None:
-        self._adjustments = [adjustment.model_dump() for adjustment in value]
-
-    _manual_edit: orm.Mapped[JsonDict | None] = orm.mapped_column("manual_edit", sql.JSON)
+        return [adjustment.adjustment for adjustment in self.ordered_adjustments]
+
+    def append_adjustment(self, adjustment: assistant_responses.Adjustment) -> None:
+        self.__add_row(
+            AdaptationAdjustment(
+                adaptation=self,
+                ordinal=self.__next_ordinal(AdaptationAdjustment, "ordered_adjustments"),
+                adjustment=adjustment,
+            )
+        )
+
+    def pop_adjustment(self) -> None:
+        self.__pop_last(AdaptationAdjustment, "ordered_adjustments")
+
+    def __next_ordinal(self, model: type[AdaptationLlmConversation | AdaptationAdjustment], collection: str) -> int:
+        session = orm.object_session(self)
+        if session is None or not sql.inspect(self).persistent:
+            # Not persisted yet, so the collection is complete in memory
+            return len(getattr(self, collection))
+        else:
+            return session.execute(
+                sql.select(sql.func.coalesce(sql.func.max(model.ordinal) + 1, 0)).where(model.adaptation_id == self.id)
+            ).scalar_one()
+
+    def __add_row(self, row: AdaptationLlmConversation | AdaptationAdjustment) -> None:
+        session = orm.object_session(self)
+        if session is not None:
+            # The backref only cascades the row into the session when the collection is loaded
+            session.add(row)
+
+    def __pop_last(self, model: type[AdaptationLlmConversation | AdaptationAdjustment], collection: str) -> None:
+        session = orm.object_session(self)
+        assert session is not None
+        session.delete(
+            session.execute(
+                sql.select(model).where(model.adaptation_id == self.id).order_by(model.ordinal.desc()).limit(1)
+            ).scalar_one()
+        )
+        # If it was loaded, the collection still contains the deleted row
+        session.expire(self, [collection])
+
+    # Manual edits are loaded on first access, or eagerly with 'orm.undefer_group("edits")'
+    _manual_edit: orm.Mapped[JsonDict | None] = orm.mapped_column(
+        "manual_edit", sql.JSON, deferred=True, deferred_group="edits"
+    )
 
     @property
     def manual_edit(self) -> adapted.Exercise | None:
         if self._manual_edit is None:
             return None
         else:
-            return adapted.Exercise.model_validate(self._manual_edit)
+            return self.get_parsed_json("manual_edit", lambda: adapted.Exercise.model_validate(self._manual_edit))
 
     @manual_edit.setter
     def manual_edit(self, value: adapted.Exercise | None) -> None:
+        self.forget_parsed_json("manual_edit")
         if value is None:
             self._manual_edit = sql.null()
         else:
@@ -283,6 +372,91 @@ class Adaptation(OrmBase):
     approved_at: orm.Mapped[datetime.datetime | None] = orm.mapped_column(sql.DateTime(timezone=True))
 
 
+class AdaptationLlmConversation(OrmBase):
+    __tablename__ = "adaptation_llm_conversations"
+
+    def __init__(self, *, adaptation: Adaptation, ordinal: int, conversation: JsonType) -> None:
+        super().__init__()
+        self.adaptation = adaptation
+        self.ordinal = ordinal
+        self.conversation = conversation
+
+    adaptation_id: orm.Mapped[int] = orm.mapped_column(sql.ForeignKey(Adaptation.id), primary_key=True)
+    adaptation: orm.Mapped[Adaptation] = orm.relationship(
+        foreign_keys=[adaptation_id], remote_side=[Adaptation.id], back_populates="llm_conversations"
+    )
+
+    ordinal: orm.Mapped[int] = orm.mapped_column(primary_key=True)
+
+    conversation: orm.Mapped[JsonType] = orm.mapped_column(sql.JSON)
+
+
+class AdaptationAdjustment(OrmBase, ParsedJsonCacheMixin):
+    __tablename__ = "adaptation_adjustments"
+
+    def __init__(self, *, adaptation: Adaptation, ordinal: int, adjustment: assistant_responses.Adjustment) -> None:
+        super().__init__()
+        self.adaptation = adaptation
+        self.ordinal = ordinal
+        self.adjustment = adjustment
+
+    adaptation_id: orm.Mapped[int] = orm.mapped_column(sql.ForeignKey(Adaptation.id), primary_key=True)
+    adaptation: orm.Mapped[Adaptation] = orm.relationship(
+        foreign_keys=[adaptation_id], remote_side=[Adaptation.id], back_populates="ordered_adjustments"
+    )
+
+    ordinal: orm.Mapped[int] = orm.mapped_column(primary_key=True)
+
+    _adjustment: orm.Mapped[JsonDict] = orm.mapped_column("adjustment", sql.JSON)
+
+    @property
+    def adjustment(self) -> assistant_responses.Adjustment:
+        return self.get_parsed_json(
+            "adjustment", lambda: assistant_responses.Adjustment.model_validate(self._adjustment)
+        )
+
+    @adjustment.setter
+    def adjustment(self, value: assistant_responses.Adjustment) -> None:
+        self.forget_parsed_json("adjustment")
+        self._adjustment = value.model_dump()
+
+
+class AdaptationLlmBatch(OrmBase, ParsedJsonCacheMixin):
+    __tablename__ = "adaptation_llm_batches"
+
+    def __init__(self, *, model: llm.ConcreteModel, remote_id: str, submitted_at: datetime.datetime) -> None:
+        super().__init__()
+        self.model = model
+        self.remote_id = remote_id
+        self.submitted_at = submitted_at
+        self.polled_at = None
+        self.finished_at = None
+
+    id: orm.Mapped[int] = orm.mapped_column(primary_key=True, autoincrement=True)
+
+    _model: orm.Mapped[JsonDict] = orm.mapped_column("model", sql.JSON)
+
+    @property
+    def model(self) -> llm.ConcreteModel:
+        return self.get_parsed_json("model", lambda: llm.validate(self._model))
+
+    @model.setter
+    def model(self, value: llm.ConcreteModel) -> None:
+        self.forget_parsed_json("model")
+        self._model = value.model_dump()
+
+    # Identifier of the batch at the provider
+    remote_id: orm.Mapped[str]
+
+    submitted_at: orm.Mapped[datetime.datetime] = orm.mapped_column(sql.DateTime(timezone=True))
+    polled_at: orm.Mapped[datetime.datetime | None] = orm.mapped_column(sql.DateTime(timezone=True))
+    finished_at: orm.Mapped[datetime.datetime | None] = orm.mapped_column(sql.DateTime(timezone=True))
+
+    adaptations: orm.Mapped[list[Adaptation]] = orm.relationship(
+        foreign_keys=[Adaptation.llm_batch_id], back_populates="llm_batch", order_by=Adaptation.id
+    )
+
+
 class AdaptationCreation(OrmBase):
     __tablename__ = "adaptation_creations"
     __mapper_args__ = {"polymorphic_on": "kind"}
@@ -300,4 +474,23 @@ class AdaptationCreation(OrmBase):
     )
 
 
+@sql.event.listens_for(orm.Session, "before_flush")
+def update_latest_adaptations(session: orm.Session, flush_context: orm.UOWTransaction, instances: object) -> None:
+    from ..classification import Classification
+
+    exercises: set[AdaptableExercise] = set()
+    for instance in session.new:
+        if isinstance(instance, (Adaptation, Classification)):
+            exercises.add(instance.exercise)
+    for instance in session.dirty:
+        # The classification daemon sets the exercise class of existing classifications
+        if isinstance(instance, Classification) and sql.inspect(instance).attrs.exercise_class.history.has_changes():
+            exercises.add(instance.exercise)
+
+    for exercise in exercises:
+        latest_adaptation = exercise.find_latest_adaptation()
+        if exercise.latest_adaptation is not latest_adaptation:
+            exercise.latest_adaptation = latest_adaptation
+
+
 annotate_new_tables("adaptation")
@@ -14,10 +14,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import datetime
 import json
+import time
 import traceback
 import typing
+import unittest.mock
 
+from sqlalchemy import orm
 import sqlalchemy as sql
 
 from . import assistant_responses
@@ -25,7 +30,9 @@ from . import llm
 from . import orm_models as db
 from .. import database_utils
 from .. import logs
+from .. import rate_limits
 from ..any_json import JsonList
+from ..logs import TimingData
 from ..retry import RetryableError
 from .adapted import Exercise
 
@@ -40,35 +47,61 @@ LlmMessage = (
 
 
 def submit_next_adaptation(
-    can_retry: bool, session: database_utils.Session
+    max_retries: int, session: database_utils.Session, *, leave_batchable: bool = False
 ) -> typing.Coroutine[None, None, None] | None:
+    query = (
+        sql.select(db.Adaptation)
+        .where(db.Adaptation._initial_assistant_response == sql.null())
+        .where(db.Adaptation.llm_batch_id == sql.null())
+    )
+    if leave_batchable:
+        # Left for 'submit_next_adaptation_llm_batch'
+        query = query.where(db.Adaptation._model["provider"].as_string().not_in(llm.batchable_providers))
+    throttled_models = rate_limits.limiter.throttled_models()
+    if len(throttled_models) > 0:
+        # Keep other models busy meanwhile
+        query = query.where(
+            sql.tuple_(db.Adaptation._model["provider"].as_string(), db.Adaptation._model["name"].as_string()).not_in(
+                throttled_models
+            )
+        )
     adaptation = (
-        session.execute(sql.select(db.Adaptation).where(db.Adaptation._initial_assistant_response == sql.null()))
-        .scalars()
-        .first()
+        session.execute(query.order_by(db.Adaptation.id).limit(1).with_for_update(skip_locked=True)).scalars().first()
     )
 
     if adaptation is None:
         return None
     else:
         logs.log(f"Found pending adaptation: {adaptation.id}")
+        model = adaptation.model
+        can_retry = rate_limits.limiter.consecutive_throttles(model.provider, model.name) < max_retries
         return submit_adaptation(can_retry, adaptation)
 
 
-async def submit_adaptation(can_retry: bool, adaptation: db.Adaptation) -> None:
-    response_format = adaptation.settings.response_specification.make_response_format()
-
-    messages: list[LlmMessage] = [
+def make_messages(adaptation: db.Adaptation) -> list[LlmMessage]:
+    return [
         llm.SystemMessage(content=adaptation.settings.system_prompt),
         llm.UserMessage(content=adaptation.exercise.full_text),
     ]
 
+
+# With a 'batch_response', the adaptation was already submitted in a provider batch: only record its outcome
+async def submit_adaptation(
+    can_retry: bool, adaptation: db.Adaptation, *, batch_response: llm.BatchResponse | None = None
+) -> None:
+    response_format = adaptation.settings.response_specification.make_response_format()
+
+    messages = make_messages(adaptation)
+
     # All branches must set 'adaptation.initial_assistant_response' to avoid infinite loop
     # (re-submitting failing adaptation again and again)
     try:
-        logs.log(f"Submitting adaptation {adaptation.id}")
         with logs.timer() as timing:
-            response = await adaptation.model.complete(messages, response_format)
+            if batch_response is None:
+                logs.log(f"Submitting adaptation {adaptation.id}")
+                response = await adaptation.model.complete(messages, response_format)
+            else:
+                response = adaptation.model.complete_from_batch(batch_response, response_format)
     except llm.InvalidJsonLlmException as error:
         logs.log(f"Error 'invalid JSON' on adaptation {adaptation.id} in {timing.elapsed:.1f} seconds")
         raw_llm_conversations: JsonList = [error.raw_conversation]
@@ -79,6 +112,10 @@ async def submit_adaptation(can_retry: bool, adaptation: db.Adaptation) -> None:
         logs.log(f"Error 'not JSON' on adaptation {adaptation.id} in {timing.elapsed:.1f} seconds")
         raw_llm_conversations = [error.raw_conversation]
         initial_assistant_response = assistant_responses.NotJsonError(kind="error", error="not-json", text=error.text)
+    except llm.FailedBatchRequestLlmException as error:
+        logs.log(f"Error 'failed batch request' on adaptation {adaptation.id}")
+        raw_llm_conversations = [error.raw_conversation]
+        initial_assistant_response = assistant_responses.UnknownError(kind="error", error="unknown")
     except RetryableError:
         if can_retry:
             logs.log(f"RETRYABLE ERROR on adaptation {adaptation.id} in {timing.elapsed:.1f} seconds")
@@ -98,12 +135,252 @@ async def submit_adaptation(can_retry: bool, adaptation: db.Adaptation) -> None:
         initial_assistant_response = assistant_responses.Success(
             kind="success", exercise=Exercise.model_validate(response.message.content.model_dump())
         )
-    finally:
-        try:
-            json.dumps(raw_llm_conversations)
-        except TypeError:
-            logs.log(f"Raw conversation not JSON-serializable: {raw_llm_conversations}")
-            raw_llm_conversations = ["Error: conversation not JSON-serializable"]
-        adaptation.raw_llm_conversations = raw_llm_conversations
-        adaptation.initial_assistant_response = initial_assistant_response
-        adaptation.initial_timing = timing
+
+    # Not in a 'finally' clause: a re-raised 'RetryableError' leaves the adaptation pending
+    try:
+        json.dumps(raw_llm_conversations)
+    except TypeError:
+        logs.log(f"Raw conversation not JSON-serializable: {raw_llm_conversations}")
+        raw_llm_conversations = ["Error: conversation not JSON-serializable"]
+    for raw_llm_conversation in raw_llm_conversations:
+        adaptation.append_raw_llm_conversation(raw_llm_conversation)
+    adaptation.initial_assistant_response = initial_assistant_response
+    adaptation.initial_timing = timing
+
+
+def submit_next_adaptation_llm_batch(
+    session: database_utils.Session, max_size: int
+) -> typing.Coroutine[None, None, None] | None:
+    adaptations = list(
+        session.execute(
+            sql.select(db.Adaptation)
+            .where(db.Adaptation._initial_assistant_response == sql.null())
+            .where(db.Adaptation.llm_batch_id == sql.null())
+            .where(db.Adaptation._model["provider"].as_string().in_(llm.batchable_providers))
+            .order_by(db.Adaptation.id)
+            .limit(max_size)
+            .options(orm.selectinload(db.Adaptation.settings), orm.selectinload(db.Adaptation.exercise))
+            .with_for_update(skip_locked=True)
+        ).scalars()
+    )
+
+    if len(adaptations) == 0:
+        return None
+    else:
+        # A batch targets a single model; others are left for the next batch
+        model = adaptations[0].model
+        adaptations = [adaptation for adaptation in adaptations if adaptation.model == model]
+        logs.log(f"Found {len(adaptations)} pending adaptations for a batch on {model.provider} {model.name}")
+        return submit_adaptation_llm_batch(model, adaptations)
+
+
+async def submit_adaptation_llm_batch(model: llm.ConcreteModel, adaptations: list[db.Adaptation]) -> None:
+    remote_id = await model.submit_batch(make_batch_requests(adaptations))
+    logs.log(f"Submitted batch {remote_id} with {len(adaptations)} adaptations")
+    llm_batch = db.AdaptationLlmBatch(
+        model=model, remote_id=remote_id, submitted_at=datetime.datetime.now(datetime.timezone.utc)
+    )
+    for adaptation in adaptations:
+        adaptation.llm_batch = llm_batch
+
+
+def poll_next_adaptation_llm_batch(
+    session: database_utils.Session, poll_interval: datetime.timedelta
+) -> typing.Coroutine[None, None, None] | None:
+    llm_batch = (
+        session.execute(
+            sql.select(db.AdaptationLlmBatch)
+            .where(db.AdaptationLlmBatch.finished_at == sql.null())
+            .where(
+                sql.or_(
+                    db.AdaptationLlmBatch.polled_at == sql.null(),
+                    db.AdaptationLlmBatch.polled_at < datetime.datetime.now(datetime.timezone.utc) - poll_interval,
+                )
+            )
+            .order_by(db.AdaptationLlmBatch.polled_at.asc().nulls_first(), db.AdaptationLlmBatch.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        .scalars()
+        .first()
+    )
+
+    if llm_batch is None:
+        return None
+    else:
+        return poll_adaptation_llm_batch(llm_batch)
+
+
+async def poll_adaptation_llm_batch(llm_batch: db.AdaptationLlmBatch) -> None:
+    adaptations = list(llm_batch.adaptations)
+    logs.log(f"Polling batch {llm_batch.remote_id}")
+    responses = await llm_batch.model.retrieve_batch(llm_batch.remote_id, make_batch_requests(adaptations))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    llm_batch.polled_at = now
+    if responses is None:
+        logs.log(f"Batch {llm_batch.remote_id} is still in progress")
+    else:
+        logs.log(f"Batch {llm_batch.remote_id} is finished")
+        llm_batch.finished_at = now
+        for adaptation in adaptations:
+            batch_response = responses.get(make_batch_request_id(adaptation))
+            if batch_response is None:
+                logs.log(
+                    f"Adaptation {adaptation.id} was not processed in batch {llm_batch.remote_id}: resubmitting it"
+                )
+                adaptation.llm_batch = None
+            else:
+                await submit_adaptation(False, adaptation, batch_response=batch_response)
+                # Time spent waiting for the batch, rather than for parsing its response
+                adaptation.initial_timing = TimingData(start=llm_batch.submitted_at.timestamp(), end=now.timestamp())
+
+
+def make_batch_requests(adaptations: list[db.Adaptation]) -> dict[str, llm.BatchRequest[Exercise]]:
+    return {
+        make_batch_request_id(adaptation): llm.BatchRequest(
+            messages=make_messages(adaptation),
+            response_format=adaptation.settings.response_specification.make_response_format(),
+        )
+        for adaptation in adaptations
+    }
+
+
+def make_batch_request_id(adaptation: db.Adaptation) -> str:
+    return f"adaptation-{adaptation.id}"
+
+
+class PendingAdaptationsTestCase(database_utils.TestCaseWithDatabase):
+    def setUp(self) -> None:
+        from .. import fixtures
+
+        super().setUp()
+        self.settings = fixtures.FixturesCreator(self.session).make_dummy_adaptation_strategy_settings()
+
+    def make_adaptation(self, model: llm.ConcreteModel, full_text: str) -> db.Adaptation:
+        from .. import exercises
+        from .. import fixtures
+        from .. import sandbox
+
+        return self.add_model(
+            db.Adaptation,
+            created=sandbox.adaptation.AdaptationCreationBySandboxBatch(
+                at=fixtures.created_at,
+                sandbox_adaptation_batch=sandbox.adaptation.SandboxAdaptationBatch(
+                    created_by="Patty", created_at=fixtures.created_at, settings=self.settings, model=model
+                ),
+            ),
+            exercise=db.AdaptableExercise(
+                created=exercises.ExerciseCreationByUser(at=fixtures.created_at, username="Patty"),
+                location=exercises.ExerciseLocationMaybePageAndNumber(page_number=None, exercise_number=None),
+                full_text=full_text,
+                instruction_hint_example_text=None,
+                statement_text=None,
+            ),
+            model=model,
+            settings=self.settings,
+            raw_llm_conversations=[],
+            initial_assistant_response=None,
+            initial_timing=None,
+            adjustments=[],
+            manual_edit=None,
+            approved_by=None,
+            approved_at=None,
+        )
+
+
+class ThrottledModelsTestCase(PendingAdaptationsTestCase):
+    def test_throttled_models_are_left_aside(self) -> None:
+        limiter = rate_limits.RateLimiter({})
+        self.enterContext(unittest.mock.patch.object(rate_limits, "limiter", limiter))
+
+        throttled = self.make_adaptation(llm.DummyModel(provider="dummy", name="dummy-1"), "Retryable error")
+        available = self.make_adaptation(llm.DummyModel(provider="dummy", name="dummy-2"), "Blah.")
+        self.session.commit()
+
+        task = submit_next_adaptation(2, self.session)
+        assert task is not None
+        with self.assertRaises(RetryableError):
+            asyncio.run(task)
+        self.session.rollback()
+        self.assertEqual(limiter.throttled_models(), [("dummy", "dummy-1")])
+
+        task = submit_next_adaptation(2, self.session)
+        assert task is not None
+        asyncio.run(task)
+        self.session.commit()
+        self.assertIsInstance(available.initial_assistant_response, assistant_responses.Success)
+        self.assertIsNone(throttled.initial_assistant_response)
+        self.assertIsNone(submit_next_adaptation(2, self.session))
+
+        # Out of retries for this model (one throttling, and a single retry allowed): the adaptation is marked as failed
+        seconds_until_unthrottled = limiter.seconds_until_unthrottled()
+        assert seconds_until_unthrottled is not None
+        time.sleep(seconds_until_unthrottled)
+        self.assertEqual(limiter.throttled_models(), [])
+        task = submit_next_adaptation(1, self.session)
+        assert task is not None
+        asyncio.run(task)
+        self.session.commit()
+        self.assertIsInstance(throttled.initial_assistant_response, assistant_responses.UnknownError)
+
+
+class AdaptationLlmBatchTestCase(PendingAdaptationsTestCase):
+    def test_llm_batch(self) -> None:
+        from .llm import openai as openai_model
+        from .llm.fake_openai_batches import FakeOpenAiBatchServer
+
+        server = FakeOpenAiBatchServer(polls_before_completion=1)
+        self.enterContext(unittest.mock.patch.object(openai_model, "client", server.make_client()))
+
+        openai_gpt_4o = llm.OpenAiModel(provider="openai", name="gpt-4o-2024-08-06")
+        dummy = self.make_adaptation(llm.DummyModel(provider="dummy", name="dummy-1"), "Not batchable.")
+        success = self.make_adaptation(openai_gpt_4o, "Adapt this exercise.")
+        invalid_json = self.make_adaptation(openai_gpt_4o, "Invalid JSON")
+        not_json = self.make_adaptation(openai_gpt_4o, "Not JSON")
+        failed = self.make_adaptation(openai_gpt_4o, "Unknown error")
+        expired = self.make_adaptation(openai_gpt_4o, "Batch expired")
+        other_model = self.make_adaptation(llm.OpenAiModel(provider="openai", name="gpt-4.1-2025-04-14"), "Later.")
+        self.session.commit()
+
+        async def run(task: typing.Coroutine[None, None, None] | None) -> None:
+            assert task is not None
+            await task
+            self.session.commit()
+
+        poll_interval = datetime.timedelta(seconds=0)
+
+        asyncio.run(run(submit_next_adaptation_llm_batch(self.session, 10)))
+        self.assertIsNone(dummy.llm_batch)
+        self.assertIsNone(other_model.llm_batch)
+        llm_batch = success.llm_batch
+        assert llm_batch is not None
+        self.assertEqual(llm_batch.adaptations, [success, invalid_json, not_json, failed, expired])
+
+        asyncio.run(run(poll_next_adaptation_llm_batch(self.session, poll_interval)))
+        self.assertIsNone(llm_batch.finished_at)
+        self.assertIsNone(success.initial_assistant_response)
+
+        asyncio.run(run(poll_next_adaptation_llm_batch(self.session, poll_interval)))
+        self.assertIsNotNone(llm_batch.finished_at)
+        self.assertIsNone(poll_next_adaptation_llm_batch(self.session, poll_interval))
+
+        self.assertIsInstance(success.initial_assistant_response, assistant_responses.Success)
+        self.assertEqual(success.raw_llm_conversations[0]["method"], "openai.AsyncOpenAI.batches.create")
+        self.assertIsNotNone(success.initial_timing)
+        self.assertIsInstance(invalid_json.initial_assistant_response, assistant_responses.InvalidJsonError)
+        self.assertIsInstance(not_json.initial_assistant_response, assistant_responses.NotJsonError)
+        self.assertIsInstance(failed.initial_assistant_response, assistant_responses.UnknownError)
+        self.assertEqual(len(failed.raw_llm_conversations), 1)
+
+        # Not processed before the batch expired: pending again, for the next batch
+        self.assertIsNone(expired.llm_batch)
+        self.assertIsNone(expired.initial_assistant_response)
+
+        asyncio.run(run(submit_next_adaptation_llm_batch(self.session, 10)))
+        self.assertIsNotNone(expired.llm_batch)
+        self.assertIsNone(other_model.llm_batch)
+
+        asyncio.run(run(submit_next_adaptation_llm_batch(self.session, 10)))
+        self.assertIsNotNone(other_model.llm_batch)
+        self.assertIsNone(submit_next_adaptation_llm_batch(self.session, 10))
+        self.assertIsNone(dummy.llm_batch)
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
 import json
 from typing import Literal
@@ -30,9 +31,10 @@ from ..sandbox import adaptation as sandbox_adaptation
 from .. import database_utils
 from .. import dispatching as dispatch
 from .. import exercises
+from .. import pending_work
 from .. import textbooks
 from ..any_json import JsonList, JsonType
-from ..api_utils import ApiModel, get_by_id
+from ..api_utils import ApiModel, ApiTestCaseWithDatabase, get_by_id
 
 
 router = fastapi.APIRouter()
@@ -128,7 +130,7 @@ class ApiAdaptation(ApiModel):
 
 
 @router.get("/adaptations/{id}")
-async def get_adaptation(id: str, session: database_utils.SessionDependable) -> ApiAdaptation:
+def get_adaptation(id: str, session: database_utils.SessionDependable) -> ApiAdaptation:
     return make_api_adaptation(get_by_id(session, adaptation.Adaptation, id))
 
 
@@ -140,6 +142,47 @@ class PostAdaptationAdjustmentRequest(ApiModel):
 async def post_adaptation_adjustment(
     id: str, req: PostAdaptationAdjustmentRequest, session: database_utils.SessionDependable
 ) -> None:
+    # Database accesses are synchronous: run them in threads to keep the event loop free while waiting for the LLM
+    (exercise_adaptation, model, messages, response_format) = await asyncio.to_thread(
+        prepare_adaptation_adjustment, id, req, session
+    )
+
+    try:
+        response = await model.complete(messages, response_format)
+    except RetryableError:
+        raise fastapi.HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=[dict(type="retryable", msg="LLM service temporarily unavailable")],
+        )
+    except adaptation.llm.InvalidJsonLlmException as error:
+        raw_conversation: JsonType = error.raw_conversation
+        assistant_response: adaptation.assistant_responses.Response = adaptation.assistant_responses.InvalidJsonError(
+            kind="error", error="invalid-json", parsed=error.parsed
+        )
+    except adaptation.llm.NotJsonLlmException as error:
+        raw_conversation = error.raw_conversation
+        assistant_response = adaptation.assistant_responses.NotJsonError(
+            kind="error", error="not-json", text=error.text
+        )
+    else:
+        raw_conversation = response.raw_conversation
+        assistant_response = adaptation.assistant_responses.Success(
+            kind="success", exercise=adaptation.adapted.Exercise.model_validate(response.message.content.model_dump())
+        )
+
+    await asyncio.to_thread(store_adaptation_adjustment, exercise_adaptation, req, raw_conversation, assistant_response)
+
+
+def prepare_adaptation_adjustment(
+    id: str, req: PostAdaptationAdjustmentRequest, session: database_utils.Session
+) -> tuple[
+    adaptation.Adaptation,
+    adaptation.llm.ConcreteModel,
+    list[adaptation.submission.LlmMessage],
+    adaptation.llm.JsonFromTextResponseFormat[adaptation.adapted.Exercise]
+    | adaptation.llm.JsonObjectResponseFormat[adaptation.adapted.Exercise]
+    | adaptation.llm.JsonSchemaResponseFormat[adaptation.adapted.Exercise],
+]:
     exercise_adaptation = get_by_id(session, adaptation.Adaptation, id)
     assert exercise_adaptation.initial_assistant_response is not None
     exercise_adaptation.approved_by = None
@@ -168,46 +211,31 @@ async def post_adaptation_adjustment(
         make_assistant_message(adjustment.assistant_response)
     messages.append(adaptation.llm.UserMessage(content=req.adjustment))
 
-    try:
-        response = await exercise_adaptation.model.complete(
-            messages, exercise_adaptation.settings.response_specification.make_response_format()
-        )
-    except RetryableError:
-        raise fastapi.HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=[dict(type="retryable", msg="LLM service temporarily unavailable")],
-        )
-    except adaptation.llm.InvalidJsonLlmException as error:
-        raw_conversation: JsonType = error.raw_conversation
-        assistant_response: adaptation.assistant_responses.Response = adaptation.assistant_responses.InvalidJsonError(
-            kind="error", error="invalid-json", parsed=error.parsed
-        )
-    except adaptation.llm.NotJsonLlmException as error:
-        raw_conversation = error.raw_conversation
-        assistant_response = adaptation.assistant_responses.NotJsonError(
-            kind="error", error="not-json", text=error.text
-        )
-    else:
-        raw_conversation = response.raw_conversation
-        assistant_response = adaptation.assistant_responses.Success(
-            kind="success", exercise=adaptation.adapted.Exercise.model_validate(response.message.content.model_dump())
-        )
+    return (
+        exercise_adaptation,
+        exercise_adaptation.model,
+        messages,
+        exercise_adaptation.settings.response_specification.make_response_format(),
+    )
+
 
+def store_adaptation_adjustment(
+    exercise_adaptation: adaptation.Adaptation,
+    req: PostAdaptationAdjustmentRequest,
+    raw_conversation: JsonType,
+    assistant_response: adaptation.assistant_responses.Response,
+) -> None:
     try:
         json.dumps(raw_conversation)
     except TypeError:
         print("Raw conversation not JSON-serializable:", raw_conversation)
         raw_conversation = "Error: conversation not JSON-serializable"
 
-    raw_llm_conversations = list(exercise_adaptation.raw_llm_conversations)
-    raw_llm_conversations.append(raw_conversation)
-    exercise_adaptation.raw_llm_conversations = raw_llm_conversations
+    exercise_adaptation.append_raw_llm_conversation(raw_conversation)
 
-    adjustments = list(exercise_adaptation.adjustments)
-    adjustments.append(
+    exercise_adaptation.append_adjustment(
         adaptation.assistant_responses.Adjustment(user_prompt=req.adjustment, assistant_response=assistant_response)
     )
-    exercise_adaptation.adjustments = adjustments
 
 
 @router.delete("/adaptations/{id}/last-adjustment")
@@ -216,13 +244,9 @@ def delete_adaptation_last_adjustment(id: str, session: database_utils.SessionDe
     exercise_adaptation.approved_by = None
     exercise_adaptation.approved_at = None
 
-    raw_llm_conversations = list(exercise_adaptation.raw_llm_conversations)
-    raw_llm_conversations.pop()
-    exercise_adaptation.raw_llm_conversations = raw_llm_conversations
+    exercise_adaptation.pop_raw_llm_conversation()
 
-    adjustments = list(exercise_adaptation.adjustments)
-    adjustments.pop()
-    exercise_adaptation.adjustments = adjustments
+    exercise_adaptation.pop_adjustment()
 
 
 @router.put("/adaptations/{id}/manual-edit")
@@ -287,6 +311,7 @@ def retry_adaptation(id: str, session: database_utils.SessionDependable) -> None
         approved_at=None,
     )
     session.add(new_adaptation)
+    pending_work.notify(session)
     session.flush()
 
 
@@ -442,3 +467,24 @@ def make_api_input_out(exercise: adaptation.AdaptableExercise) -> ApiInputOut:
         exercise_number=exercise.location.exercise_number,
         text=exercise.full_text.split("\n"),
     )
+
+
+class AdaptationAdjustmentsTestCase(ApiTestCaseWithDatabase):
+    api_router = router
+
+    def test_append_and_pop(self) -> None:
+        from .. import fixtures
+
+        fixtures.load(self.session, False, ["dummy-adaptation"])
+        self.session.commit()
+
+        for adjustment in ["First", "Second", "Third"]:
+            response = self.client.post("/adaptations/1/adjustment", json={"adjustment": adjustment})
+            self.assertEqual(response.status_code, 200, response.text)
+        response = self.client.delete("/adaptations/1/last-adjustment")
+        self.assertEqual(response.status_code, 200, response.text)
+
+        response = self.client.get("/adaptations/1")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.json()["adjustmentPrompts"], ["First", "Second"])
+        self.assertEqual(len(response.json()["rawLlmConversations"]), 3)
@@ -14,16 +14,23 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from collections.abc import Iterable
-from typing import Any, Literal
+from __future__ import annotations
+from collections.abc import Callable, Iterable
+from typing import Any, Literal, TypeVar
+import abc
 import base64
 import csv
+import datetime
 import hashlib
 import io
 import json
 import os
+import tempfile
+import traceback
+import unittest
 import zipfile
 
+from sqlalchemy import orm
 import fastapi
 import sqlalchemy as sql
 
@@ -35,11 +42,14 @@ from .. import classification
 from .. import database_utils
 from .. import exercises
 from .. import external_exercises
+from .. import extraction
 from .. import sandbox
 from .. import file_storage
+from .. import logs
 from .. import textbooks
 from ..any_json import JsonDict
-from ..api_utils import get_by_id
+from ..api_utils import ApiTestCaseWithDatabase, get_by_id
+from ..version import PATTY_VERSION
 
 
 router = fastapi.APIRouter(dependencies=[fastapi.Depends(authentication.auth_param_dependable)])
@@ -57,103 +67,208 @@ def export_extraction_batch_html(
     return export_batch_html("extraction", id, get_extraction_batch_adaptations(session, id), download)
 
 
-class TsvResponse(fastapi.responses.Response):
+class TsvResponse(fastapi.responses.StreamingResponse):
     media_type = "text/tab-separated-values"
 
 
+class JsonStreamingResponse(fastapi.responses.StreamingResponse):
+    media_type = "application/json"
+
+
+class ZipStreamingResponse(fastapi.responses.StreamingResponse):
+    media_type = "application/zip"
+
+
+T = TypeVar("T")
+
+
+# Exports are streamed, so they are generated after the request's session is closed: they use their own session
+def iterate_in_session(
+    engine: database_utils.Engine, generate: Callable[[database_utils.Session], Iterable[T]]
+) -> Iterable[T]:
+    with database_utils.Session(engine) as session:
+        yield from generate(session)
+
+
+def stream_tsv(headers: tuple[str, ...], rows: Iterable[tuple[Any, ...]]) -> Iterable[bytes]:
+    string_file = io.StringIO()
+    writer = csv.writer(string_file, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow(row)
+        yield pop_string_file(string_file).encode("utf-8")
+    yield pop_string_file(string_file).encode("utf-8")
+
+
+def pop_string_file(string_file: io.StringIO) -> str:
+    content = string_file.getvalue()
+    string_file.seek(0)
+    string_file.truncate()
+    return content
+
+
+def stream_json_list(items: Iterable[Any]) -> Iterable[bytes]:
+    # Same format as 'fastapi.responses.JSONResponse'
+    separator = "["
+    for item in items:
+        yield (
+            separator + json.dumps(item, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"))
+        ).encode("utf-8")
+        separator = ","
+    yield ("]" if separator == "," else "[]").encode("utf-8")
+
+
+class ZipStreamBuffer:
+    # 'zipfile.ZipFile' cannot seek back into this file, so it writes each member's sizes and CRC
+    # in a data descriptor after the member, and each member can be sent as soon as it's written.
+
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+        self.position = 0
+
+    def write(self, data: bytes, /) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(members: Iterable[tuple[str, bytes]]) -> Iterable[bytes]:
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in members:
+            zip_file.writestr(name, data)
+            yield buffer.pop()
+    yield buffer.pop()
+
+
 @router.get("/sandbox-extraction-batch-{id}-extracted-exercises.json")
 def export_extraction_batch_extracted_exercises_json(
-    id: str, session: database_utils.SessionDependable, download: bool = True
-) -> fastapi.responses.JSONResponse:
-    batch = get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
+) -> JsonStreamingResponse:
+    get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
+
+    return JsonStreamingResponse(
+        content=stream_json_list(iterate_in_session(engine, lambda session: gather_extracted_exercises(session, id))),
+        headers=make_export_header(download, f"sandbox-extraction-batch-{id}-extracted-exercises.json"),
+    )
+
+
+def gather_extracted_exercises(session: database_utils.Session, id: str) -> Iterable[JsonDict]:
+    batch = get_by_id(
+        session,
+        sandbox.extraction.SandboxExtractionBatch,
+        id,
+        options=[
+            orm.selectinload(sandbox.extraction.SandboxExtractionBatch.page_extraction_creations)
+            .joinedload(sandbox.extraction.PageExtractionCreationBySandboxBatch.page_extraction)
+            .undefer(extraction.PageExtraction.extracted_text_and_styles)
+        ],
+    )
 
-    content = []
     for page_creation in batch.page_extraction_creations:
         page = page_creation.page_extraction
         assert page.assistant_response is not None
-        content.append(
-            {
-                "pdfPageNumber": page.pdf_page_number,
-                "extractedTextAndStyles": page.extracted_text_and_styles,
-                "response": page.assistant_response.model_dump(),
-                "imagesUrls": {
-                    creation.image.local_identifier: previewable_exercise.make_image_url("data", creation.image)
-                    for creation in page.extracted_images
-                },
-            }
-        )
-
-    return fastapi.responses.JSONResponse(
-        content=content, headers=make_export_header(download, f"sandbox-extraction-batch-{id}-extracted-exercises.json")
-    )
+        yield {
+            "pdfPageNumber": page.pdf_page_number,
+            "extractedTextAndStyles": page.extracted_text_and_styles,
+            "response": page.assistant_response.model_dump(),
+            "imagesUrls": previewable_exercise.make_images_data_urls(
+                creation.image for creation in page.extracted_images
+            ),
+        }
 
 
 @router.get("/sandbox-extraction-batch-{id}-extracted-exercises.tsv")
 def export_extraction_batch_extracted_exercises_tsv(
-    id: str, session: database_utils.SessionDependable, download: bool = True
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
 ) -> TsvResponse:
-    batch = get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
+    get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
 
     headers = ("page", "num", "instruction_hint_example", "statement")
-    data = []
+    return make_tsv_response(
+        headers,
+        iterate_in_session(engine, lambda session: gather_extracted_exercises_rows(session, id)),
+        download,
+        f"sandbox-extraction-batch-{id}-extracted-exercises.tsv",
+    )
+
+
+def gather_extracted_exercises_rows(
+    session: database_utils.Session, id: str
+) -> Iterable[tuple[int | None, str | None, str | None, str | None]]:
+    batch = get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
+
     for page in batch.page_extraction_creations:
         for ec in page.page_extraction.exercise_creations__ordered_by_id:
             exercise = ec.exercise
             assert isinstance(exercise, adaptation.AdaptableExercise)
             assert isinstance(exercise.location, exercises.ExerciseLocationMaybePageAndNumber)
-            data.append(
-                (
-                    exercise.location.page_number,
-                    exercise.location.exercise_number,
-                    exercise.instruction_hint_example_text,
-                    exercise.statement_text,
-                )
+            yield (
+                exercise.location.page_number,
+                exercise.location.exercise_number,
+                exercise.instruction_hint_example_text,
+                exercise.statement_text,
             )
 
-    return make_tsv_response(headers, data, download, f"sandbox-extraction-batch-{id}-extracted-exercises.tsv")
-
 
 def make_tsv_response(
-    headers: tuple[str, ...], data: list[tuple[Any, ...]], download: bool, filename: str
+    headers: tuple[str, ...], rows: Iterable[tuple[Any, ...]], download: bool, filename: str
 ) -> TsvResponse:
-    string_file = io.StringIO()
-    writer = csv.writer(string_file, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
-    writer.writerow(headers)
-    writer.writerows(data)
-    content = string_file.getvalue()
-
-    return TsvResponse(content=content, headers=make_export_header(download, filename))
+    return TsvResponse(content=stream_tsv(headers, rows), headers=make_export_header(download, filename))
 
 
 @router.get("/sandbox-extraction-batch-{id}-classified-exercises.tsv")
 def export_extraction_batch_classified_exercises_tsv(
-    id: str, session: database_utils.SessionDependable, download: bool = True
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
 ) -> TsvResponse:
+    get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
+
+    return export_batch_classified_exercises_tsv(
+        "extraction", id, engine, get_extraction_batch_classifications, download
+    )
+
+
+def get_extraction_batch_classifications(
+    session: database_utils.Session, id: str
+) -> Iterable[classification.ClassificationByChunk]:
     batch = get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
 
-    classifications: list[classification.ClassificationByChunk] = []
     if batch.run_classification:
         for page_creation in batch.page_extraction_creations:
             for chunk_creation in page_creation.page_extraction.classification_chunk_creations:
-                classifications.extend(chunk_creation.classification_chunk.classifications)
-
-    return export_batch_classified_exercises_tsv("extraction", id, classifications, download)
+                yield from chunk_creation.classification_chunk.classifications
 
 
 @router.get("/sandbox-extraction-batch-{id}-adapted-exercises.json")
 def export_extraction_batch_adapted_exercises_json(
-    id: str, session: database_utils.SessionDependable, download: bool = True
-) -> fastapi.responses.JSONResponse:
-    return export_batch_adapted_exercises_json(
-        "extraction", id, get_extraction_batch_adaptations(session, id), download
-    )
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
+) -> JsonStreamingResponse:
+    get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
+
+    return export_batch_adapted_exercises_json("extraction", id, engine, get_extraction_batch_adaptations, download)
 
 
 @router.get("/sandbox-extraction-batch-{id}-adapted-exercises.zip")
 def export_extraction_batch_adapted_exercises_zip(
-    id: str, session: database_utils.SessionDependable, download: bool = True
-) -> fastapi.responses.StreamingResponse:
-    return export_batch_adapted_exercises_zip("extraction", id, get_extraction_batch_adaptations(session, id), download)
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
+) -> ZipStreamingResponse:
+    get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
+
+    return export_batch_adapted_exercises_zip("extraction", id, engine, get_extraction_batch_adaptations, download)
 
 
 def get_extraction_batch_adaptations(
@@ -177,30 +292,41 @@ def export_classification_batch_html(
 
 @router.get("/sandbox-classification-batch-{id}-classified-exercises.tsv")
 def export_classification_batch_classified_exercises_tsv(
-    id: str, session: database_utils.SessionDependable, download: bool = True
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
 ) -> TsvResponse:
-    batch = get_by_id(session, sandbox.classification.SandboxClassificationBatch, id)
+    get_by_id(session, sandbox.classification.SandboxClassificationBatch, id)
 
     return export_batch_classified_exercises_tsv(
-        "classification", id, batch.classification_chunk_creation.classification_chunk.classifications, download
+        "classification", id, engine, get_classification_batch_classifications, download
     )
 
 
+def get_classification_batch_classifications(
+    session: database_utils.Session, id: str
+) -> Iterable[classification.ClassificationByChunk]:
+    batch = get_by_id(session, sandbox.classification.SandboxClassificationBatch, id)
+    return batch.classification_chunk_creation.classification_chunk.classifications
+
+
 @router.get("/sandbox-classification-batch-{id}-adapted-exercises.json")
 def export_classification_batch_adapted_exercises_json(
-    id: str, session: database_utils.SessionDependable, download: bool = True
-) -> fastapi.responses.JSONResponse:
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
+) -> JsonStreamingResponse:
+    get_by_id(session, sandbox.classification.SandboxClassificationBatch, id)
+
     return export_batch_adapted_exercises_json(
-        "classification", id, get_classification_batch_adaptations(session, id), download
+        "classification", id, engine, get_classification_batch_adaptations, download
     )
 
 
 @router.get("/sandbox-classification-batch-{id}-adapted-exercises.zip")
 def export_classification_batch_adapted_exercises_zip(
-    id: str, session: database_utils.SessionDependable, download: bool = True
-) -> fastapi.responses.StreamingResponse:
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
+) -> ZipStreamingResponse:
+    get_by_id(session, sandbox.classification.SandboxClassificationBatch, id)
+
     return export_batch_adapted_exercises_zip(
-        "classification", id, get_classification_batch_adaptations(session, id), download
+        "classification", id, engine, get_classification_batch_adaptations, download
     )
 
 
@@ -224,18 +350,20 @@ def export_adaptation_batch_html(
 
 @router.get("/sandbox-adaptation-batch-{id}-adapted-exercises.json")
 def export_adaptation_batch_adapted_exercises_json(
-    id: str, session: database_utils.SessionDependable, download: bool = True
-) -> fastapi.responses.JSONResponse:
-    return export_batch_adapted_exercises_json(
-        "adaptation", id, get_adaptation_batch_adaptations(session, id), download
-    )
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
+) -> JsonStreamingResponse:
+    get_by_id(session, sandbox.adaptation.SandboxAdaptationBatch, id)
+
+    return export_batch_adapted_exercises_json("adaptation", id, engine, get_adaptation_batch_adaptations, download)
 
 
 @router.get("/sandbox-adaptation-batch-{id}-adapted-exercises.zip")
 def export_adaptation_batch_adapted_exercises_zip(
-    id: str, session: database_utils.SessionDependable, download: bool = True
-) -> fastapi.responses.StreamingResponse:
-    return export_batch_adapted_exercises_zip("adaptation", id, get_adaptation_batch_adaptations(session, id), download)
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
+) -> ZipStreamingResponse:
+    get_by_id(session, sandbox.adaptation.SandboxAdaptationBatch, id)
+
+    return export_batch_adapted_exercises_zip("adaptation", id, engine, get_adaptation_batch_adaptations, download)
 
 
 def get_adaptation_batch_adaptations(
@@ -258,7 +386,9 @@ def export_batch_html(
     data = list(
         adapted_exercise_data
         for adapted_exercise_data in (
-            make_adapted_exercise_data(adaptation) for adaptation in adaptations if adaptation is not None
+            make_adapted_exercise_data(adaptation, InlinedFiles())
+            for adaptation in adaptations
+            if adaptation is not None
         )
         if adapted_exercise_data is not None
     )
@@ -273,77 +403,83 @@ def export_batch_html(
 def export_batch_adapted_exercises_json(
     kind: Literal["extraction", "classification", "adaptation"],
     id: str,
-    adaptations: Iterable[adaptation.Adaptation | None],
+    engine: database_utils.Engine,
+    get_adaptations: Callable[[database_utils.Session, str], Iterable[adaptation.Adaptation | None]],
     download: bool,
-) -> fastapi.responses.JSONResponse:
-    content = list(
-        adapted_exercise_data
-        for adapted_exercise_data in (
-            make_adapted_exercise_data(adaptation) for adaptation in adaptations if adaptation is not None
-        )
-        if adapted_exercise_data is not None
-    )
-
-    return fastapi.responses.JSONResponse(
-        content=content, headers=make_export_header(download, f"sandbox-{kind}-batch-{id}-adapted-exercises.json")
+) -> JsonStreamingResponse:
+    return JsonStreamingResponse(
+        content=stream_json_list(
+            iterate_in_session(engine, lambda session: gather_adapted_exercises_data(get_adaptations(session, id)))
+        ),
+        headers=make_export_header(download, f"sandbox-{kind}-batch-{id}-adapted-exercises.json"),
     )
 
 
 def export_batch_adapted_exercises_zip(
     kind: Literal["extraction", "classification", "adaptation"],
     id: str,
-    adaptations: Iterable[adaptation.Adaptation | None],
+    engine: database_utils.Engine,
+    get_adaptations: Callable[[database_utils.Session, str], Iterable[adaptation.Adaptation | None]],
     download: bool,
-) -> fastapi.responses.StreamingResponse:
-    exercises = list(
-        adapted_exercise_data
-        for adapted_exercise_data in (
-            make_adapted_exercise_data(adaptation) for adaptation in adaptations if adaptation is not None
-        )
-        if adapted_exercise_data is not None
+) -> ZipStreamingResponse:
+    return make_adapted_exercises_zip_response(
+        iterate_in_session(engine, lambda session: gather_adapted_exercises_data(get_adaptations(session, id))),
+        download,
+        f"sandbox-{kind}-batch-{id}-adapted-exercises.zip",
     )
 
-    zip_bytes = io.BytesIO()
-    with zipfile.ZipFile(zip_bytes, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_file:
-        for exercise in exercises:
-            if exercise["kind"] == "adapted":
-                zip_file.writestr(
-                    f"{exercise['exerciseId']}.json", json.dumps(exercise["adaptedExercise"], indent=2).encode("utf-8")
-                )
 
-    zip_bytes.seek(0)
-    return fastapi.responses.StreamingResponse(
-        content=zip_bytes,
-        media_type="application/zip",
-        headers={"Content-Length": str(zip_bytes.getbuffer().nbytes)}
-        | make_export_header(download, f"sandbox-{kind}-batch-{id}-adapted-exercises.zip"),
+def gather_adapted_exercises_data(adaptations: Iterable[adaptation.Adaptation | None]) -> Iterable[JsonDict]:
+    for adaptation_ in adaptations:
+        if adaptation_ is not None:
+            adapted_exercise_data = make_adapted_exercise_data(adaptation_, InlinedFiles())
+            if adapted_exercise_data is not None:
+                yield adapted_exercise_data
+
+
+def make_adapted_exercises_zip_response(
+    exercises: Iterable[JsonDict], download: bool, filename: str
+) -> ZipStreamingResponse:
+    return ZipStreamingResponse(
+        content=stream_zip(
+            (f"{exercise['exerciseId']}.json", json.dumps(exercise["adaptedExercise"], indent=2).encode("utf-8"))
+            for exercise in exercises
+            if exercise["kind"] == "adapted"
+        ),
+        headers=make_export_header(download, filename),
     )
 
 
 def export_batch_classified_exercises_tsv(
     kind: Literal["extraction", "classification"],
     id: str,
-    classifications: Iterable[classification.ClassificationByChunk],
+    engine: database_utils.Engine,
+    get_classifications: Callable[[database_utils.Session, str], Iterable[classification.ClassificationByChunk]],
     download: bool,
 ) -> TsvResponse:
     headers = ("page", "num", "instruction_hint_example", "statement", "class_name")
 
-    data: list[tuple[int | None, str | None, str | None, str | None, str]] = []
-    for classification_ in classifications:
-        exercise = classification_.exercise
-        assert isinstance(exercise.location, exercises.ExerciseLocationMaybePageAndNumber)
-        if classification_.exercise_class is not None:
-            data.append(
-                (
+    def gather_rows(
+        session: database_utils.Session,
+    ) -> Iterable[tuple[int | None, str | None, str | None, str | None, str]]:
+        for classification_ in get_classifications(session, id):
+            exercise = classification_.exercise
+            assert isinstance(exercise.location, exercises.ExerciseLocationMaybePageAndNumber)
+            if classification_.exercise_class is not None:
+                yield (
                     exercise.location.page_number,
                     exercise.location.exercise_number,
                     exercise.instruction_hint_example_text,
                     exercise.statement_text,
                     classification_.exercise_class.name,
                 )
-            )
 
-    return make_tsv_response(headers, data, download, f"sandbox-{kind}-batch-{id}-classified-exercises.tsv")
+    return make_tsv_response(
+        headers,
+        iterate_in_session(engine, gather_rows),
+        download,
+        f"sandbox-{kind}-batch-{id}-classified-exercises.tsv",
+    )
 
 
 export_adaptation_template_file_path = os.path.join(
@@ -355,7 +491,7 @@ export_adaptation_template_file_path = os.path.join(
 def export_adaptation(
     id: str, session: database_utils.SessionDependable, download: bool = True
 ) -> fastapi.responses.HTMLResponse:
-    data = make_adapted_exercise_data(get_by_id(session, adaptation.Adaptation, id))
+    data = make_adapted_exercise_data(get_by_id(session, adaptation.Adaptation, id), InlinedFiles())
     assert data is not None
     content = render_template(export_adaptation_template_file_path, "ADAPTATION_EXPORT_DATA", data)
 
@@ -373,7 +509,7 @@ export_textbook_template_file_path = os.path.join(
 def export_textbook(
     id: str, session: database_utils.SessionDependable, download: bool = True
 ) -> fastapi.responses.HTMLResponse:
-    data = get_textbook_data(id, session)
+    data = get_textbook_data(id, session, InlinedFiles())
 
     content = render_template(export_textbook_template_file_path, "TEXTBOOK_EXPORT_DATA", data)
 
@@ -384,58 +520,291 @@ def export_textbook(
 
 @router.get("/textbook/{id}-adapted-exercises.zip")
 def export_textbook_adapted_exercises_zip(
-    id: str, session: database_utils.SessionDependable, download: bool = True
-) -> fastapi.responses.StreamingResponse:
-    data = get_textbook_data(id, session)
-
-    zip_bytes = io.BytesIO()
-    with zipfile.ZipFile(zip_bytes, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_file:
-        for exercise in data["exercises"]:
-            if exercise["kind"] == "adapted":
-                zip_file.writestr(
-                    f"{exercise['exerciseId']}.json", json.dumps(exercise["adaptedExercise"], indent=2).encode("utf-8")
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
+) -> ZipStreamingResponse:
+    textbook = get_by_id(session, textbooks.Textbook, id)
+    textbook_id = textbook.id
+
+    return make_adapted_exercises_zip_response(
+        iterate_in_session(
+            engine, lambda session: gather_adapted_exercises_data(iterate_textbook_adaptations(session, textbook_id))
+        ),
+        download,
+        f"{textbook.title}-adapted-exercises.zip",
+    )
+
+
+@router.get("/textbook/{id}.zip")
+def export_textbook_bundle(
+    id: str, engine: database_utils.EngineDependable, session: database_utils.SessionDependable, download: bool = True
+) -> ZipStreamingResponse:
+    # Like 'export_textbook', but with files stored next to 'index.html' instead of inlined in it
+    textbook = get_by_id(session, textbooks.Textbook, id)
+
+    return ZipStreamingResponse(
+        content=stream_zip(iterate_in_session(engine, lambda session: gather_textbook_bundle_members(session, id))),
+        headers=make_export_header(download, f"{textbook.title}.zip"),
+    )
+
+
+def gather_textbook_bundle_members(session: database_utils.Session, id: str) -> Iterable[tuple[str, bytes]]:
+    files = BundledFiles()
+    data = get_textbook_data(id, session, files)
+    yield from make_textbook_bundle_members(data, files)
+
+
+def make_textbook_bundle_members(data: JsonDict, files: BundledFiles) -> Iterable[tuple[str, bytes]]:
+    with open(export_textbook_template_file_path) as f:
+        template = f.read()
+    # Browsers refuse to 'fetch' files from 'file://' URLs, but they do load scripts, so the data is in a script
+    assert template.count("</head>") == 1
+    yield ("index.html", template.replace("</head>", '<script src="data.js"></script></head>').encode("utf-8"))
+    yield ("data.js", f"window.textbookExportData = {json.dumps(data)};\n".encode("utf-8"))
+    yield from files.load()
+
+
+def hash_textbook_export(format: textbooks.TextbookExportFormat, data: JsonDict) -> str:
+    # 'data' must be made with 'BundledFiles': it then references files by their storage keys instead of
+    # including their contents. This is enough because these files are never modified once uploaded.
+    hasher = hashlib.sha256()
+    hasher.update(f"{PATTY_VERSION}\n{format}\n".encode("utf-8"))
+    with open(export_textbook_template_file_path, "rb") as f:
+        hasher.update(f.read())
+    hasher.update(json.dumps(data, sort_keys=True).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def execute_next_textbook_export(session: database_utils.Session) -> bool:
+    textbook_export = (
+        session.execute(
+            sql.select(textbooks.TextbookExport)
+            .where(textbooks.TextbookExport.finished_at == sql.null())
+            .order_by(textbooks.TextbookExport.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        .scalars()
+        .first()
+    )
+
+    if textbook_export is None:
+        return False
+    else:
+        textbook_export_id = textbook_export.id
+        logs.log(f"Found pending textbook export: {textbook_export_id}")
+        try:
+            render_textbook_export(session, textbook_export)
+        except Exception:  # Pokemon programming: gotta catch 'em all
+            logs.log(f"UNEXPECTED ERROR while rendering textbook export {textbook_export_id}")
+            traceback.print_exc()
+            # The error may come from the database and have aborted the transaction: record the failure in a new one.
+            # The rollback releases the lock on the export, so fetch it again, unless someone else took it meanwhile.
+            session.rollback()
+            textbook_export = (
+                session.execute(
+                    sql.select(textbooks.TextbookExport)
+                    .where(textbooks.TextbookExport.id == textbook_export_id)
+                    .where(textbooks.TextbookExport.finished_at == sql.null())
+                    .with_for_update(skip_locked=True)
                 )
+                .scalars()
+                .first()
+            )
+            if textbook_export is None:
+                return True
+            textbook_export.succeeded = False
+        else:
+            textbook_export.succeeded = True
+        textbook_export.finished_at = datetime.datetime.now(datetime.timezone.utc)
+        return True
+
+
+def render_textbook_export(session: database_utils.Session, textbook_export: textbooks.TextbookExport) -> None:
+    files = BundledFiles()
+    data = get_textbook_data(str(textbook_export.textbook_id), session, files)
+    # The textbook may have changed since the export was requested: export its current state
+    textbook_export.content_hash = hash_textbook_export(textbook_export.format, data)
+
+    if file_storage.textbook_exports.has(textbook_export.artifact_key):
+        logs.log(f"Textbook export {textbook_export.id} reuses existing {textbook_export.artifact_key}")
+    elif textbook_export.format == "html":
+        content = render_template(export_textbook_template_file_path, "TEXTBOOK_EXPORT_DATA", files.inline(data))
+        file_storage.textbook_exports.store(textbook_export.artifact_key, content.encode("utf-8"))
+    elif textbook_export.format == "zip":
+        # Through a temporary file, to keep memory usage flat whatever the size of the textbook's files
+        with tempfile.TemporaryFile() as file:
+            for chunk in stream_zip(make_textbook_bundle_members(data, files)):
+                file.write(chunk)
+            file.seek(0)
+            file_storage.textbook_exports.store_fileobj(textbook_export.artifact_key, file)
+    else:
+        assert False
+
+
+def delete_old_textbook_exports(session: database_utils.Session, before: datetime.datetime) -> int:
+    # Artifacts are shared by exports with the same content: keep those still referenced by a more recent export.
+    # Requesting a deleted export again renders it again.
+    old_exports = (
+        session.execute(
+            sql.select(textbooks.TextbookExport)
+            .where(textbooks.TextbookExport.finished_at != sql.null())
+            .where(textbooks.TextbookExport.created_at < before)
+        )
+        .scalars()
+        .all()
+    )
+    kept_artifact_keys = {
+        textbook_export.artifact_key
+        for textbook_export in session.execute(
+            sql.select(textbooks.TextbookExport).where(textbooks.TextbookExport.created_at >= before)
+        ).scalars()
+    }
+    for textbook_export in old_exports:
+        if textbook_export.artifact_key not in kept_artifact_keys:
+            file_storage.textbook_exports.delete(textbook_export.artifact_key)
+        session.delete(textbook_export)
+    return len(old_exports)
+
 
-    zip_bytes.seek(0)
-    return fastapi.responses.StreamingResponse(
-        content=zip_bytes,
-        media_type="application/zip",
-        headers={"Content-Length": str(zip_bytes.getbuffer().nbytes)}
-        | make_export_header(download, f"{data['title']}-adapted-exercises.zip"),
+def iterate_textbook_adaptations(session: database_utils.Session, textbook_id: int) -> Iterable[adaptation.Adaptation]:
+    polymorphic_exercise = orm.with_polymorphic(
+        exercises.Exercise, [adaptation.AdaptableExercise, external_exercises.ExternalExercise]
     )
+    for location in session.execute(
+        sql.select(textbooks.ExerciseLocationTextbook)
+        .where(textbooks.ExerciseLocationTextbook.textbook_id == textbook_id)
+        .order_by(textbooks.ExerciseLocationTextbook.id)
+        .options(
+            *previewable_exercise.make_loader_options(
+                orm.selectinload(textbooks.ExerciseLocationTextbook.exercise.of_type(polymorphic_exercise)),
+                polymorphic_exercise.AdaptableExercise,
+                all_adaptations=True,
+            )
+        )
+        # Fetch locations in batches from a server-side cursor, to keep memory usage flat for large textbooks
+        .execution_options(yield_per=100)
+    ).scalars():
+        if not location.effectively_removed:
+            exercise = location.exercise
+            if isinstance(exercise, adaptation.AdaptableExercise):
+                latest_adaptation = exercise.latest_adaptation
+                if latest_adaptation is not None:
+                    yield latest_adaptation
+
+
+class ExportedFiles(abc.ABC):
+    @abc.abstractmethod
+    def make_images_urls(self, exercise: adaptation.AdaptableExercise) -> adaptation.adapted.ImagesUrls: ...
+
+    @abc.abstractmethod
+    def make_file_data(
+        self, storage: file_storage.StorageEngine, directory: str, key: str, original_file_name: str
+    ) -> JsonDict: ...
+
+
+class InlinedFiles(ExportedFiles):
+    def make_images_urls(self, exercise: adaptation.AdaptableExercise) -> adaptation.adapted.ImagesUrls:
+        return previewable_exercise.gather_images_urls("data", exercise)
+
+    def make_file_data(
+        self, storage: file_storage.StorageEngine, directory: str, key: str, original_file_name: str
+    ) -> JsonDict:
+        return {"data": base64.b64encode(storage.load(key)).decode("ascii")}
+
+
+class BundledFiles(ExportedFiles):
+    def __init__(self) -> None:
+        # Files are only loaded when written to the bundle, one at a time
+        self.files: dict[str, tuple[file_storage.StorageEngine, str]] = {}
+
+    def make_images_urls(self, exercise: adaptation.AdaptableExercise) -> adaptation.adapted.ImagesUrls:
+        return {
+            image.local_identifier: self.add(file_storage.exercise_images, f"{image.id}.png", "assets/images")
+            for image in previewable_exercise.gather_required_images(exercise)
+        }
+
+    def make_file_data(
+        self, storage: file_storage.StorageEngine, directory: str, key: str, original_file_name: str
+    ) -> JsonDict:
+        # Keep the extension so that browsers know how to open the file
+        return {"url": self.add(storage, key, directory, os.path.splitext(original_file_name)[1])}
+
+    def add(self, storage: file_storage.StorageEngine, key: str, directory: str, extension: str = "") -> str:
+        path = f"{directory}/{key}{extension}"
+        self.files[path] = (storage, key)
+        return path
+
+    def load(self) -> Iterable[tuple[str, bytes]]:
+        def load_file(path: str) -> bytes:
+            (storage, key) = self.files[path]
+            return storage.load(key)
+
+        return file_storage.load_concurrently(load_file, self.files.keys())
+
+    def inline(self, data: JsonDict) -> JsonDict:
+        # Turns 'data' made with these 'BundledFiles' into what 'InlinedFiles' would have made,
+        # without gathering the textbook's data a second time
+        contents = dict(self.load())
+
+        def inline_item(item: JsonDict) -> JsonDict:
+            item = dict(item)
+            if "imagesUrls" in item:
+                item["imagesUrls"] = {
+                    identifier: previewable_exercise.make_image_data_url(contents[path])
+                    for (identifier, path) in item["imagesUrls"].items()
+                }
+            if "url" in item:
+                item["data"] = base64.b64encode(contents[item.pop("url")]).decode("ascii")
+            return item
+
+        return dict(
+            data,
+            lessons=[inline_item(lesson) for lesson in data["lessons"]],
+            exercises=[inline_item(exercise) for exercise in data["exercises"]],
+        )
 
 
-def get_textbook_data(id: str, session: database_utils.Session) -> JsonDict:
+def get_textbook_data(id: str, session: database_utils.Session, files: ExportedFiles) -> JsonDict:
     textbook = get_by_id(session, textbooks.Textbook, id)
 
-    exercises: list[JsonDict] = []
+    polymorphic_exercise = orm.with_polymorphic(
+        exercises.Exercise, [adaptation.AdaptableExercise, external_exercises.ExternalExercise]
+    )
+    exercises_data: list[JsonDict] = []
     for location in session.execute(
         sql.select(textbooks.ExerciseLocationTextbook)
         .where(textbooks.ExerciseLocationTextbook.textbook == textbook)
         .order_by(textbooks.ExerciseLocationTextbook.id)
+        .options(
+            *previewable_exercise.make_loader_options(
+                orm.selectinload(textbooks.ExerciseLocationTextbook.exercise.of_type(polymorphic_exercise)),
+                polymorphic_exercise.AdaptableExercise,
+                all_adaptations=True,
+            )
+        )
     ).scalars():
         if not location.effectively_removed:
             exercise = location.exercise
             if isinstance(exercise, adaptation.AdaptableExercise):
                 latest_adaptation = exercise.latest_adaptation
                 if latest_adaptation is not None:
-                    adapted_exercise_data = make_adapted_exercise_data(latest_adaptation)
+                    adapted_exercise_data = make_adapted_exercise_data(latest_adaptation, files)
                     if adapted_exercise_data is not None:
-                        exercises.append(adapted_exercise_data)
+                        exercises_data.append(adapted_exercise_data)
             elif isinstance(exercise, external_exercises.ExternalExercise):
-                exercises.append(make_external_exercise_data(exercise))
+                exercises_data.append(make_external_exercise_data(exercise, files))
             else:
                 assert False
 
     lessons: list[JsonDict] = []
     for lesson in textbook.lessons:
         if not lesson.effectively_removed:
-            lessons.append(make_lesson_data(lesson))
+            lessons.append(make_lesson_data(lesson, files))
 
     return dict(
         title=textbook.title,
         lessons=sorted(lessons, key=lambda lesson: lesson["pageNumber"]),
-        exercises=sorted(exercises, key=lambda ex: (ex["pageNumber"], alnum.key(ex["exerciseNumber"]))),
+        exercises=sorted(exercises_data, key=lambda ex: (ex["pageNumber"], alnum.key(ex["exerciseNumber"]))),
     )
 
 
@@ -447,7 +816,7 @@ def render_template(template: str, placeholder: str, data: Any) -> str:
     )
 
 
-def make_adapted_exercise_data(exercise_adaptation: adaptation.Adaptation) -> JsonDict | None:
+def make_adapted_exercise_data(exercise_adaptation: adaptation.Adaptation, files: ExportedFiles) -> JsonDict | None:
     location = exercise_adaptation.exercise.location
     assert isinstance(location, (exercises.ExerciseLocationMaybePageAndNumber, textbooks.ExerciseLocationTextbook))
     if location.page_number is not None and location.exercise_number is not None:
@@ -478,31 +847,126 @@ def make_adapted_exercise_data(exercise_adaptation: adaptation.Adaptation) -> Js
             json.dumps(adapted_exercise_dump, separators=(",", ":"), indent=None).encode()
         ).hexdigest(),
         "adaptedExercise": adapted_exercise_dump,
-        "imagesUrls": previewable_exercise.gather_images_urls("data", exercise_adaptation.exercise),
+        "imagesUrls": files.make_images_urls(exercise_adaptation.exercise),
     }
 
 
-def make_external_exercise_data(external_exercise: external_exercises.ExternalExercise) -> JsonDict:
+def make_external_exercise_data(
+    external_exercise: external_exercises.ExternalExercise, files: ExportedFiles
+) -> JsonDict:
     location = external_exercise.location
     assert isinstance(location, textbooks.ExerciseLocationTextbook)
-    data = base64.b64encode(file_storage.external_exercises.load(str(external_exercise.id))).decode("ascii")
     return {
         "exerciseId": f"P{location.page_number}Ex{location.exercise_number}",
         "pageNumber": location.page_number,
         "exerciseNumber": location.exercise_number,
         "kind": "external",
         "originalFileName": external_exercise.original_file_name,
-        "data": data,
+        **files.make_file_data(
+            file_storage.external_exercises,
+            "assets/external-exercises",
+            str(external_exercise.id),
+            external_exercise.original_file_name,
+        ),
     }
 
 
-def make_lesson_data(lesson: textbooks.Lesson) -> JsonDict:
-    data = base64.b64encode(file_storage.lessons.load(str(lesson.id))).decode("ascii")
-    return {"pageNumber": lesson.page_number, "originalFileName": lesson.original_file_name, "data": data}
+def make_lesson_data(lesson: textbooks.Lesson, files: ExportedFiles) -> JsonDict:
+    return {
+        "pageNumber": lesson.page_number,
+        "originalFileName": lesson.original_file_name,
+        **files.make_file_data(file_storage.lessons, "assets/lessons", str(lesson.id), lesson.original_file_name),
+    }
 
 
 def make_export_header(download: bool, filename: str) -> dict[str, str]:
     headers = {}
     if download:
-        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        headers["Content-Disposition"] = make_content_disposition(filename)
     return headers
+
+
+def make_content_disposition(filename: str) -> str:
+    return f'attachment; filename="{filename}"'
+
+
+class StreamingTestCase(unittest.TestCase):
+    def test_stream_zip(self) -> None:
+        chunks = list(stream_zip([("a.json", b"{}"), ("b.json", b"[]" * 1000)]))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[0][:2], b"PK")
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.namelist(), ["a.json", "b.json"])
+            self.assertEqual(zip_file.read("b.json"), b"[]" * 1000)
+
+    def test_stream_json_list(self) -> None:
+        items_: list[list[Any]] = [[], [{"a": "é"}], [1, {"b": [2, 3]}, None]]
+        for items in items_:
+            with self.subTest(items=items):
+                self.assertEqual(
+                    b"".join(stream_json_list(iter(items))), fastapi.responses.JSONResponse(content=items).body
+                )
+
+    def test_stream_tsv(self) -> None:
+        self.assertEqual(
+            b"".join(stream_tsv(("a", "b"), iter([(1, "x\ty"), (2, None)]))), b'a\tb\r\n1\t"x\ty"\r\n2\t\r\n'
+        )
+
+
+class ExportTextbookTestCase(ApiTestCaseWithDatabase):
+    api_router = router
+
+    def test_statements_count(self) -> None:
+        from .. import fixtures
+
+        fixtures.load(self.session, False, ["dummy-textbook-with-pdf-range"])
+        self.session.commit()
+
+        with self.assert_statements_count(18):
+            response = self.client.get(f"/textbook/1-adapted-exercises.zip?token={self.access_token}")
+        self.assertEqual(response.status_code, 200, response.text)
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            files_count = len(archive.namelist())
+
+        creator = fixtures.FixturesCreator(self.session)
+        exercise_class = self.session.get(adaptation.ExerciseClass, 1)
+        assert exercise_class is not None
+        assert exercise_class.latest_strategy_settings is not None
+        settings = exercise_class.latest_strategy_settings
+        textbook = self.session.get(textbooks.Textbook, 1)
+        assert textbook is not None
+        for page_number, exercise_number in [(40, "12"), (41, "1"), (41, "2")]:
+            exercise = creator.add(
+                adaptation.AdaptableExercise(
+                    created=exercises.ExerciseCreationByUser(at=fixtures.created_at, username="Patty"),
+                    location=textbooks.ExerciseLocationTextbook(
+                        textbook=textbook,
+                        page_number=page_number,
+                        exercise_number=exercise_number,
+                        marked_as_removed=False,
+                    ),
+                    full_text="Ceci est un exercice manuel.",
+                    instruction_hint_example_text=None,
+                    statement_text=None,
+                )
+            )
+            creator.add(
+                classification.ClassificationByUser(
+                    exercise=exercise, at=fixtures.created_at, username="Patty", exercise_class=exercise_class
+                )
+            )
+            creator.make_successful_adaptation(
+                created=creator.add(textbooks.AdaptationCreationByTextbook(at=fixtures.created_at, textbook=textbook)),
+                settings=settings,
+                model=adaptation.llm.DummyModel(provider="dummy", name="dummy-1"),
+                exercise=exercise,
+            )
+        self.session.commit()
+
+        # Constant whatever the number of exercises and adaptations, thanks to eager loading
+        with self.assert_statements_count(18):
+            response = self.client.get(f"/textbook/1-adapted-exercises.zip?token={self.access_token}")
+        self.assertEqual(response.status_code, 200, response.text)
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            self.assertEqual(len(archive.namelist()), files_count + 3)
@@ -17,12 +17,11 @@
 import datetime
 
 import fastapi
-import fastapi.testclient
 
 from .. import database_utils
 from .. import extraction
 from .. import file_storage
-from ..api_utils import ApiModel
+from ..api_utils import ApiModel, ApiTestCaseWithDatabase
 
 
 router = fastapi.APIRouter()
@@ -66,17 +65,14 @@ def create_pdf_file(req: CreatePdfFileRequest, session: database_utils.SessionDe
     return CreatePdfFileResponse(upload_url=upload_url)
 
 
-class ApiTestCase(database_utils.TestCaseWithDatabase):
+class ApiTestCase(ApiTestCaseWithDatabase):
+    api_router = router
+
     def setUp(self) -> None:
-        from .. import authentication
         from ..file_storage import file_system_engine
 
         super().setUp()
-        self.app = fastapi.FastAPI(database_engine=self.engine)
-        self.app.include_router(router)
         self.app.include_router(file_system_engine.router)
-        access_token = authentication.login(authentication.PostTokenRequest(password="password")).access_token
-        self.client = fastapi.testclient.TestClient(self.app, headers={"Authorization": f"Bearer {access_token}"})
 
     def test_create_the_same_pdf_file_several_times(self) -> None:
         sha = "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
@@ -18,10 +18,15 @@ import base64
 import datetime
 import typing
 
+from sqlalchemy import orm
+
 from .. import adaptation
+from .. import classification
 from .. import dispatching as dispatch
 from .. import exercises
+from .. import extraction
 from .. import file_storage
+from .. import textbooks
 from ..api_utils import ApiModel
 
 
@@ -173,45 +178,103 @@ def _gather_required_image_identifiers_from_adaptation(adaptation_: adaptation.A
         yield from _gather_required_image_identifiers_from_adapted_exercise(adaptation_.manual_edit)
 
 
+def make_loader_options(
+    load: orm.strategy_options._AbstractLoad,
+    exercise: typing.Any = adaptation.AdaptableExercise,
+    *,
+    all_adaptations: bool = False,
+) -> list[orm.strategy_options._AbstractLoad]:
+    # Eagerly load everything read by the functions of this module (and their callers) from the adaptable exercises
+    # reached by 'load'. 'exercise' is the entity at the end of 'load', e.g. 'some_with_polymorphic.AdaptableExercise'.
+    # (Options are chained from 'load' because 'load.options(...)' ignores 'orm.with_polymorphic' in 'of_type')
+    created = orm.with_polymorphic(
+        exercises.ExerciseCreation, [exercises.ExerciseCreationByUser, extraction.ExerciseCreationByPageExtraction]
+    )
+    classifications = orm.with_polymorphic(
+        classification.Classification, [classification.ClassificationByUser, classification.ClassificationByChunk]
+    )
+    return [
+        load.selectinload(exercise.location).selectin_polymorphic(
+            [textbooks.ExerciseLocationTextbook, exercises.ExerciseLocationMaybePageAndNumber]
+        ),
+        load.selectinload(exercise.created.of_type(created))
+        .selectinload(created.ExerciseCreationByPageExtraction.page_extraction)
+        .selectinload(extraction.PageExtraction.extracted_images)
+        .joinedload(extraction.ExerciseImageCreationByPageExtraction.image),
+        load.selectinload(exercise.ordered_classifications.of_type(classifications))
+        .selectinload(classifications.exercise_class)
+        .selectinload(adaptation.ExerciseClass.latest_strategy_settings),
+        load.selectinload(exercise.latest_adaptation).undefer_group("edits"),
+        load.selectinload(exercise.latest_adaptation).selectinload(adaptation.Adaptation.ordered_adjustments),
+        # Only exports need all adaptations, to gather the images they require
+        *(
+            [
+                load.selectinload(exercise.unordered_adaptations).undefer_group("edits"),
+                load.selectinload(exercise.unordered_adaptations).selectinload(
+                    adaptation.Adaptation.ordered_adjustments
+                ),
+            ]
+            if all_adaptations
+            else []
+        ),
+    ]
+
+
 def make_image_url(kind: typing.Literal["http", "data"], image: exercises.ExerciseImage) -> str:
     file_name = f"{image.id}.png"
     if kind == "data":
-        data = base64.b64encode(file_storage.exercise_images.load(file_name)).decode("ascii")
-        return f"data:image/png;base64,{data}"
+        return make_image_data_url(file_storage.exercise_images.load(file_name))
     elif kind == "http":
         return file_storage.exercise_images.get_get_url(file_name)
     else:
         assert False
 
 
+def make_images_data_urls(images: typing.Iterable[exercises.ExerciseImage]) -> adaptation.adapted.ImagesUrls:
+    # Exports need many images: load them concurrently
+    images_by_file_name = {f"{image.id}.png": image for image in images}
+    return {
+        images_by_file_name[file_name].local_identifier: make_image_data_url(data)
+        for (file_name, data) in file_storage.exercise_images.load_many(images_by_file_name.keys())
+    }
+
+
+def make_image_data_url(data: bytes) -> str:
+    return f"data:image/png;base64,{base64.b64encode(data).decode('ascii')}"
+
+
 def gather_images_urls(
     kind: typing.Literal["http", "data"], exercise: adaptation.AdaptableExercise
 ) -> adaptation.adapted.ImagesUrls:
-    available_images = dispatch.exercise_creation(
-        exercise.created,
-        by_user=lambda ec: [],
-        by_page_extraction=lambda ec: [creation.image for creation in ec.page_extraction.extracted_images],
-    )
-
     if kind == "http":
         # HTTP URLs are small and used during adjustments and manual edits, so we return all of them
-        return {image.local_identifier: make_image_url(kind, image) for image in available_images}
+        return {image.local_identifier: make_image_url(kind, image) for image in gather_available_images(exercise)}
     elif kind == "data":
         # Data URLs are large and used only for the export, so we return only the required ones
-        required_image_identifiers = {
-            identifier
-            for adaptation_ in exercise.unordered_adaptations
-            for identifier in _gather_required_image_identifiers_from_adaptation(adaptation_)
-        }
-        return {
-            image.local_identifier: make_image_url(kind, image)
-            for image in available_images
-            if image.local_identifier in required_image_identifiers
-        }
+        return make_images_data_urls(gather_required_images(exercise))
     else:
         assert False
 
 
+def gather_available_images(exercise: adaptation.AdaptableExercise) -> list[exercises.ExerciseImage]:
+    return dispatch.exercise_creation(
+        exercise.created,
+        by_user=lambda ec: [],
+        by_page_extraction=lambda ec: [creation.image for creation in ec.page_extraction.extracted_images],
+    )
+
+
+def gather_required_images(exercise: adaptation.AdaptableExercise) -> list[exercises.ExerciseImage]:
+    required_image_identifiers = {
+        identifier
+        for adaptation_ in exercise.unordered_adaptations
+        for identifier in _gather_required_image_identifiers_from_adaptation(adaptation_)
+    }
+    return [
+        image for image in gather_available_images(exercise) if image.local_identifier in required_image_identifiers
+    ]
+
+
 def make_api_adaptation_status(exercise_adaptation: adaptation.Adaptation) -> AdaptationStatus:
     adaptation_id = str(exercise_adaptation.id)
 
@@ -17,6 +17,7 @@
 import datetime
 import typing
 
+from sqlalchemy import orm
 import fastapi
 import sqlalchemy as sql
 
@@ -27,6 +28,7 @@ from .. import database_utils
 from .. import dispatching as dispatch
 from .. import exercises
 from .. import logs
+from .. import pending_work
 from .. import sandbox
 from .. import textbooks
 from ..any_json import JsonDict
@@ -207,7 +209,7 @@ class PostAdaptationBatchResponse(ApiModel):
 
 
 @router.post("/adaptation-batches")
-async def post_adaptation_batch(
+def post_adaptation_batch(
     req: PostAdaptationBatchRequest, session: database_utils.SessionDependable
 ) -> PostAdaptationBatchResponse:
     now = datetime.datetime.now(datetime.timezone.utc)
@@ -298,6 +300,7 @@ async def post_adaptation_batch(
             )
         )
 
+    pending_work.notify(session)
     session.flush()
 
     return PostAdaptationBatchResponse(id=str(adaptation_batch.id))
@@ -321,8 +324,20 @@ class GetAdaptationBatchResponse(ApiModel):
 
 
 @router.get("/adaptation-batches/{id}")
-async def get_adaptation_batch(id: str, session: database_utils.SessionDependable) -> GetAdaptationBatchResponse:
-    adaptation_batch = get_by_id(session, sandbox.adaptation.SandboxAdaptationBatch, id)
+def get_adaptation_batch(id: str, session: database_utils.SessionDependable) -> GetAdaptationBatchResponse:
+    adaptation_batch = get_by_id(
+        session,
+        sandbox.adaptation.SandboxAdaptationBatch,
+        id,
+        options=[
+            orm.selectinload(sandbox.adaptation.SandboxAdaptationBatch.adaptation_creations)
+            .joinedload(sandbox.adaptation.AdaptationCreationBySandboxBatch.exercise_adaptation)
+            .undefer_group("edits"),
+            orm.selectinload(sandbox.adaptation.SandboxAdaptationBatch.adaptation_creations)
+            .joinedload(sandbox.adaptation.AdaptationCreationBySandboxBatch.exercise_adaptation)
+            .selectinload(adaptation.Adaptation.ordered_adjustments),
+        ],
+    )
 
     api_exercises: list[GetAdaptationBatchResponse.Exercise] = []
     timing = GetAdaptationBatchResponse.Timing(adaptations=[])
@@ -450,9 +465,11 @@ def put_adaptable_exercise_class(
                 )
             )
 
+    pending_work.notify(session)
+
 
 @router.get("/adaptation-batches")
-async def get_adaptation_batches(
+def get_adaptation_batches(
     session: database_utils.SessionDependable, chunkId: str | None = None
 ) -> GetAdaptationBatchesResponse:
     (batches, next_chunk_id) = paginate(sandbox.adaptation.SandboxAdaptationBatch, session, chunkId)
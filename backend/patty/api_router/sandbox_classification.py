@@ -16,6 +16,7 @@
 
 import datetime
 
+from sqlalchemy import orm
 import fastapi
 
 from . import previewable_exercise
@@ -24,8 +25,9 @@ from .. import classification
 from .. import database_utils
 from .. import exercises
 from .. import logs
+from .. import pending_work
 from .. import sandbox
-from ..api_utils import ApiModel, get_by_id, paginate, assert_isinstance
+from ..api_utils import ApiModel, ApiTestCaseWithDatabase, get_by_id, paginate, assert_isinstance
 
 
 router = fastapi.APIRouter()
@@ -84,6 +86,7 @@ def create_classification_batch(
             )
         )
 
+    pending_work.notify(session)
     session.flush()
 
     return PostClassificationBatchResponse(id=str(classification_batch.id))
@@ -108,10 +111,18 @@ class GetClassificationBatchResponse(ApiModel):
 
 
 @router.get("/classification-batches/{id}")
-async def get_classification_batch(
-    id: str, session: database_utils.SessionDependable
-) -> GetClassificationBatchResponse:
-    classification_batch = get_by_id(session, sandbox.classification.SandboxClassificationBatch, id)
+def get_classification_batch(id: str, session: database_utils.SessionDependable) -> GetClassificationBatchResponse:
+    classification_batch = get_by_id(
+        session,
+        sandbox.classification.SandboxClassificationBatch,
+        id,
+        options=previewable_exercise.make_loader_options(
+            orm.joinedload(sandbox.classification.SandboxClassificationBatch.classification_chunk_creation)
+            .joinedload(sandbox.classification.ClassificationChunkCreationBySandboxBatch.classification_chunk)
+            .selectinload(classification.ClassificationChunk.classifications)
+            .selectinload(classification.ClassificationByChunk.exercise)
+        ),
+    )
     needs_refresh = False
 
     timing = GetClassificationBatchResponse.Timing(
@@ -226,6 +237,8 @@ def submit_adaptations_with_recent_settings_in_classification_batch(
                 )
             )
 
+    pending_work.notify(session)
+
 
 @router.put("/classification-batches/{id}/model-for-adaptation")
 def put_classification_batch_model_for_adaptation(
@@ -260,6 +273,8 @@ def put_classification_batch_model_for_adaptation(
                 )
             )
 
+    pending_work.notify(session)
+
 
 class GetClassificationBatchesResponse(ApiModel):
     class ClassificationBatch(ApiModel):
@@ -272,7 +287,7 @@ class GetClassificationBatchesResponse(ApiModel):
 
 
 @router.get("/classification-batches")
-async def get_classification_batches(
+def get_classification_batches(
     session: database_utils.SessionDependable, chunkId: str | None = None
 ) -> GetClassificationBatchesResponse:
     (batches, next_chunk_id) = paginate(sandbox.classification.SandboxClassificationBatch, session, chunkId)
@@ -288,3 +303,55 @@ async def get_classification_batches(
         ],
         next_chunk_id=next_chunk_id,
     )
+
+
+class GetClassificationBatchTestCase(ApiTestCaseWithDatabase):
+    api_router = router
+
+    def test_statements_count(self) -> None:
+        from .. import fixtures
+
+        fixtures.load(self.session, False, ["dummy-classification-batch"])
+        self.session.commit()
+
+        with self.assert_statements_count(11):
+            response = self.client.get("/classification-batches/1")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(len(response.json()["exercises"]), 2)
+
+        creator = fixtures.FixturesCreator(self.session)
+        chunk = self.session.get(classification.ClassificationChunk, 1)
+        assert chunk is not None
+        exercise_class = self.session.get(adaptation.ExerciseClass, 1)
+        assert exercise_class is not None
+        assert exercise_class.latest_strategy_settings is not None
+        for number in ["2", "3", "4"]:
+            exercise = creator.add(
+                adaptation.AdaptableExercise(
+                    created=exercises.ExerciseCreationByUser(at=fixtures.created_at, username="Patty"),
+                    location=exercises.ExerciseLocationMaybePageAndNumber(page_number=1, exercise_number=number),
+                    full_text="Avec adaptation",
+                    instruction_hint_example_text=None,
+                    statement_text=None,
+                )
+            )
+            creator.add(
+                classification.ClassificationByChunk(
+                    at=fixtures.created_at, exercise=exercise, classification_chunk=chunk, exercise_class=exercise_class
+                )
+            )
+            creator.make_successful_adaptation(
+                created=creator.add(
+                    classification.AdaptationCreationByChunk(at=fixtures.created_at, classification_chunk=chunk)
+                ),
+                model=adaptation.llm.DummyModel(provider="dummy", name="dummy-1"),
+                settings=exercise_class.latest_strategy_settings,
+                exercise=exercise,
+            )
+        self.session.commit()
+
+        # Constant whatever the number of exercises, thanks to eager loading
+        with self.assert_statements_count(11):
+            response = self.client.get("/classification-batches/1")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(len(response.json()["exercises"]), 5)
@@ -16,6 +16,7 @@
 
 import datetime
 
+from sqlalchemy import orm
 import fastapi
 import sqlalchemy as sql
 
@@ -26,9 +27,10 @@ from .. import database_utils
 from .. import exercises
 from .. import extraction
 from .. import logs
+from .. import pending_work
 from .. import sandbox
 from ..any_json import JsonDict
-from ..api_utils import ApiModel, get_by_id, paginate, assert_isinstance
+from ..api_utils import ApiModel, ApiTestCaseWithDatabase, get_by_id, paginate, assert_isinstance
 from ..version import PATTY_VERSION
 
 
@@ -171,6 +173,7 @@ def create_extraction_batch(
         )
         session.add(page)
 
+    pending_work.notify(session)
     session.flush()
 
     return PostExtractionBatchResponse(id=str(extraction_batch.id))
@@ -205,8 +208,29 @@ class GetExtractionBatchResponse(ApiModel):
 
 
 @router.get("/extraction-batches/{id}")
-async def get_extraction_batch(id: str, session: database_utils.SessionDependable) -> GetExtractionBatchResponse:
-    extraction_batch = get_by_id(session, sandbox.extraction.SandboxExtractionBatch, id)
+def get_extraction_batch(id: str, session: database_utils.SessionDependable) -> GetExtractionBatchResponse:
+    page_extractions = orm.selectinload(sandbox.extraction.SandboxExtractionBatch.page_extraction_creations).joinedload(
+        sandbox.extraction.PageExtractionCreationBySandboxBatch.page_extraction
+    )
+    extraction_batch = get_by_id(
+        session,
+        sandbox.extraction.SandboxExtractionBatch,
+        id,
+        options=[
+            orm.joinedload(sandbox.extraction.SandboxExtractionBatch.settings),
+            page_extractions.selectinload(extraction.PageExtraction.extracted_images).joinedload(
+                extraction.ExerciseImageCreationByPageExtraction.image
+            ),
+            page_extractions.selectinload(extraction.PageExtraction.classification_chunk_creations).joinedload(
+                extraction.ClassificationChunkCreationByPageExtraction.classification_chunk
+            ),
+            *previewable_exercise.make_loader_options(
+                page_extractions.selectinload(extraction.PageExtraction.exercise_creations__ordered_by_id).selectinload(
+                    extraction.ExerciseCreationByPageExtraction.exercise.of_type(adaptation.AdaptableExercise)
+                )
+            ),
+        ],
+    )
     needs_refresh = False
     pages: list[GetExtractionBatchResponse.Page] = []
 
@@ -374,6 +398,8 @@ def submit_adaptations_with_recent_settings_in_extraction_batch(
                     )
                 )
 
+    pending_work.notify(session)
+
 
 @router.put("/extraction-batches/{id}/run-classification")
 def put_extraction_batch_run_classification(id: str, session: database_utils.SessionDependable) -> None:
@@ -402,6 +428,8 @@ def put_extraction_batch_run_classification(id: str, session: database_utils.Ses
                 )
             )
 
+    pending_work.notify(session)
+
 
 @router.put("/extraction-batches/{id}/model-for-adaptation")
 def put_extraction_batch_model_for_adaptation(
@@ -456,6 +484,8 @@ def put_extraction_batch_model_for_adaptation(
                     )
                 )
 
+    pending_work.notify(session)
+
 
 class GetExtractionBatchesResponse(ApiModel):
     class ExtractionBatch(ApiModel):
@@ -468,7 +498,7 @@ class GetExtractionBatchesResponse(ApiModel):
 
 
 @router.get("/extraction-batches")
-async def get_extraction_batches(
+def get_extraction_batches(
     session: database_utils.SessionDependable, chunkId: str | None = None
 ) -> GetExtractionBatchesResponse:
     (batches, next_chunk_id) = paginate(sandbox.extraction.SandboxExtractionBatch, session, chunkId)
@@ -483,3 +513,59 @@ async def get_extraction_batches(
         ],
         next_chunk_id=next_chunk_id,
     )
+
+
+class GetExtractionBatchTestCase(ApiTestCaseWithDatabase):
+    api_router = router
+
+    def test_statements_count(self) -> None:
+        from .. import fixtures
+
+        fixtures.load(self.session, False, ["dummy-extraction-batch"])
+        self.session.commit()
+
+        with self.assert_statements_count(16):
+            response = self.client.get("/extraction-batches/1")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(len(response.json()["pages"][0]["exercises"]), 2)
+
+        creator = fixtures.FixturesCreator(self.session)
+        page_extraction = self.session.get(extraction.PageExtraction, 1)
+        assert page_extraction is not None
+        chunk = self.session.get(classification.ClassificationChunk, 1)
+        assert chunk is not None
+        exercise_class = self.session.get(adaptation.ExerciseClass, 1)
+        assert exercise_class is not None
+        assert exercise_class.latest_strategy_settings is not None
+        for number in ["3", "4", "5"]:
+            exercise = creator.add(
+                adaptation.AdaptableExercise(
+                    created=extraction.ExerciseCreationByPageExtraction(
+                        at=fixtures.created_at, page_extraction=page_extraction
+                    ),
+                    location=exercises.ExerciseLocationMaybePageAndNumber(page_number=10, exercise_number=number),
+                    full_text="Complète.\na. ...\nb. ...",
+                    instruction_hint_example_text="Complète.",
+                    statement_text="a. ...\nb. ...",
+                )
+            )
+            creator.add(
+                classification.ClassificationByChunk(
+                    exercise=exercise, at=fixtures.created_at, classification_chunk=chunk, exercise_class=exercise_class
+                )
+            )
+            creator.make_successful_adaptation(
+                created=creator.add(
+                    classification.AdaptationCreationByChunk(at=fixtures.created_at, classification_chunk=chunk)
+                ),
+                settings=exercise_class.latest_strategy_settings,
+                model=adaptation.llm.DummyModel(provider="dummy", name="dummy-1"),
+                exercise=exercise,
+            )
+        self.session.commit()
+
+        # Constant whatever the number of exercises, thanks to eager loading
+        with self.assert_statements_count(16):
+            response = self.client.get("/extraction-batches/1")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(len(response.json()["pages"][0]["exercises"]), 5)
@@ -17,10 +17,17 @@
 from __future__ import annotations
 from typing import Literal
 import datetime
+import io
+import tempfile
+import unittest
+import unittest.mock
+import zipfile
 
+from sqlalchemy import orm
 import fastapi
 import sqlalchemy as sql
 
+from . import export
 from . import previewable_exercise
 from .. import adaptation
 from .. import classification
@@ -29,8 +36,10 @@ from .. import exercises
 from .. import external_exercises
 from .. import extraction
 from .. import file_storage
+from .. import pending_work
 from .. import textbooks
-from ..api_utils import ApiModel, get_by_id
+from ..any_json import JsonDict
+from ..api_utils import ApiModel, ApiTestCaseWithDatabase, get_by_id
 
 
 router = fastapi.APIRouter()
@@ -154,6 +163,8 @@ def post_textbook(
             )
             session.add(extraction_batch)
 
+    pending_work.notify(session)
+
     return PostTextbookResponse(id=str(textbook.id))
 
 
@@ -236,16 +247,41 @@ class GetTextbookResponse(ApiModel):
 
 
 @router.get("/textbooks/{id}")
-async def get_textbook(id: str, session: database_utils.SessionDependable) -> GetTextbookResponse:
-    textbook = get_by_id(session, textbooks.Textbook, id)
+def get_textbook(id: str, session: database_utils.SessionDependable) -> GetTextbookResponse:
+    extraction_batches = orm.selectinload(textbooks.Textbook.extraction_batches)
+    textbook = get_by_id(
+        session,
+        textbooks.Textbook,
+        id,
+        options=[
+            orm.joinedload(textbooks.Textbook.single_pdf_file),
+            orm.selectinload(textbooks.Textbook.lessons),
+            extraction_batches.joinedload(textbooks.TextbookExtractionBatch.pdf_file_range).joinedload(
+                extraction.PdfFileRange.pdf_file
+            ),
+            extraction_batches.selectinload(textbooks.TextbookExtractionBatch.page_extraction_creations)
+            .joinedload(textbooks.PageExtractionCreationByTextbook.page_extraction)
+            .selectinload(extraction.PageExtraction.exercise_creations__ordered_by_id)
+            .selectinload(extraction.ExerciseCreationByPageExtraction.exercise)
+            .selectinload(exercises.Exercise.location),
+        ],
+    )
 
     pages_with_exercises: set[int] = set()
 
+    polymorphic_exercise = orm.with_polymorphic(
+        exercises.Exercise, [adaptation.AdaptableExercise, external_exercises.ExternalExercise]
+    )
     external_exercises_: list[GetTextbookResponse.ExternalExercise] = []
     for location in session.execute(
         sql.select(textbooks.ExerciseLocationTextbook)
         .where(textbooks.ExerciseLocationTextbook.textbook == textbook)
         .order_by(textbooks.ExerciseLocationTextbook.id)
+        .options(
+            orm.selectinload(textbooks.ExerciseLocationTextbook.exercise.of_type(polymorphic_exercise)).selectinload(
+                polymorphic_exercise.created
+            )
+        )
     ).scalars():
         exercise = location.exercise
         if isinstance(exercise, external_exercises.ExternalExercise):
@@ -408,8 +444,20 @@ class GetTextbookPageResponse(ApiModel):
 
 
 @router.get("/textbooks/{id}/pages/{number}")
-async def get_textbook_page(id: str, number: int, session: database_utils.SessionDependable) -> GetTextbookPageResponse:
-    textbook = get_by_id(session, textbooks.Textbook, id)
+def get_textbook_page(id: str, number: int, session: database_utils.SessionDependable) -> GetTextbookPageResponse:
+    textbook = get_by_id(
+        session,
+        textbooks.Textbook,
+        id,
+        options=[
+            orm.selectinload(textbooks.Textbook.extraction_batches).joinedload(
+                textbooks.TextbookExtractionBatch.pdf_file_range
+            ),
+            orm.selectinload(textbooks.Textbook.extraction_batches)
+            .selectinload(textbooks.TextbookExtractionBatch.page_extraction_creations)
+            .joinedload(textbooks.PageExtractionCreationByTextbook.page_extraction),
+        ],
+    )
     if number < 1 or (textbook.pages_count is not None and number > textbook.pages_count):
         raise fastapi.HTTPException(status_code=404, detail="Page not found")
 
@@ -439,6 +487,21 @@ async def get_textbook_page(id: str, number: int, session: database_utils.Sessio
             needs_refresh = True
         page_extractions.append(page_extraction_creation.page_extraction)
 
+    # Load the exercises of this page only, with everything needed to preview them
+    if len(page_extractions) > 0:
+        session.execute(
+            sql.select(extraction.PageExtraction)
+            .where(extraction.PageExtraction.id.in_([page_extraction.id for page_extraction in page_extractions]))
+            .options(
+                orm.selectinload(extraction.PageExtraction.created),
+                *previewable_exercise.make_loader_options(
+                    orm.selectinload(extraction.PageExtraction.exercise_creations__ordered_by_id).selectinload(
+                        extraction.ExerciseCreationByPageExtraction.exercise.of_type(adaptation.AdaptableExercise)
+                    )
+                ),
+            )
+        ).all()
+
     exercises_: list[GetTextbookPageResponse.AdaptableExercise | GetTextbookPageResponse.ExternalExercise] = []
     for page_extraction in page_extractions:
         for exercise_creation in page_extraction.exercise_creations__ordered_by_id:
@@ -506,13 +569,26 @@ async def get_textbook_page(id: str, number: int, session: database_utils.Sessio
                 )
             )
 
+    polymorphic_exercise = orm.with_polymorphic(
+        exercises.Exercise, [adaptation.AdaptableExercise, external_exercises.ExternalExercise]
+    )
     for location in session.execute(
         sql.select(textbooks.ExerciseLocationTextbook)
         .where(
             textbooks.ExerciseLocationTextbook.textbook == textbook,
             textbooks.ExerciseLocationTextbook.page_number == number,
+            # Exercises created by page extraction are handled above
+            ~sql.exists().where(
+                extraction.ExerciseCreationByPageExtraction.id == textbooks.ExerciseLocationTextbook.id
+            ),
         )
         .order_by(textbooks.ExerciseLocationTextbook.id)
+        .options(
+            *previewable_exercise.make_loader_options(
+                orm.selectinload(textbooks.ExerciseLocationTextbook.exercise.of_type(polymorphic_exercise)),
+                polymorphic_exercise.AdaptableExercise,
+            )
+        )
     ).scalars():
         exercise = location.exercise
         if isinstance(exercise, external_exercises.ExternalExercise):
@@ -602,7 +678,7 @@ class GetTextbooksResponse(ApiModel):
 
 
 @router.get("/textbooks")
-async def get_textbooks(session: database_utils.SessionDependable) -> GetTextbooksResponse:
+def get_textbooks(session: database_utils.SessionDependable) -> GetTextbooksResponse:
     textbooks_ = session.query(textbooks.Textbook).order_by(-textbooks.Textbook.id).all()
     return GetTextbooksResponse(
         textbooks=[
@@ -705,6 +781,86 @@ def put_textbook_lessons_removed(
     lesson.marked_as_removed = removed
 
 
+class PostTextbookExportRequest(ApiModel):
+    creator: str
+    format: textbooks.TextbookExportFormat
+
+
+class ApiTextbookExport(ApiModel):
+    id: str
+    format: textbooks.TextbookExportFormat
+    status: Literal["inProgress", "success", "error"]
+    url: str | None
+
+
+@router.post("/textbooks/{textbook_id}/exports")
+def post_textbook_export(
+    textbook_id: str, req: PostTextbookExportRequest, session: database_utils.SessionDependable
+) -> ApiTextbookExport:
+    # Rendering an export loads every file it contains, which takes too long for an HTTP request.
+    # So the submission daemon renders it in the background, and the client polls 'get_textbook_export'.
+    # Computing the hash only reads the database, so identical exports are detected here and served immediately.
+    textbook = get_by_id(session, textbooks.Textbook, textbook_id)
+    content_hash = export.hash_textbook_export(
+        req.format, export.get_textbook_data(textbook_id, session, export.BundledFiles())
+    )
+
+    textbook_export = (
+        session.execute(
+            sql.select(textbooks.TextbookExport)
+            .where(textbooks.TextbookExport.textbook == textbook)
+            .where(textbooks.TextbookExport.format == req.format)
+            .where(textbooks.TextbookExport.content_hash == content_hash)
+            .where(textbooks.TextbookExport.succeeded.is_not(False))  # Pending or succeeded
+            .order_by(textbooks.TextbookExport.id.desc())
+            .limit(1)
+        )
+        .scalars()
+        .first()
+    )
+
+    if textbook_export is None:
+        textbook_export = textbooks.TextbookExport(
+            created_at=datetime.datetime.now(datetime.timezone.utc),
+            created_by=req.creator,
+            textbook=textbook,
+            format=req.format,
+            content_hash=content_hash,
+        )
+        session.add(textbook_export)
+        session.flush()
+        pending_work.notify(session)
+
+    return make_api_textbook_export(textbook_export)
+
+
+@router.get("/textbook-exports/{id}")
+def get_textbook_export(id: str, session: database_utils.SessionDependable) -> ApiTextbookExport:
+    return make_api_textbook_export(get_by_id(session, textbooks.TextbookExport, id))
+
+
+def make_api_textbook_export(textbook_export: textbooks.TextbookExport) -> ApiTextbookExport:
+    if textbook_export.succeeded is None:
+        return ApiTextbookExport(
+            id=str(textbook_export.id), format=textbook_export.format, status="inProgress", url=None
+        )
+    elif textbook_export.succeeded:
+        return ApiTextbookExport(
+            id=str(textbook_export.id),
+            format=textbook_export.format,
+            status="success",
+            url=file_storage.textbook_exports.get_get_url(
+                textbook_export.artifact_key,
+                # Downloaded under the textbook's title, like the synchronous exports, instead of the artifact's hash
+                content_disposition=export.make_content_disposition(
+                    f"{textbook_export.textbook.title}.{textbook_export.format}"
+                ),
+            ),
+        )
+    else:
+        return ApiTextbookExport(id=str(textbook_export.id), format=textbook_export.format, status="error", url=None)
+
+
 class PostTextbookRangesRequest(ApiModel):
     creator: str
     pdf_file_sha256: str
@@ -715,9 +871,7 @@ class PostTextbookRangesRequest(ApiModel):
 
 
 @router.post("/textbooks/{id}/ranges")
-async def post_textbook_ranges(
-    id: str, req: PostTextbookRangesRequest, session: database_utils.SessionDependable
-) -> None:
+def post_textbook_ranges(id: str, req: PostTextbookRangesRequest, session: database_utils.SessionDependable) -> None:
     textbook = get_by_id(session, textbooks.Textbook, id)
     pdf_file = session.get(extraction.PdfFile, req.pdf_file_sha256)
     if pdf_file is None:
@@ -772,6 +926,8 @@ async def post_textbook_ranges(
                 )
             )
 
+    pending_work.notify(session)
+
 
 @router.put("/textbooks/{textbook_id}/ranges/{range_id}/removed")
 def put_textbook_ranges_removed(
@@ -864,6 +1020,8 @@ def post_textbook_manual_exercises_chunks(
             )
             session.add(adaptation_)
 
+    pending_work.notify(session)
+
 
 class SubmitAdaptationsWithRecentSettingsRequest(ApiModel):
     model_for_adaptation: adaptation.llm.ConcreteModel
@@ -911,3 +1069,256 @@ def submit_adaptations_with_recent_settings_in_classification_batch(
             approved_at=None,
         )
         session.add(adaptation_)
+
+    pending_work.notify(session)
+
+
+class GetTextbookTestCase(ApiTestCaseWithDatabase):
+    api_router = router
+
+    def test_statements_count(self) -> None:
+        from .. import fixtures
+
+        fixtures.load(self.session, False, ["dummy-textbook-with-pdf-range", "dummy-textbook-with-manual-exercises"])
+        self.session.commit()
+
+        (textbook, extracted_page, manual_page) = self.get_and_assert_statements_counts()
+        self.assertEqual(textbook["pagesWithExercises"], [40])
+        self.assertEqual(len(extracted_page["exercises"]), 4)
+        self.assertEqual(len(manual_page["exercises"]), 1)
+
+        creator = fixtures.FixturesCreator(self.session)
+        extracted_exercise = self.session.get(adaptation.AdaptableExercise, 1)
+        assert extracted_exercise is not None
+        assert isinstance(extracted_exercise.created, extraction.ExerciseCreationByPageExtraction)
+        page_extraction = extracted_exercise.created.page_extraction
+        assert isinstance(extracted_exercise.location, textbooks.ExerciseLocationTextbook)
+        extracted_textbook = extracted_exercise.location.textbook
+        assert isinstance(extracted_exercise.latest_classification, classification.ClassificationByChunk)
+        classification_chunk = extracted_exercise.latest_classification.classification_chunk
+        exercise_class = extracted_exercise.latest_classification.exercise_class
+        assert exercise_class is not None
+        assert exercise_class.latest_strategy_settings is not None
+        settings = exercise_class.latest_strategy_settings
+        manual_exercise = self.session.get(adaptation.AdaptableExercise, 5)
+        assert manual_exercise is not None
+        assert isinstance(manual_exercise.location, textbooks.ExerciseLocationTextbook)
+        manual_textbook = manual_exercise.location.textbook
+        model = adaptation.llm.DummyModel(provider="dummy", name="dummy-1")
+
+        for exercise_number in ["12", "14", "16"]:
+            exercise = creator.add(
+                adaptation.AdaptableExercise(
+                    created=extraction.ExerciseCreationByPageExtraction(
+                        at=fixtures.created_at, page_extraction=page_extraction
+                    ),
+                    location=textbooks.ExerciseLocationTextbook(
+                        textbook=extracted_textbook,
+                        page_number=40,
+                        exercise_number=exercise_number,
+                        marked_as_removed=False,
+                    ),
+                    full_text="Complète.",
+                    instruction_hint_example_text="Complète.",
+                    statement_text="",
+                )
+            )
+            creator.add(
+                classification.ClassificationByChunk(
+                    exercise=exercise,
+                    at=fixtures.created_at,
+                    classification_chunk=classification_chunk,
+                    exercise_class=exercise_class,
+                )
+            )
+            creator.make_successful_adaptation(
+                created=creator.add(
+                    classification.AdaptationCreationByChunk(
+                        at=fixtures.created_at, classification_chunk=classification_chunk
+                    )
+                ),
+                settings=settings,
+                model=model,
+                exercise=exercise,
+            )
+        for textbook_, page_number, exercise_number in [
+            (manual_textbook, 12, "2"),
+            (manual_textbook, 12, "3"),
+            (extracted_textbook, 41, "1"),
+            (extracted_textbook, 42, "1"),
+        ]:
+            exercise = creator.add(
+                adaptation.AdaptableExercise(
+                    created=exercises.ExerciseCreationByUser(at=fixtures.created_at, username="Patty"),
+                    location=textbooks.ExerciseLocationTextbook(
+                        textbook=textbook_,
+                        page_number=page_number,
+                        exercise_number=exercise_number,
+                        marked_as_removed=False,
+                    ),
+                    full_text="Ceci est un exercice manuel.",
+                    instruction_hint_example_text=None,
+                    statement_text=None,
+                )
+            )
+            creator.add(
+                classification.ClassificationByUser(
+                    exercise=exercise, at=fixtures.created_at, username="Patty", exercise_class=exercise_class
+                )
+            )
+            creator.make_successful_adaptation(
+                created=creator.add(textbooks.AdaptationCreationByTextbook(at=fixtures.created_at, textbook=textbook_)),
+                settings=settings,
+                model=model,
+                exercise=exercise,
+            )
+        self.session.commit()
+
+        # Constant whatever the number of pages and exercises, thanks to eager loading
+        (textbook, extracted_page, manual_page) = self.get_and_assert_statements_counts()
+        self.assertEqual(textbook["pagesWithExercises"], [40, 41, 42])
+        self.assertEqual(len(extracted_page["exercises"]), 7)
+        self.assertEqual(len(manual_page["exercises"]), 3)
+
+    def get_and_assert_statements_counts(self) -> list[JsonDict]:
+        responses = []
+        for url, expected_statements_count in [
+            ("/textbooks/1", 10),
+            ("/textbooks/1/pages/40", 18),
+            ("/textbooks/2/pages/12", 12),
+        ]:
+            with self.subTest(url=url):
+                with self.assert_statements_count(expected_statements_count):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200, response.text)
+                responses.append(response.json())
+        return responses
+
+
+class TextbookExportTestCase(ApiTestCaseWithDatabase):
+    api_router = router
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        # The actual template is built with the frontend
+        template_file = tempfile.NamedTemporaryFile(mode="w", suffix=".html")
+        template_file.write("<html><head></head><body>##TO_BE_SUBSTITUTED_TEXTBOOK_EXPORT_DATA##</body></html>")
+        template_file.flush()
+        self.enterContext(template_file)
+        self.enterContext(unittest.mock.patch.object(export, "export_textbook_template_file_path", template_file.name))
+
+
+class ReusedTextbookExportTestCase(TextbookExportTestCase):
+    def test_export_is_reused_until_textbook_changes(self) -> None:
+        from .. import fixtures
+
+        fixtures.load(self.session, False, ["dummy-textbook-with-manual-exercises"])
+        self.session.commit()
+
+        response = self.client.post("/textbooks/1/exports", json={"creator": "Alice", "format": "html"})
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.json(), {"id": "1", "format": "html", "status": "inProgress", "url": None})
+        self.session.commit()
+
+        # Requested again before it's rendered: same export
+        response = self.client.post("/textbooks/1/exports", json={"creator": "Bob", "format": "html"})
+        self.assertEqual(response.json()["id"], "1")
+        self.session.commit()
+
+        self.assertTrue(export.execute_next_textbook_export(self.session))
+        self.assertFalse(export.execute_next_textbook_export(self.session))
+        self.session.commit()
+
+        response = self.client.get("/textbook-exports/1")
+        self.assertEqual(response.json()["status"], "success")
+        self.assertIsNotNone(response.json()["url"])
+
+        # Requested again after it's rendered: same export, immediately available
+        response = self.client.post("/textbooks/1/exports", json={"creator": "Alice", "format": "html"})
+        self.assertEqual(response.json()["id"], "1")
+        self.assertEqual(response.json()["status"], "success")
+        self.session.commit()
+
+        # Textbook changed: new export
+        self.session.get_one(textbooks.Textbook, 1).title = "Changed title"
+        self.session.commit()
+        response = self.client.post("/textbooks/1/exports", json={"creator": "Alice", "format": "html"})
+        self.assertEqual(response.json(), {"id": "2", "format": "html", "status": "inProgress", "url": None})
+
+
+class RenderedTextbookExportTestCase(TextbookExportTestCase):
+    def test_rendered_artifacts(self) -> None:
+        from .. import fixtures
+        from ..file_storage import file_system_engine
+
+        fixtures.load(self.session, False, ["dummy-textbook-with-pdf-range"])
+        lesson = textbooks.Lesson(
+            created_at=datetime.datetime.now(datetime.timezone.utc),
+            created_by="Alice",
+            textbook=self.session.get_one(textbooks.Textbook, 1),
+            page_number=40,
+            original_file_name="lesson.pdf",
+            marked_as_removed=False,
+        )
+        self.session.add(lesson)
+        self.session.flush()
+        file_storage.lessons.store(str(lesson.id), b"Lesson's contents")
+        self.session.commit()
+        self.app.include_router(file_system_engine.router)
+
+        for format in ["html", "zip"]:
+            response = self.client.post("/textbooks/1/exports", json={"creator": "Alice", "format": format})
+            self.session.commit()
+            self.assertTrue(export.execute_next_textbook_export(self.session))
+            self.session.commit()
+            textbook_export = self.session.get_one(textbooks.TextbookExport, int(response.json()["id"]))
+            self.assertTrue(textbook_export.succeeded)
+
+            url = self.client.get(f"/textbook-exports/{textbook_export.id}").json()["url"]
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.headers["Content-Disposition"], f'attachment; filename="Dummy Textbook Title.{format}"'
+            )
+            if format == "html":
+                # Same as rendered synchronously
+                self.assertEqual(
+                    response.text,
+                    export.render_template(
+                        export.export_textbook_template_file_path,
+                        "TEXTBOOK_EXPORT_DATA",
+                        export.get_textbook_data("1", self.session, export.InlinedFiles()),
+                    ),
+                )
+            else:
+                with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
+                    self.assertEqual(zip_file.read(f"assets/lessons/{lesson.id}.pdf"), b"Lesson's contents")
+
+        # Old exports are deleted, with their artifacts
+        self.assertEqual(
+            export.delete_old_textbook_exports(self.session, datetime.datetime.now(datetime.timezone.utc)), 2
+        )
+        self.session.commit()
+        self.assertEqual(self.client.get("/textbook-exports/1").status_code, 404)
+        self.assertFalse(file_storage.textbook_exports.has(textbook_export.artifact_key))
+
+
+class FailedTextbookExportTestCase(TextbookExportTestCase):
+    def test_database_error(self) -> None:
+        from .. import fixtures
+
+        fixtures.load(self.session, False, ["dummy-textbook-with-manual-exercises"])
+        self.session.commit()
+        self.client.post("/textbooks/1/exports", json={"creator": "Alice", "format": "html"})
+        self.session.commit()
+
+        def render_textbook_export(session: database_utils.Session, textbook_export: textbooks.TextbookExport) -> None:
+            session.execute(sql.text("SELECT 1 / 0"))  # Aborts the transaction
+
+        with unittest.mock.patch.object(export, "render_textbook_export", render_textbook_export):
+            self.assertTrue(export.execute_next_textbook_export(self.session))
+        self.session.commit()
+
+        self.assertFalse(self.session.get_one(textbooks.TextbookExport, 1).succeeded)
+        self.assertEqual(self.client.get("/textbook-exports/1").json()["status"], "error")
@@ -18,6 +18,7 @@ import typing
 
 from sqlalchemy import orm
 import fastapi
+import fastapi.testclient
 import pydantic.alias_generators
 import sqlalchemy as sql
 
@@ -33,12 +34,18 @@ class ApiModel(pydantic.BaseModel):
 Model = typing.TypeVar("Model", bound=database_utils.OrmBase)
 
 
-def get_by_id(session: database_utils.Session, model: type[Model], id: str) -> Model:
+def get_by_id(
+    session: database_utils.Session,
+    model: type[Model],
+    id: str,
+    *,
+    options: typing.Sequence[orm.strategy_options._AbstractLoad] = (),
+) -> Model:
     try:
         numerical_id = int(id)
     except ValueError:
         raise fastapi.HTTPException(status_code=404, detail=f"{model.__name__} not found")
-    instance = session.get(model, numerical_id)
+    instance = session.get(model, numerical_id, options=options)
     if instance is None:
         raise fastapi.HTTPException(status_code=404, detail=f"{model.__name__} not found")
     return instance
@@ -80,3 +87,16 @@ T1 = typing.TypeVar("T1")
 def assert_isinstance(value: typing.Any, type_: type[T1]) -> T1:
     assert isinstance(value, type_)
     return value
+
+
+class ApiTestCaseWithDatabase(database_utils.TestCaseWithDatabase):
+    api_router: typing.ClassVar[fastapi.APIRouter]
+
+    def setUp(self) -> None:
+        from . import authentication
+
+        super().setUp()
+        self.app = fastapi.FastAPI(database_engine=self.engine)
+        self.app.include_router(self.api_router)
+        self.access_token = authentication.login(authentication.PostTokenRequest(password="password")).access_token
+        self.client = fastapi.testclient.TestClient(self.app, headers={"Authorization": f"Bearer {self.access_token}"})
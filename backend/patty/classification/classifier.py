@@ -0,0 +1,212 @@
+# MALIN Platform https://malin.cahiersfantastiques.fr/
+# Copyright 2025 Vincent Jacques <vincent@vincent-jacques.net>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import os
+import tempfile
+import typing
+import unittest
+import unittest.mock
+
+import torch
+import transformers  # type: ignore[import-untyped]
+
+from .. import logs
+from .. import settings
+from .models import SingleBert
+
+
+MAX_SEQUENCE_LENGTH = 256
+
+labels_by_id = [
+    "Associe",
+    "AssocieCoche",
+    "CM",
+    "CacheIntrus",
+    "Classe",
+    "ClasseCM",
+    "CliqueEcrire",
+    "CocheGroupeMots",
+    "CocheIntrus",
+    "CocheLettre",
+    "CocheMot",
+    "CocheMot*",
+    "CochePhrase",
+    "Echange",
+    "EditPhrase",
+    "EditTexte",
+    "ExpressionEcrite",
+    "GenreNombre",
+    "Phrases",
+    "Question",
+    "RC",
+    "RCCadre",
+    "RCDouble",
+    "RCImage",
+    "Texte",
+    "Trait",
+    "TransformeMot",
+    "TransformePhrase",
+    "VraiFaux",
+]
+
+
+ClassificationBackend = typing.Literal["fp32", "int8"]
+
+
+class Classifier:
+    # Loads the tokenizer and the model once, to classify many chunks of exercises
+
+    def __init__(self, model_path: str, backend: ClassificationBackend) -> None:
+        self.device = torch.device("cpu")
+
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(
+            os.path.join(os.path.dirname(__file__), "models/camembert_base"), do_lower_case=True
+        )
+
+        logs.log(f"Loading classification model from {model_path}")
+        model: SingleBert = torch.load(model_path, weights_only=False, map_location=self.device)
+        model.to(self.device)
+        model.eval()
+        if backend == "int8":
+            logs.log("Quantizing classification model to int8")
+            # Dynamic quantization of the linear layers (most of CamemBERT's weights and compute)
+            self.model: torch.nn.Module = torch.ao.quantization.quantize_dynamic(  # type: ignore[no-untyped-call]
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        else:
+            assert backend == "fp32"
+            self.model = model
+
+    def classify(self, instructions: list[str], statements: list[str]) -> list[str]:
+        # 'SingleBert' averages the embeddings of all positions, *including padding*, like it did during training.
+        # So we must keep padding to 'MAX_SEQUENCE_LENGTH': padding to the longest sequence would change predictions.
+        inputs = self.tokenizer(
+            instructions,
+            statements,
+            max_length=MAX_SEQUENCE_LENGTH,
+            truncation=True,
+            padding="max_length",
+            return_token_type_ids=True,
+            add_special_tokens=True,
+            return_tensors="pt",
+        )
+        batch_size = max(1, settings.CLASSIFICATION_TOKENS_PER_BATCH // MAX_SEQUENCE_LENGTH)
+
+        predicted_label_ids: list[int] = []
+        with torch.inference_mode():
+            for begin in range(0, len(instructions), batch_size):
+                end = begin + batch_size
+                outputs: torch.Tensor = self.model(
+                    inputs["input_ids"][begin:end].to(self.device),
+                    attention_mask=inputs["attention_mask"][begin:end].to(self.device),
+                    token_type_ids=inputs["token_type_ids"][begin:end].to(self.device),
+                )
+                predicted_label_ids.extend(outputs.argmax(-1).tolist())
+
+        return [labels_by_id[id] for id in predicted_label_ids]
+
+
+class ClassifierTestCase(unittest.TestCase):
+    instructions = [
+        "Écris les noms représentés par les dessins.",
+        "Recopie les phrases en les complétant avec le ou la.",
+        "Souligne le verbe dans chaque phrase.",
+        "Relie chaque mot à son contraire.",
+        "Vrai ou faux ? Coche la bonne réponse.",
+    ]
+    statements = [
+        "a. ... b. ... c. ...",
+        "a. Je vois ... chat. b. Elle mange ... pomme.",
+        "a. Le chat dort. b. Les enfants jouent dans la cour.",
+        "grand • • petit / chaud • • froid",
+        "a. Le soleil est une étoile. b. La Lune est une planète.",
+    ]
+
+    def make_random_model_file(self) -> str:
+        # A tiny 'SingleBert' with random weights, to test the classifier without the actual (large) model
+        torch.manual_seed(0)
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        camembert_path = os.path.join(directory, "camembert-tiny")
+        transformers.CamembertModel(
+            transformers.CamembertConfig(
+                vocab_size=32005,
+                hidden_size=16,
+                num_hidden_layers=2,
+                num_attention_heads=2,
+                intermediate_size=32,
+                max_position_embeddings=MAX_SEQUENCE_LENGTH + 2,
+            )
+        ).save_pretrained(camembert_path)
+        model_path = os.path.join(directory, "model.pt")
+        torch.save(SingleBert(camembert_path, labels_by_id), model_path)
+        return model_path
+
+    def test_batches(self) -> None:
+        classifier = Classifier(self.make_random_model_file(), "fp32")
+        instructions = [f"{self.instructions[i % 5]} ({i})" for i in range(40)]
+        statements = [" ".join(self.statements[(i + j) % 5] for j in range(i % 7 + 1)) for i in range(40)]
+
+        # The labels of this random model hardly depend on the exercise, so its outputs are compared too
+        batches_outputs: list[torch.Tensor] = []
+
+        def record_outputs(module: torch.nn.Module, args: typing.Any, output: torch.Tensor) -> None:
+            batches_outputs.append(output)
+
+        hook = classifier.model.register_forward_hook(record_outputs)
+        labels = classifier.classify(instructions, statements)
+        hook.remove()
+        self.assertEqual(
+            len(batches_outputs), math.ceil(40 / (settings.CLASSIFICATION_TOKENS_PER_BATCH // MAX_SEQUENCE_LENGTH))
+        )
+
+        # Same as when classifying one exercise at a time, padded by hand
+        expected_outputs = []
+        with torch.inference_mode():
+            for instruction, statement in zip(instructions, statements):
+                inputs = classifier.tokenizer(
+                    instruction,
+                    statement,
+                    max_length=MAX_SEQUENCE_LENGTH,
+                    truncation=True,
+                    return_token_type_ids=True,
+                    add_special_tokens=True,
+                )
+                padding_length = MAX_SEQUENCE_LENGTH - len(inputs["input_ids"])
+                outputs = classifier.model(
+                    torch.tensor([inputs["input_ids"] + [classifier.tokenizer.pad_token_id] * padding_length]),
+                    attention_mask=torch.tensor([inputs["attention_mask"] + [0] * padding_length]),
+                    token_type_ids=torch.tensor([inputs["token_type_ids"] + [0] * padding_length]),
+                )
+                expected_outputs.append(outputs[0])
+        torch.testing.assert_close(torch.cat(batches_outputs), torch.stack(expected_outputs))
+        expected_labels = [labels_by_id[id] for id in torch.stack(expected_outputs).argmax(-1).tolist()]
+        self.assertEqual(labels, expected_labels)
+
+        # Whatever the batch size
+        with unittest.mock.patch.object(settings, "CLASSIFICATION_TOKENS_PER_BATCH", 3 * MAX_SEQUENCE_LENGTH):
+            self.assertEqual(classifier.classify(instructions, statements), expected_labels)
+
+    # Meaningful only with the actual model: the outputs of a random one are too close to each other
+    @unittest.skipUnless(os.path.exists(settings.CLASSIFICATION_CAMEMBERT_2025_05_20_PATH), "Needs the actual model")
+    def test_int8_agrees_with_fp32(self) -> None:
+        fp32_labels = Classifier(settings.CLASSIFICATION_CAMEMBERT_2025_05_20_PATH, "fp32").classify(
+            self.instructions, self.statements
+        )
+        int8_labels = Classifier(settings.CLASSIFICATION_CAMEMBERT_2025_05_20_PATH, "int8").classify(
+            self.instructions, self.statements
+        )
+        self.assertEqual(int8_labels, fp32_labels)
@@ -78,6 +78,10 @@ class ExerciseClassCreationByUser(ExerciseClassCreation):
 class Classification(OrmBase):
     __tablename__ = "classifications"
     __mapper_args__ = {"polymorphic_on": "kind"}
+    __table_args__ = (
+        # For the submission daemon to find pending classifications
+        sql.Index("ix_classifications__pending", "id", postgresql_where=sql.text("exercise_class_id IS NULL")),
+    )
 
     def __init__(
         self, *, exercise: AdaptableExercise, at: datetime.datetime, exercise_class: ExerciseClass | None
@@ -190,7 +194,7 @@ class ClassificationByChunk(Classification):
 
     id: orm.Mapped[int] = orm.mapped_column(sql.ForeignKey(Classification.id), primary_key=True)
 
-    classification_chunk_id: orm.Mapped[int] = orm.mapped_column(sql.ForeignKey(ClassificationChunk.id))
+    classification_chunk_id: orm.Mapped[int] = orm.mapped_column(sql.ForeignKey(ClassificationChunk.id), index=True)
     classification_chunk: orm.Mapped[ClassificationChunk] = orm.relationship(
         foreign_keys=[classification_chunk_id], remote_side=[ClassificationChunk.id], back_populates="classifications"
     )
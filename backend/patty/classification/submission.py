@@ -16,27 +16,18 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import datetime
-import os
-import typing
 
 from sqlalchemy import orm
-import datasets  # type: ignore[import-untyped]
-import numpy as np
 import pandas as pd
 import sqlalchemy as sql
-import torch
-import torch.utils.data
-import transformers  # type: ignore[import-untyped]
-
 
 from . import orm_models as db
 from .. import adaptation
 from .. import database_utils
 from .. import logs
+from .. import pending_work
 from .. import settings
-from .models import SingleBert
-
-MAX_SEQUENCE_LENGTH = 256
+from .classifier import Classifier
 
 
 def execute_next_classification_chunk(session: database_utils.Session) -> bool:
@@ -49,9 +40,17 @@ def execute_next_classification_chunk(session: database_utils.Session) -> bool:
         session.execute(
             sql.select(db.ClassificationChunk)
             .options(orm.load_only(db.ClassificationChunk.id))
-            .join(db.ClassificationByChunk)
-            .where(db.ClassificationByChunk.exercise_class == sql.null())
-            .distinct()
+            # 'FOR UPDATE' is not allowed with 'DISTINCT', so we use 'IN' instead of a join
+            .where(
+                db.ClassificationChunk.id.in_(
+                    sql.select(db.ClassificationByChunk.classification_chunk_id).where(
+                        db.ClassificationByChunk.exercise_class == sql.null()
+                    )
+                )
+            )
+            .order_by(db.ClassificationChunk.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
         )
         .scalars()
         .first()
@@ -104,100 +103,20 @@ def execute_next_classification_chunk(session: database_utils.Session) -> bool:
                     approved_at=None,
                 )
                 session.add(exercise_adaptation)
+        pending_work.notify(session)
         return True
 
 
-device = torch.device("cpu")
-model: SingleBert | None = None
+classifier: Classifier | None = None
 
 
 def classify(dataframe: pd.DataFrame) -> None:
-    global model
+    global classifier
 
-    if model is None:
-        logs.log(f"Loading classification model from {settings.CLASSIFICATION_CAMEMBERT_2025_05_20_PATH}")
-        model_: SingleBert = torch.load(
-            settings.CLASSIFICATION_CAMEMBERT_2025_05_20_PATH, weights_only=False, map_location=device
-        )
-        model = model_
-        model.to(device)
-        model.eval()
-
-    tokenizer = transformers.AutoTokenizer.from_pretrained(
-        os.path.join(os.path.dirname(__file__), "models/camembert_base"), do_lower_case=True, use_fast=False
-    )
+    if classifier is None:
+        classifier = Classifier(settings.CLASSIFICATION_CAMEMBERT_2025_05_20_PATH, settings.CLASSIFICATION_BACKEND)
 
     input_columns = dataframe[["instruction", "statement"]].fillna("")
-
-    input_ids: list[int] = []
-    attention_mask: list[int] = []
-    token_type_ids: list[int] = []
-    for _, instance in input_columns.iterrows():
-        inputs = tokenizer(
-            instance["instruction"],
-            instance["statement"],
-            max_length=MAX_SEQUENCE_LENGTH,
-            truncation=True,
-            return_token_type_ids=True,
-            add_special_tokens=True,
-        )
-
-        padding_length = MAX_SEQUENCE_LENGTH - len(inputs["input_ids"])
-        input_ids.append(inputs["input_ids"] + ([tokenizer.pad_token_id] * padding_length))
-        attention_mask.append(inputs["attention_mask"] + ([0] * padding_length))
-        token_type_ids.append(inputs["token_type_ids"] + ([0] * padding_length))
-
-    eval_dataset = datasets.Dataset.from_dict(
-        {
-            "input_ids": torch.tensor(input_ids),
-            "attention_mask": torch.tensor(attention_mask),
-            "token_type_ids": torch.tensor(token_type_ids),
-        }
+    dataframe.loc[:, "predicted_label"] = classifier.classify(
+        input_columns["instruction"].tolist(), input_columns["statement"].tolist()
     )
-    eval_dataset.set_format(type="torch", device=device)
-    eval_dataloader = torch.utils.data.DataLoader(
-        eval_dataset, sampler=torch.utils.data.SequentialSampler(eval_dataset), batch_size=1
-    )
-
-    predicted_label_ids: list[int] = []
-    for batch in eval_dataloader:
-        with torch.no_grad():
-            outputs: torch.Tensor = model(
-                batch["input_ids"], attention_mask=batch["attention_mask"], token_type_ids=batch["token_type_ids"]
-            )
-            prediction: np.ndarray[typing.Any, np.dtype[np.int32]]
-            for prediction in outputs.detach().cpu().numpy():
-                predicted_label_ids.append(prediction.argmax(-1))
-
-    labels_by_id = [
-        "Associe",
-        "AssocieCoche",
-        "CM",
-        "CacheIntrus",
-        "Classe",
-        "ClasseCM",
-        "CliqueEcrire",
-        "CocheGroupeMots",
-        "CocheIntrus",
-        "CocheLettre",
-        "CocheMot",
-        "CocheMot*",
-        "CochePhrase",
-        "Echange",
-        "EditPhrase",
-        "EditTexte",
-        "ExpressionEcrite",
-        "GenreNombre",
-        "Phrases",
-        "Question",
-        "RC",
-        "RCCadre",
-        "RCDouble",
-        "RCImage",
-        "Texte",
-        "Trait",
-        "TransformeMot",
-        "TransformePhrase",
-        "VraiFaux",
-    ]
-    dataframe.loc[:, "predicted_label"] = [labels_by_id[id] for id in predicted_label_ids]
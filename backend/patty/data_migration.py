@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from sqlalchemy import orm
 import sqlalchemy as sql
 
 from . import adaptation
@@ -37,7 +38,11 @@ def validate(session: database_utils.Session) -> None:
 def parse_all_json_fields(session: database_utils.Session) -> None:
     for adaptation_settings in session.execute(sql.select(adaptation.AdaptationSettings)).scalars():
         adaptation_settings.response_specification
-    for adaptation_ in session.execute(sql.select(adaptation.Adaptation)).scalars():
+    for adaptation_ in session.execute(
+        sql.select(adaptation.Adaptation).options(
+            orm.undefer_group("edits"), orm.selectinload(adaptation.Adaptation.ordered_adjustments)
+        )
+    ).scalars():
         adaptation_.adjustments
         adaptation_.initial_assistant_response
         adaptation_.manual_edit
@@ -63,5 +68,9 @@ def parse_all_json_fields(session: database_utils.Session) -> None:
 
 
 def make_all_api_objects(session: database_utils.Session) -> None:
-    for adaptation_ in session.execute(sql.select(adaptation.Adaptation)).scalars():
+    for adaptation_ in session.execute(
+        sql.select(adaptation.Adaptation).options(
+            orm.undefer_group("edits"), orm.selectinload(adaptation.Adaptation.ordered_adjustments)
+        )
+    ).scalars():
         api_router.adaptations.make_api_adaptation(adaptation_)
@@ -14,7 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Annotated, Any, Iterable, TypeVar
+from typing import Annotated, Any, Callable, Iterable, TypeVar
 import contextlib
 import datetime
 import os
@@ -37,8 +37,8 @@ Engine = sqlalchemy.Engine
 Session = orm.Session
 
 
-def create_engine(url: str, echo: bool = False) -> Engine:
-    return sqlalchemy.create_engine(url, echo=echo)
+def create_engine(url: str, echo: bool = False, pool_size: int = 5) -> Engine:
+    return sqlalchemy.create_engine(url, echo=echo, pool_size=pool_size)
 
 
 def make_session(engine: Engine) -> Session:
@@ -62,6 +62,40 @@ class CreatedByUserMixin:
     created_at: orm.Mapped[datetime.datetime] = orm.mapped_column(sql.DateTime(timezone=True))
 
 
+T = TypeVar("T")
+
+
+class ParsedJsonCacheMixin:
+    # Properties exposing JSON columns as pydantic models can use this cache to validate the JSON only once per instance.
+    # Their setters must call 'forget_parsed_json', and the cache is cleared when the instance is refreshed or expired.
+
+    def get_parsed_json(self, key: str, parse: Callable[[], T]) -> T:
+        try:
+            return typing.cast(T, self.__dict__["_parsed_json_cache"][key])
+        except KeyError:
+            # Parse before getting the cache: loading expired attributes in 'parse' clears it
+            value = parse()
+            self.__dict__.setdefault("_parsed_json_cache", {})[key] = value
+            return value
+
+    def forget_parsed_json(self, key: str) -> None:
+        self.__dict__.get("_parsed_json_cache", {}).pop(key, None)
+
+    def forget_all_parsed_json(self) -> None:
+        self.__dict__.pop("_parsed_json_cache", None)
+
+
+@sql.event.listens_for(ParsedJsonCacheMixin, "refresh", propagate=True)
+def _forget_parsed_json_on_refresh(target: ParsedJsonCacheMixin, context: Any, attrs: Iterable[str] | None) -> None:
+    target.forget_all_parsed_json()
+
+
+@sql.event.listens_for(ParsedJsonCacheMixin, "expire", propagate=True)
+def _forget_parsed_json_on_expire(target: ParsedJsonCacheMixin | None, attrs: Iterable[str] | None) -> None:
+    if target is not None:  # The instance may have been garbage-collected
+        target.forget_all_parsed_json()
+
+
 OrderBy = list[sql.sql._typing._ColumnExpressionArgument[typing.Any]]
 
 
@@ -211,3 +245,19 @@ class TestCaseWithDatabase(unittest.TestCase):
         assert isinstance(cm.exception.orig, psycopg2.errors.IntegrityError)
         self.assertEqual(cm.exception.orig.diag.constraint_name, name)
         self.session.rollback()
+
+    @contextlib.contextmanager
+    def assert_statements_count(self, expected: int) -> typing.Generator[None, None, None]:
+        statements: list[str] = []
+
+        def before_cursor_execute(
+            conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+        ) -> None:
+            statements.append(statement)
+
+        sql.event.listen(self.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield None
+        finally:
+            sql.event.remove(self.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(len(statements), expected, "\n\n".join(statements))
@@ -17,6 +17,7 @@
 from . import assistant_responses as assistant_responses
 from . import extracted as extracted
 from . import llm as llm
+from . import preprocessing as preprocessing
 from . import submission as submission
 from .orm_models import (
     ClassificationChunkCreationByPageExtraction as ClassificationChunkCreationByPageExtraction,
@@ -33,14 +33,19 @@ def log(message: str) -> None:
 model: ultralytics.models.YOLO | None = None
 
 
-def detect_images(
-    identifier_prefix: str, input_pil_image: PIL.Image.Image
-) -> tuple[PIL.Image.Image, dict[str, PIL.Image.Image]]:
+def load_model() -> ultralytics.models.YOLO:
     global model
 
     if model is None:
         log(f"Loading images detection model from {settings.IMAGES_DETECTION_MODEL_2025_09_15_PATH}")
         model = ultralytics.models.YOLO(settings.IMAGES_DETECTION_MODEL_2025_09_15_PATH)
+    return model
+
+
+def detect_images(
+    identifier_prefix: str, input_pil_image: PIL.Image.Image
+) -> tuple[PIL.Image.Image, dict[str, PIL.Image.Image]]:
+    model = load_model()
 
     font = cv2.FONT_HERSHEY_SIMPLEX
     font_scale = 0.8
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import abc
+import hashlib
 import json
 import typing
 
@@ -22,6 +23,8 @@ import PIL.Image
 import pydantic
 import json_repair
 
+from ... import llm_cache
+from ... import rate_limits
 from .. import extracted
 
 
@@ -45,15 +48,19 @@ class NotJsonLlmException(LlmException):
 
 
 class Model(abc.ABC, pydantic.BaseModel):
-    def extract_v2(self, prompt: str, image: PIL.Image.Image) -> list[extracted.ExerciseV2]:
-        return self._extract(extracted.ExercisesV2List, prompt, image, lambda s: s, json.loads)[2]
+    # Narrowed to literals by each concrete model
+    provider: str
+    name: str
 
-    def extract_v3(
+    async def extract_v2(self, prompt: str, image: PIL.Image.Image) -> list[extracted.ExerciseV2]:
+        return (await self._extract(extracted.ExercisesV2List, prompt, image, lambda s: s, json.loads))[2]
+
+    async def extract_v3(
         self, prompt: str, image: PIL.Image.Image, pre_cleanup: typing.Callable[[str], str]
     ) -> tuple[str, str, list[extracted.ExerciseV3]]:
-        return self._extract(extracted.ExercisesV3List, prompt, image, pre_cleanup, json_repair.loads)
+        return await self._extract(extracted.ExercisesV3List, prompt, image, pre_cleanup, json_repair.loads)
 
-    def _extract[T](
+    async def _extract[T](
         self,
         t: type[pydantic.RootModel[T]],
         prompt: str,
@@ -61,7 +68,27 @@ class Model(abc.ABC, pydantic.BaseModel):
         pre_cleanup: typing.Callable[[str], str],
         json_loads: typing.Callable[[str], typing.Any],
     ) -> tuple[str, str, T]:
-        raw_response = self.do_extract(prompt, image)
+        cache = llm_cache.responses_cache
+        if cache is None:
+            cached = None
+        else:
+            # The response is validated after being cached: the key includes everything the validation depends on,
+            # so that 'extract_v2' and 'extract_v3' with the same prompt and image do not share entries
+            cache_key = llm_cache.make_key(
+                self.model_dump(mode="json"),
+                prompt,
+                [image.mode, *image.size, hashlib.sha256(image.tobytes()).hexdigest()],
+                t.__name__,
+                t.model_json_schema(),
+                [make_function_key(pre_cleanup), make_function_key(json_loads)],
+            )
+            cached = await cache.get(cache_key)
+
+        if cached is None:
+            async with rate_limits.limiter.slot(self.provider, self.name):
+                raw_response = await self.do_extract(prompt, image)
+        else:
+            raw_response = cached.value["raw_response"]
 
         cleaned_response = raw_response.strip()
         if cleaned_response.startswith("```json"):
@@ -81,9 +108,18 @@ class Model(abc.ABC, pydantic.BaseModel):
 
         try:
             validated = t.model_validate(parsed).root
-            return raw_response, cleaned_response, validated
         except pydantic.ValidationError:
             raise InvalidJsonLlmException(raw_response=raw_response, cleaned_response=cleaned_response, parsed=parsed)
 
+        # Only valid responses are cached, so that retrying after an error calls the provider again
+        if cache is not None and cached is None:
+            await cache.store(cache_key, {"raw_response": raw_response})
+
+        return raw_response, cleaned_response, validated
+
     @abc.abstractmethod
-    def do_extract(self, prompt: str, image: PIL.Image.Image) -> str: ...
+    async def do_extract(self, prompt: str, image: PIL.Image.Image) -> str: ...
+
+
+def make_function_key(function: typing.Callable[..., typing.Any]) -> str:
+    return f"{function.__module__}.{getattr(function, '__qualname__', '')}"
@@ -30,7 +30,7 @@ class DummyModel(Model):
         "dummy-1", "dummy-2", "dummy-for-images", "dummy-for-textually-numbered-exercises", "dummy-for-errors"
     ]
 
-    def do_extract(self, prompt: str, image: PIL.Image.Image) -> str:
+    async def do_extract(self, prompt: str, image: PIL.Image.Image) -> str:
         if self.name == "dummy-for-images":
             return self.do_extract_for_images()
         elif self.name == "dummy-for-textually-numbered-exercises":
@@ -22,6 +22,7 @@ import google.genai.errors
 import PIL.Image
 
 from ... import logs
+from ... import rate_limits
 from ... import settings
 from ...retry import RetryableError
 from ...test_utils import costs_money
@@ -35,14 +36,14 @@ class GeminiModel(Model):
     provider: Literal["gemini"]
     name: Literal["gemini-2.0-flash", "gemini-2.5-flash", "gemini-3-flash-preview"]
 
-    def do_extract(self, prompt: str, image: PIL.Image.Image) -> str:
+    async def do_extract(self, prompt: str, image: PIL.Image.Image) -> str:
         contents: list[google.genai.types.ContentUnion] = [prompt, image]
         try:
-            response = client.models.generate_content(model=self.name, contents=contents).text
+            response = (await client.aio.models.generate_content(model=self.name, contents=contents)).text
         except google.genai.errors.ClientError as e:
             if e.code == 429:
                 logs.log(f"Gemini rate limit exceeded {e}")
-                raise RetryableError()
+                raise RetryableError(retry_after=rate_limits.parse_google_retry_delay(e.details))
             else:
                 raise
         else:
@@ -50,7 +51,7 @@ class GeminiModel(Model):
             return response
 
 
-class GeminiModelTestCase(unittest.TestCase):
+class GeminiModelTestCase(unittest.IsolatedAsyncioTestCase):
     def setUp(self) -> None:
         with open("../frontend/e2e-tests/inputs/test.pdf", "rb") as f:
             self.pdf_data = f.read()
@@ -163,22 +164,22 @@ class GeminiModelTestCase(unittest.TestCase):
     ]
 
     @costs_money
-    def test_extract_2_0_flash(self) -> None:
+    async def test_extract_2_0_flash(self) -> None:
         from ...fixtures import make_default_extraction_prompt_v2
-        from ..submission import pdf_page_as_image
+        from ..preprocessing import pdf_page_as_image
 
-        exercises = GeminiModel(provider="gemini", name="gemini-2.0-flash").extract_v2(
+        exercises = await GeminiModel(provider="gemini", name="gemini-2.0-flash").extract_v2(
             make_default_extraction_prompt_v2(), pdf_page_as_image(self.pdf_data, 2)
         )
         actual_ids = tuple(exercise.id for exercise in exercises)
         self.assertIn(actual_ids, self.possible_expected_ids)
 
     @costs_money
-    def test_extract_2_5_flash(self) -> None:
+    async def test_extract_2_5_flash(self) -> None:
         from ...fixtures import make_default_extraction_prompt_v2
-        from ..submission import pdf_page_as_image
+        from ..preprocessing import pdf_page_as_image
 
-        exercises = GeminiModel(provider="gemini", name="gemini-2.5-flash").extract_v2(
+        exercises = await GeminiModel(provider="gemini", name="gemini-2.5-flash").extract_v2(
             make_default_extraction_prompt_v2(), pdf_page_as_image(self.pdf_data, 2)
         )
         actual_ids = tuple(exercise.id for exercise in exercises)
@@ -30,7 +30,7 @@ from .. import adaptation
 from ..any_json import JsonDict
 from ..api_utils import ApiModel
 from ..classification import ClassificationChunkCreation, ModelForAdaptationMixin
-from ..database_utils import OrmBase, CreatedByUserMixin, annotate_new_tables
+from ..database_utils import OrmBase, CreatedByUserMixin, ParsedJsonCacheMixin, annotate_new_tables
 from ..exercises import ExerciseCreation, ExerciseImageCreation
 from ..logs import TimingData
 
@@ -138,8 +138,12 @@ class ExtractionSettings(OrmBase, CreatedByUserMixin):
         self.output_schema_description_ = value.model_dump()
 
 
-class PageExtraction(OrmBase, ModelForAdaptationMixin):
+class PageExtraction(OrmBase, ModelForAdaptationMixin, ParsedJsonCacheMixin):
     __tablename__ = "page_extractions"
+    __table_args__ = (
+        # For the submission daemon to find pending page extractions in FIFO order
+        sql.Index("ix_page_extractions__pending", "id", postgresql_where=sql.text("assistant_response IS NULL")),
+    )
 
     def __init__(
         self,
@@ -194,7 +198,8 @@ class PageExtraction(OrmBase, ModelForAdaptationMixin):
 
     run_classification: orm.Mapped[bool]
 
-    extracted_text_and_styles: orm.Mapped[str | None]
+    # Large, and only needed to submit and export the extraction: loaded on first access
+    extracted_text_and_styles: orm.Mapped[str | None] = orm.mapped_column(deferred=True)
 
     _assistant_response: orm.Mapped[JsonDict | None] = orm.mapped_column("assistant_response", sql.JSON)
 
@@ -203,10 +208,13 @@ class PageExtraction(OrmBase, ModelForAdaptationMixin):
         if self._assistant_response is None:
             return None
         else:
-            return assistant_responses.validate(self._assistant_response)
+            return self.get_parsed_json(
+                "assistant_response", lambda: assistant_responses.validate(self._assistant_response)
+            )
 
     @assistant_response.setter
     def assistant_response(self, value: assistant_responses.Response | None) -> None:
+        self.forget_parsed_json("assistant_response")
         if value is None:
             self._assistant_response = sql.null()
         else:
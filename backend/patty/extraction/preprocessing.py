@@ -0,0 +1,341 @@
+# MALIN Platform https://malin.cahiersfantastiques.fr/
+# Copyright 2025 Vincent Jacques <vincent@vincent-jacques.net>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# CPU-heavy preparation of a PDF page before sending it to the LLM (rasterization, images detection, PNG encoding,
+# text and styles extraction). It runs in a pool of processes so that the submission daemon's event loop
+# keeps awaiting in-flight LLM calls meanwhile.
+
+from collections.abc import Iterator
+import asyncio
+import concurrent.futures
+import contextlib
+import dataclasses
+import fcntl
+import io
+import multiprocessing
+import os
+import re
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+import cachetools
+import PIL.Image
+import pymupdf
+
+from .. import file_storage
+from ..file_storage.disk_cache import DiskCache
+from .. import logs
+from .. import settings
+from .images_detection import detect_images, load_model
+from .text_and_styles_extraction import extract_text_and_styles_from_pdf_page
+
+
+@dataclasses.dataclass
+class PreprocessedPage:
+    annotated_pdf_page_image: PIL.Image.Image
+    # PNG-encoded, by local identifier
+    detected_images: dict[str, bytes]
+    extracted_text_and_styles: str | None
+
+
+executor: concurrent.futures.ProcessPoolExecutor | None = None
+
+
+def start(max_workers: int) -> None:
+    global executor
+
+    assert executor is None
+    logs.log(f"Starting {max_workers} preprocessing process(es)")
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        # Not forking: the parent process may have running threads, and torch does not support being forked
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=load_model,
+    )
+
+
+async def preprocess_page(
+    sha256: str, page_number: int, first_page_number: int, last_page_number: int, extract_text_and_styles: bool
+) -> PreprocessedPage:
+    if executor is None:
+        start(1)
+    assert executor is not None
+    return await asyncio.get_running_loop().run_in_executor(
+        executor,
+        preprocess_page_sync,
+        sha256,
+        page_number,
+        first_page_number,
+        last_page_number,
+        extract_text_and_styles,
+    )
+
+
+# PDF files are read by path, from the storage or from its local cache (see 'get_pdf_path'), not kept in memory.
+# Each preprocessing process has its own in-memory caches
+pdf_documents_cache: cachetools.LRUCache[str, pymupdf.Document] = cachetools.LRUCache(maxsize=2)
+
+# Resolution of the PDF pages used for images detection and sent to the LLM (pdftoppm's default)
+PDF_PAGE_IMAGE_DPI = 150
+
+# Rasterizing a range of pages in one 'pdftoppm' invocation avoids parsing the whole PDF for each page
+RASTERIZATION_CHUNK_SIZE = 8
+
+pdf_page_images_cache = cachetools.LRUCache[tuple[str, int, int], PIL.Image.Image](maxsize=2 * RASTERIZATION_CHUNK_SIZE)
+
+# Behind the in-memory cache above, rasterized pages are cached on disk, where all preprocessing processes find them,
+# also after a restart (e.g. when extracting pages again with other settings). In the local cache of the file storage
+# if configured, else in a fixed temporary directory.
+PDF_PAGE_IMAGES_DISK_CACHE_NAMESPACE = "pdf-page-images"
+pdf_page_images_disk_cache: DiskCache | None = None
+
+
+def get_pdf_page_images_disk_cache() -> DiskCache:
+    global pdf_page_images_disk_cache
+    if pdf_page_images_disk_cache is None:
+        if file_storage.local_cache is None:
+            pdf_page_images_disk_cache = DiskCache(
+                os.path.join(tempfile.gettempdir(), "patty-pdf-page-images"), settings.FILE_STORAGE_CACHE_MAX_BYTES
+            )
+        else:
+            pdf_page_images_disk_cache = file_storage.local_cache
+    return pdf_page_images_disk_cache
+
+
+def preprocess_page_sync(
+    sha256: str, page_number: int, first_page_number: int, last_page_number: int, extract_text_and_styles: bool
+) -> PreprocessedPage:
+    pdf_page_image = get_pdf_page_image(sha256, page_number, first_page_number, last_page_number)
+
+    annotated_pdf_page_image, detected_images = detect_images(f"p{page_number}", pdf_page_image)
+
+    if extract_text_and_styles:
+        extracted_text_and_styles: str | None = extract_text_and_styles_from_pdf_page(
+            open_pdf_document(sha256), page_number
+        )
+    else:
+        extracted_text_and_styles = None
+
+    if settings.DETECTED_IMAGES_SAVE_PATH is not None:
+        pdf_page_image.save(f"{settings.DETECTED_IMAGES_SAVE_PATH}/{sha256}.p{page_number}.png")
+        annotated_pdf_page_image.save(f"{settings.DETECTED_IMAGES_SAVE_PATH}/{sha256}.p{page_number}.annotated.png")
+        for identifier, image in detected_images.items():
+            image.save(f"{settings.DETECTED_IMAGES_SAVE_PATH}/{sha256}.p{page_number}.extracted.{identifier}.png")
+        if extracted_text_and_styles is not None:
+            with open(
+                f"{settings.DETECTED_IMAGES_SAVE_PATH}/{sha256}.p{page_number}.text_and_styles.csv",
+                "w",
+                encoding="utf-8",
+            ) as f:
+                f.write(extracted_text_and_styles)
+
+    encoded_detected_images: dict[str, bytes] = {}
+    for identifier, image in detected_images.items():
+        image_bytes = io.BytesIO()
+        image.save(image_bytes, format="PNG")
+        encoded_detected_images[identifier] = image_bytes.getvalue()
+
+    return PreprocessedPage(
+        annotated_pdf_page_image=annotated_pdf_page_image,
+        detected_images=encoded_detected_images,
+        extracted_text_and_styles=extracted_text_and_styles,
+    )
+
+
+def get_pdf_path(sha256: str) -> str:
+    # Downloaded to the local cache if needed, which survives restarts when PATTY_FILE_STORAGE_CACHE_PATH is set
+    return file_storage.pdf_files.get_local_path(sha256)
+
+
+def open_pdf_document(sha256: str) -> pymupdf.Document:
+    if sha256 not in pdf_documents_cache:
+        # MuPDF reads the file on demand, instead of loading all of it in memory
+        pdf_documents_cache[sha256] = pymupdf.open(get_pdf_path(sha256), filetype="pdf")
+    return pdf_documents_cache[sha256]
+
+
+def get_pdf_page_image(sha256: str, page_number: int, first_page_number: int, last_page_number: int) -> PIL.Image.Image:
+    cache_key = (sha256, page_number, PDF_PAGE_IMAGE_DPI)
+    if cache_key in pdf_page_images_cache:
+        logs.log(f"Found image of page {page_number} of {sha256} in memory cache")
+        return pdf_page_images_cache[cache_key]
+
+    image = load_cached_pdf_page_image(sha256, page_number)
+    if image is None:
+        # Chunks are aligned on the range's first page, and rasterized under a lock shared by all processes:
+        # processes needing pages of the same chunk wait for the first one, then find their pages in the disk cache
+        first_rasterized_page_number = (
+            first_page_number + (page_number - first_page_number) // RASTERIZATION_CHUNK_SIZE * RASTERIZATION_CHUNK_SIZE
+        )
+        last_rasterized_page_number = min(last_page_number, first_rasterized_page_number + RASTERIZATION_CHUNK_SIZE - 1)
+        with lock_pdf_pages_rasterization(sha256, first_rasterized_page_number):
+            image = load_cached_pdf_page_image(sha256, page_number)
+            if image is None:
+                logs.log(f"Rasterizing pages {first_rasterized_page_number}-{last_rasterized_page_number} of {sha256}")
+                images = pdf_pages_as_images(
+                    get_pdf_path(sha256), first_rasterized_page_number, last_rasterized_page_number
+                )
+                for rasterized_page_number, rasterized_image in images.items():
+                    store_pdf_page_image(sha256, rasterized_page_number, rasterized_image)
+                image = images[page_number]
+
+    pdf_page_images_cache[cache_key] = image
+    return image
+
+
+def load_cached_pdf_page_image(sha256: str, page_number: int) -> PIL.Image.Image | None:
+    disk_cache = get_pdf_page_images_disk_cache()
+    storage_key = make_pdf_page_image_storage_key(sha256, page_number, PDF_PAGE_IMAGE_DPI)
+    data = disk_cache.get(PDF_PAGE_IMAGES_DISK_CACHE_NAMESPACE, storage_key)
+    if data is None:
+        if file_storage.pdf_page_images is None or not file_storage.pdf_page_images.has(storage_key):
+            return None
+        logs.log(f"Found image of page {page_number} of {sha256} in storage cache")
+        data = file_storage.pdf_page_images.load(storage_key)
+        disk_cache.put(PDF_PAGE_IMAGES_DISK_CACHE_NAMESPACE, storage_key, data)
+    image = PIL.Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def store_pdf_page_image(sha256: str, page_number: int, image: PIL.Image.Image) -> None:
+    storage_key = make_pdf_page_image_storage_key(sha256, page_number, PDF_PAGE_IMAGE_DPI)
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, format="PNG")
+    get_pdf_page_images_disk_cache().put(PDF_PAGE_IMAGES_DISK_CACHE_NAMESPACE, storage_key, image_bytes.getvalue())
+    if file_storage.pdf_page_images is not None:
+        file_storage.pdf_page_images.store(storage_key, image_bytes.getvalue())
+    pdf_page_images_cache[(sha256, page_number, PDF_PAGE_IMAGE_DPI)] = image
+
+
+@contextlib.contextmanager
+def lock_pdf_pages_rasterization(sha256: str, first_page_number: int) -> Iterator[None]:
+    # Lock files are empty, and hidden from the disk cache (whose scan skips dot-files): they are never removed
+    directory = os.path.join(get_pdf_page_images_disk_cache().path, PDF_PAGE_IMAGES_DISK_CACHE_NAMESPACE)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f".{sha256}.p{first_page_number}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def make_pdf_page_image_storage_key(sha256: str, page_number: int, dpi: int) -> str:
+    return f"{sha256}.p{page_number}.{dpi}dpi.png"
+
+
+def pdf_page_as_image(pdf: bytes | str, page_number: int) -> PIL.Image.Image:
+    return pdf_pages_as_images(pdf, page_number, page_number)[page_number]
+
+
+# Without an output file root, pdftoppm writes all pages to its standard output, as concatenated binary PPM images
+ppm_header = re.compile(rb"P6\s+(\d+)\s+(\d+)\s+(\d+)\s")
+
+
+def pdf_pages_as_images(
+    pdf: bytes | str, first_page_number: int, last_page_number: int, dpi: int = PDF_PAGE_IMAGE_DPI
+) -> dict[int, PIL.Image.Image]:
+    # 'pdf' is either the PDF data, or the path to a PDF file (which pdftoppm reads directly)
+    # Not using PyMuPDF or pdf2image:
+    #  - MuPDF allegedly has lesser rendering fidelity than Poppler's pdftoppm
+    #  - pdf2image writes the PDF to disk (in /tmp), which can be slow on a Raspberry Pi's SD card
+    #  - this is simple enough anyway
+    process = subprocess.run(
+        ["pdftoppm", "-f", str(first_page_number), "-l", str(last_page_number), "-r", str(dpi)]
+        + ([pdf] if isinstance(pdf, str) else []),
+        input=pdf if isinstance(pdf, bytes) else None,
+        capture_output=True,
+        check=True,
+    )
+    output = process.stdout
+
+    images: dict[int, PIL.Image.Image] = {}
+    offset = 0
+    page_number = first_page_number
+    while offset < len(output):
+        match = ppm_header.match(output, offset)
+        assert match is not None
+        width, height, max_value = (int(group) for group in match.groups())
+        assert max_value == 255
+        offset = match.end() + width * height * 3
+        images[page_number] = PIL.Image.frombytes("RGB", (width, height), output[match.end() : offset])
+        page_number += 1
+    assert page_number == last_page_number + 1
+    return images
+
+
+class PdfPagesAsImagesTestCase(unittest.TestCase):
+    def test_range_is_same_as_single_pages(self) -> None:
+        with open("../frontend/e2e-tests/inputs/test.pdf", "rb") as f:
+            pdf_data = f.read()
+
+        images = pdf_pages_as_images(pdf_data, 1, 3)
+
+        self.assertEqual(list(images.keys()), [1, 2, 3])
+        self.assertEqual(
+            [image.tobytes() for image in pdf_pages_as_images("../frontend/e2e-tests/inputs/test.pdf", 1, 3).values()],
+            [image.tobytes() for image in images.values()],
+        )
+        for page_number, image in images.items():
+            single_page_image = PIL.Image.open(
+                io.BytesIO(
+                    subprocess.run(
+                        ["pdftoppm", "-f", str(page_number), "-l", str(page_number)],
+                        input=pdf_data,
+                        capture_output=True,
+                        check=True,
+                    ).stdout
+                )
+            )
+            self.assertEqual(image.size, single_page_image.size)
+            self.assertEqual(image.tobytes(), single_page_image.tobytes())
+
+
+class GetPdfPageImageTestCase(unittest.TestCase):
+    def test_pages_are_rasterized_once_per_chunk(self) -> None:
+        rasterized: list[tuple[int, int]] = []
+
+        def pdf_pages_as_images(pdf: str, first_page_number: int, last_page_number: int) -> dict[int, PIL.Image.Image]:
+            rasterized.append((first_page_number, last_page_number))
+            return {
+                page_number: PIL.Image.new("RGB", (4, 4), (page_number, 0, 0))
+                for page_number in range(first_page_number, last_page_number + 1)
+            }
+
+        disk_cache_path = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(unittest.mock.patch(f"{__name__}.pdf_pages_as_images", pdf_pages_as_images))
+        self.enterContext(unittest.mock.patch(f"{__name__}.get_pdf_path", lambda sha256: f"{sha256}.pdf"))
+        self.enterContext(unittest.mock.patch.object(file_storage, "pdf_page_images", None))
+        self.enterContext(
+            unittest.mock.patch(f"{__name__}.pdf_page_images_disk_cache", DiskCache(disk_cache_path, 1024 * 1024))
+        )
+
+        def get_page(page_number: int) -> PIL.Image.Image:
+            # Each time with an empty in-memory cache, as in another process, or after a restart
+            with unittest.mock.patch.dict(pdf_page_images_cache, clear=True):
+                return get_pdf_page_image("abcd", page_number, first_page_number=3, last_page_number=20)
+
+        # Chunks are aligned on the range's first page
+        self.assertEqual(get_page(5).getpixel((0, 0)), (5, 0, 0))
+        self.assertEqual(rasterized, [(3, 10)])
+        self.assertEqual(get_page(3).getpixel((0, 0)), (3, 0, 0))
+        self.assertEqual(get_page(10).getpixel((0, 0)), (10, 0, 0))
+        self.assertEqual(rasterized, [(3, 10)])
+        self.assertEqual(get_page(19).getpixel((0, 0)), (19, 0, 0))
+        self.assertEqual(rasterized, [(3, 10), (19, 20)])
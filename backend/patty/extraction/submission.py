@@ -16,39 +16,42 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import datetime
-import io
-import subprocess
 import traceback
 import typing
 
-import cachetools
 import PIL.Image
 import sqlalchemy as sql
 
 from . import assistant_responses
 from . import orm_models as db
+from . import preprocessing
 from .. import adaptation
 from .. import classification
 from .. import database_utils
 from .. import exercises
 from .. import file_storage
 from .. import logs
-from .. import settings
+from .. import pending_work
+from .. import rate_limits
 from ..retry import RetryableError
-from .images_detection import detect_images
 from .postprocessing import cleanup_slashes, remove_styles
 from .llm import InvalidJsonLlmException, NotJsonLlmException
-from .text_and_styles_extraction import extract_text_and_styles_from_pdf_page
-
-
-pdf_data_cache = cachetools.TTLCache[str, bytes](maxsize=5, ttl=60 * 60)
 
 
 def submit_next_extraction(
-    can_retry: bool, session: database_utils.Session
+    max_retries: int, session: database_utils.Session
 ) -> typing.Coroutine[None, None, None] | None:
+    query = sql.select(db.PageExtraction).where(db.PageExtraction._assistant_response == sql.null())
+    throttled_models = rate_limits.limiter.throttled_models()
+    if len(throttled_models) > 0:
+        # Keep other models busy meanwhile
+        query = query.where(
+            sql.tuple_(
+                db.PageExtraction._model["provider"].as_string(), db.PageExtraction._model["name"].as_string()
+            ).not_in(throttled_models)
+        )
     extraction = (
-        session.execute(sql.select(db.PageExtraction).where(db.PageExtraction._assistant_response == sql.null()))
+        session.execute(query.order_by(db.PageExtraction.id).limit(1).with_for_update(skip_locked=True))
         .scalars()
         .first()
     )
@@ -56,6 +59,8 @@ def submit_next_extraction(
         return None
     else:
         logs.log(f"Found pending page extraction: {extraction.id}")
+        model = extraction.model
+        can_retry = rate_limits.limiter.consecutive_throttles(model.provider, model.name) < max_retries
         return submit_extraction(can_retry, session, extraction)
 
 
@@ -65,32 +70,22 @@ async def submit_extraction(
     from ..sandbox import extraction as sandbox_extraction  # noqa: F401 to populate ORM metadata
 
     assert page_extraction.pdf_file_range is not None
-    sha256 = page_extraction.pdf_file_range.pdf_file.sha256
-    if sha256 in pdf_data_cache:
-        logs.log(f"Found PDF data for page extraction {page_extraction.id} in cache")
-        pdf_data = pdf_data_cache[sha256]
-    else:
-        logs.log(f"Loading PDF data for page extraction {page_extraction.id}")
-        pdf_data = file_storage.pdf_files.load(sha256)
-        pdf_data_cache[sha256] = pdf_data
-    pdf_page_image = pdf_page_as_image(pdf_data, page_extraction.pdf_page_number)
-
-    annotated_pdf_page_image, detected_images = detect_images(f"p{page_extraction.pdf_page_number}", pdf_page_image)
-
-    if settings.DETECTED_IMAGES_SAVE_PATH is not None:
-        pdf_page_image.save(f"{settings.DETECTED_IMAGES_SAVE_PATH}/{sha256}.p{page_extraction.pdf_page_number}.png")
-        annotated_pdf_page_image.save(
-            f"{settings.DETECTED_IMAGES_SAVE_PATH}/{sha256}.p{page_extraction.pdf_page_number}.annotated.png"
-        )
-        for identifier, image in detected_images.items():
-            image.save(
-                f"{settings.DETECTED_IMAGES_SAVE_PATH}/{sha256}.p{page_extraction.pdf_page_number}.extracted.{identifier}.png"
-            )
+    output_schema_description = page_extraction.settings.output_schema_description
+    pdf_file_range = page_extraction.pdf_file_range
+    preprocessed_page = await preprocessing.preprocess_page(
+        pdf_file_range.pdf_file.sha256,
+        page_extraction.pdf_page_number,
+        pdf_file_range.first_page_number,
+        pdf_file_range.first_page_number + pdf_file_range.pages_count - 1,
+        extract_text_and_styles=(
+            output_schema_description.version == "v3" and output_schema_description.append_text_and_styles_to_prompt
+        ),
+    )
 
     created_at = datetime.datetime.now(tz=datetime.timezone.utc)
 
-    extracted_images: list[tuple[exercises.ExerciseImage, PIL.Image.Image]] = []
-    for identifier, image in detected_images.items():
+    extracted_images: list[tuple[exercises.ExerciseImage, bytes]] = []
+    for identifier, image in preprocessed_page.detected_images.items():
         extracted_image = exercises.ExerciseImage(
             local_identifier=identifier,
             created=db.ExerciseImageCreationByPageExtraction(at=created_at, page_extraction=page_extraction),
@@ -99,33 +94,18 @@ async def submit_extraction(
         extracted_images.append((extracted_image, image))
     session.flush()  # To get all extracted image ids
     for extracted_image, image in extracted_images:
-        image_bytes = io.BytesIO()
-        image.save(image_bytes, format="PNG")
-        image_bytes.seek(0)
-        file_storage.exercise_images.store(f"{extracted_image.id}.png", image_bytes.getvalue())
-
-    if page_extraction.settings.output_schema_description.version == "v2":
-        submit_extraction_v2(can_retry, session, page_extraction, annotated_pdf_page_image)
-    elif page_extraction.settings.output_schema_description.version == "v3":
-        if page_extraction.settings.output_schema_description.append_text_and_styles_to_prompt:
-            page_extraction.extracted_text_and_styles = extract_text_and_styles_from_pdf_page(
-                pdf_data, page_extraction.pdf_page_number
-            )
-            if settings.DETECTED_IMAGES_SAVE_PATH is not None:
-                with open(
-                    f"{settings.DETECTED_IMAGES_SAVE_PATH}/{sha256}.p{page_extraction.pdf_page_number}.text_and_styles.csv",
-                    "w",
-                    encoding="utf-8",
-                ) as f:
-                    f.write(page_extraction.extracted_text_and_styles)
-        else:
-            page_extraction.extracted_text_and_styles = None
-        submit_extraction_v3(can_retry, session, page_extraction, annotated_pdf_page_image)
+        file_storage.exercise_images.store(f"{extracted_image.id}.png", image)
+
+    if output_schema_description.version == "v2":
+        await submit_extraction_v2(can_retry, session, page_extraction, preprocessed_page.annotated_pdf_page_image)
+    elif output_schema_description.version == "v3":
+        page_extraction.extracted_text_and_styles = preprocessed_page.extracted_text_and_styles
+        await submit_extraction_v3(can_retry, session, page_extraction, preprocessed_page.annotated_pdf_page_image)
     else:
         assert False
 
 
-def submit_extraction_v2(
+async def submit_extraction_v2(
     can_retry: bool,
     session: database_utils.Session,
     page_extraction: db.PageExtraction,
@@ -136,7 +116,7 @@ def submit_extraction_v2(
     try:
         logs.log(f"Submitting page extraction {page_extraction.id}")
         with logs.timer() as timing:
-            extracted_exercises = page_extraction.model.extract_v2(
+            extracted_exercises = await page_extraction.model.extract_v2(
                 page_extraction.settings.prompt, annotated_pdf_page_image
             )
     except InvalidJsonLlmException as error:
@@ -203,7 +183,7 @@ def submit_extraction_v2(
         page_extraction.timing = timing
 
 
-def submit_extraction_v3(
+async def submit_extraction_v3(
     can_retry: bool,
     session: database_utils.Session,
     page_extraction: db.PageExtraction,
@@ -230,7 +210,7 @@ def submit_extraction_v3(
     try:
         logs.log(f"Submitting page extraction {page_extraction.id}")
         with logs.timer() as timing:
-            raw_response, cleaned_response, extracted_exercises = page_extraction.model.extract_v3(
+            raw_response, cleaned_response, extracted_exercises = await page_extraction.model.extract_v3(
                 prompt, annotated_pdf_page_image, pre_cleanup
             )
     except InvalidJsonLlmException as error:
@@ -374,12 +354,5 @@ def submit_follow_ups(
                     )
                 )
 
-
-def pdf_page_as_image(pdf_data: bytes, page_number: int) -> PIL.Image.Image:
-    # Not using PyMuPDF or pdf2image:
-    #  - MuPDF allegedly has lesser rendering fidelity than Poppler's pdftoppm
-    #  - pdf2image writes the PDF to disk (in /tmp), which can be slow on a Raspberry Pi's SD card
-    #  - this is simple enough anyway
-    page = str(page_number)
-    process = subprocess.run(["pdftoppm", "-f", page, "-l", page], input=pdf_data, capture_output=True, check=True)
-    return PIL.Image.open(io.BytesIO(process.stdout))
+    if classification_chunk is not None:
+        pending_work.notify(session)
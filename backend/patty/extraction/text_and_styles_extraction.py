@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
 import csv
 import io
 import re
@@ -25,15 +26,21 @@ import unittest
 import pymupdf
 
 
-def extract_text_and_styles_from_pdf_page(pdf_page: bytes, page_number: int) -> str:
+def extract_text_and_styles_from_pdf_page(pdf: bytes | pymupdf.Document, page_number: int) -> str:
     csv_file = io.StringIO()
     csv_writer = csv.writer(csv_file, delimiter=";")
     csv_writer.writerow(["phrase", "font_family", "size", "color_hex", "style_tag", "overrides"])
 
-    page = pymupdf.open("pdf", pdf_page)[page_number - 1]
+    if isinstance(pdf, bytes):
+        pdf = pymupdf.open("pdf", pdf)
+    page = pdf[page_number - 1]
     page_dict = page.get_text("dict")
     assert isinstance(page_dict, dict)
 
+    words = page.get_text("words")
+    assert isinstance(words, list)
+    words_index = WordsIndex(words)
+
     for block in page_dict.get("blocks", []):
         if block.get("type", 0) != 0:
             continue
@@ -63,8 +70,6 @@ def extract_text_and_styles_from_pdf_page(pdf_page: bytes, page_number: int) ->
             fam_d, tag_d, size_d, col_d = weighted_dominant_style(spans)
 
             overrides = []
-            words = page.get_text("words")
-            assert isinstance(words, list)
 
             x0 = min(s["bbox"][0] for s in spans)
             y0 = min(s["bbox"][1] for s in spans)
@@ -72,7 +77,7 @@ def extract_text_and_styles_from_pdf_page(pdf_page: bytes, page_number: int) ->
             y1 = max(s["bbox"][3] for s in spans)
             lbbox = (x0, y0, x1, y1)
 
-            for (wx0, wy0, wx1, wy1, word, *_rest) in words:
+            for wx0, wy0, wx1, wy1, word, *_rest in words_index.vertically_overlapping(y0, y1):
                 wbbox = (wx0, wy0, wx1, wy1)
                 if rect_intersection_area(lbbox, wbbox) <= 0:
                     continue
@@ -93,6 +98,23 @@ def extract_text_and_styles_from_pdf_page(pdf_page: bytes, page_number: int) ->
     return csv_file.getvalue()
 
 
+class WordsIndex:
+    # Words sorted by their top coordinate, to find words that may intersect a line without scanning the whole page
+
+    def __init__(self, words: list[typing.Any]) -> None:
+        self.words = words
+        self.order = sorted(range(len(words)), key=lambda index: words[index][1])
+        self.tops = [words[index][1] for index in self.order]
+        self.max_height = max((word[3] - word[1] for word in words), default=0.0)
+
+    def vertically_overlapping(self, y0: float, y1: float) -> list[typing.Any]:
+        # A word overlaps [y0, y1] only if its top is in ]y0 - max_height, y1[
+        begin = bisect.bisect_right(self.tops, y0 - self.max_height)
+        end = bisect.bisect_left(self.tops, y1)
+        # In page order, like 'page.get_text("words")'
+        return [self.words[index] for index in sorted(self.order[begin:end])]
+
+
 def to_hex_color(c: int | tuple[float, float, float] | list[float]) -> str:
     if isinstance(c, int):
         return f"#{c:06x}"
@@ -191,3 +213,14 @@ class ExtractTextAndStylesTestCase(unittest.TestCase):
                 """
             ),
         )
+
+    def test_opened_document(self) -> None:
+        with open("../frontend/e2e-tests/inputs/test.pdf", "rb") as f:
+            pdf_data = f.read()
+        pdf_document = pymupdf.open("pdf", pdf_data)
+
+        for page_number in [1, 2]:
+            self.assertEqual(
+                extract_text_and_styles_from_pdf_page(pdf_document, page_number),
+                extract_text_and_styles_from_pdf_page(pdf_data, page_number),
+            )
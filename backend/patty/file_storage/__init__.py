@@ -17,14 +17,27 @@
 import urllib.parse
 
 from .. import settings
+from .concurrent_loading import load_concurrently as load_concurrently
+from .disk_cache import DiskCache
 from .s3_engine import S3FileStorageEngine
 from .file_system_engine import FileSystemStorageEngine
 
 
-def make_storage_engine(prefix_url: str) -> S3FileStorageEngine | FileSystemStorageEngine:
+StorageEngine = S3FileStorageEngine | FileSystemStorageEngine
+
+
+local_cache = (
+    None
+    if settings.FILE_STORAGE_CACHE_PATH is None
+    else DiskCache(settings.FILE_STORAGE_CACHE_PATH, settings.FILE_STORAGE_CACHE_MAX_BYTES)
+)
+
+
+def make_storage_engine(prefix_url: str, *, immutable: bool = False) -> StorageEngine:
+    # 'immutable' storages never change the data stored under a given key, so it can be cached locally
     target = urllib.parse.urlparse(prefix_url)
     if target.scheme == "s3":
-        return S3FileStorageEngine(target)
+        return S3FileStorageEngine(target, local_cache if immutable else None)
     elif target.scheme == "file":
         return FileSystemStorageEngine(target)
     else:
@@ -33,5 +46,7 @@ def make_storage_engine(prefix_url: str) -> S3FileStorageEngine | FileSystemStor
 
 external_exercises = make_storage_engine(settings.EXTERNAL_EXERCISES_URL)
 lessons = make_storage_engine(settings.LESSONS_URL)
-pdf_files = make_storage_engine(settings.PDF_FILES_URL)
-exercise_images = make_storage_engine(settings.EXERCISE_IMAGES_URL)
+pdf_files = make_storage_engine(settings.PDF_FILES_URL, immutable=True)  # Keyed by their SHA-256
+exercise_images = make_storage_engine(settings.EXERCISE_IMAGES_URL, immutable=True)
+textbook_exports = make_storage_engine(settings.TEXTBOOK_EXPORTS_URL)
+pdf_page_images = None if settings.PDF_PAGE_IMAGES_URL is None else make_storage_engine(settings.PDF_PAGE_IMAGES_URL)
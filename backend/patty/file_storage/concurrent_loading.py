@@ -0,0 +1,66 @@
+# MALIN Platform https://malin.cahiersfantastiques.fr/
+# Copyright 2025 Vincent Jacques <vincent@vincent-jacques.net>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections.abc import Callable, Iterable
+import collections
+import concurrent.futures
+import threading
+import time
+import typing
+import unittest
+
+from .. import settings
+
+
+T = typing.TypeVar("T")
+
+
+def load_concurrently(load: Callable[[T], bytes], items: Iterable[T]) -> Iterable[tuple[T, bytes]]:
+    # Yields in the order of 'items', with at most 'FILE_STORAGE_LOAD_CONCURRENCY' loads in flight,
+    # so that loading many large files does not hold them all in memory.
+    concurrency = settings.FILE_STORAGE_LOAD_CONCURRENCY
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight: collections.deque[tuple[T, concurrent.futures.Future[bytes]]] = collections.deque()
+        for item in items:
+            if len(in_flight) == concurrency:
+                (done_item, future) = in_flight.popleft()
+                yield (done_item, future.result())
+            in_flight.append((item, executor.submit(load, item)))
+        while in_flight:
+            (done_item, future) = in_flight.popleft()
+            yield (done_item, future.result())
+
+
+class LoadConcurrentlyTestCase(unittest.TestCase):
+    def test_order_and_concurrency(self) -> None:
+        lock = threading.Lock()
+        current = 0
+        maximum = 0
+
+        def load(item: int) -> bytes:
+            nonlocal current, maximum
+            with lock:
+                current += 1
+                maximum = max(maximum, current)
+            # Later items finish first
+            time.sleep(0.001 * (50 - item))
+            with lock:
+                current -= 1
+            return str(item).encode()
+
+        self.assertEqual(list(load_concurrently(load, range(50))), [(i, str(i).encode()) for i in range(50)])
+        self.assertGreater(maximum, 1)
+        self.assertLessEqual(maximum, settings.FILE_STORAGE_LOAD_CONCURRENCY)
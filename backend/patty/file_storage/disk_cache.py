@@ -0,0 +1,203 @@
+# MALIN Platform https://malin.cahiersfantastiques.fr/
+# Copyright 2025 Vincent Jacques <vincent@vincent-jacques.net>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections.abc import Callable
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from .. import logs
+from .. import settings
+
+
+class DiskCache:
+    # A local read-through cache for objects that never change once stored (e.g. exercise images, PDF files),
+    # so entries are never invalidated. When its size exceeds 'max_bytes', least recently used entries are evicted.
+    # Several processes can share the same directory: files are written atomically.
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.size = sum(size for (_path, _mtime, size) in self.scan())
+        # Per process, for monitoring
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, namespace: str, key: str, load: Callable[[str], bytes]) -> bytes:
+        data = self.get(namespace, key)
+        if data is None:
+            data = load(key)
+            self.put(namespace, key, data)
+        return data
+
+    def get(self, namespace: str, key: str) -> bytes | None:
+        path = self.make_path(namespace, key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            self.count_miss(path)
+            return None
+        else:
+            self.count_hit(path)
+            return data
+
+    def put(self, namespace: str, key: str, data: bytes) -> None:
+        def write(temporary_path: str) -> None:
+            with open(temporary_path, "wb") as file:
+                file.write(data)
+
+        self.store(self.make_path(namespace, key), write)
+
+    def get_path(self, namespace: str, key: str, download: Callable[[str, str], None]) -> str:
+        # For tools that read files by path: 'download(key, path)' writes the object directly to disk
+        path = self.make_path(namespace, key)
+        if os.path.exists(path):
+            self.count_hit(path)
+        else:
+            self.count_miss(path)
+            self.store(path, lambda temporary_path: download(key, temporary_path))
+        return path
+
+    def make_path(self, namespace: str, key: str) -> str:
+        assert ".." not in namespace
+        assert ".." not in key
+        assert "/" not in key
+        return os.path.join(self.path, namespace, key)
+
+    def count_hit(self, path: str) -> None:
+        with self.lock:
+            self.hits += 1
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:  # Evicted meanwhile
+            pass
+
+    def count_miss(self, path: str) -> None:
+        with self.lock:
+            self.misses += 1
+        logs.log(f"Local cache miss for {path} ({self.hits} hits and {self.misses} misses so far)")
+
+    def store(self, path: str, write: Callable[[str], None]) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=".", delete=False) as file:
+            pass
+        try:
+            write(file.name)
+            size = os.path.getsize(file.name)
+            os.replace(file.name, path)
+        except BaseException:
+            os.remove(file.name)
+            raise
+        with self.lock:
+            self.size += size
+            if self.size > self.max_bytes:
+                self.evict(keep=path)
+
+    def evict(self, keep: str) -> None:
+        # Scan the directory instead of trusting 'self.size', to account for other processes' entries
+        entries = sorted(self.scan(), key=lambda entry: entry[1])
+        self.size = sum(size for (_path, _mtime, size) in entries)
+        for path, _mtime, size in entries:
+            if self.size <= self.max_bytes:
+                break
+            if path == keep:  # Just stored for the caller, even if it's larger than the budget
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # Evicted by another process
+                pass
+            self.size -= size
+
+    def scan(self) -> list[tuple[str, float, int]]:
+        entries = []
+        for directory, _subdirectories, file_names in os.walk(self.path):
+            for file_name in file_names:
+                if not file_name.startswith("."):  # Skip files being written
+                    path = os.path.join(directory, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        pass
+                    else:
+                        entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+
+temporary_cache: DiskCache | None = None
+temporary_cache_lock = threading.Lock()
+
+
+def get_temporary_cache() -> DiskCache:
+    # For when files must be on disk but PATTY_FILE_STORAGE_CACHE_PATH is not set: they are lost on restart
+    global temporary_cache
+    with temporary_cache_lock:
+        if temporary_cache is None:
+            temporary_cache = DiskCache(
+                tempfile.mkdtemp(prefix="patty-file-storage-cache-"), settings.FILE_STORAGE_CACHE_MAX_BYTES
+            )
+            atexit.register(shutil.rmtree, temporary_cache.path, ignore_errors=True)
+        return temporary_cache
+
+
+class DiskCacheTestCase(unittest.TestCase):
+    def test_read_through_and_eviction(self) -> None:
+        loaded: list[str] = []
+
+        def load(key: str) -> bytes:
+            loaded.append(key)
+            return key.encode() * 10
+
+        with tempfile.TemporaryDirectory() as path:
+            cache = DiskCache(path, max_bytes=25)
+
+            self.assertEqual(cache.get_or_load("ns", "a", load), b"a" * 10)
+            self.assertEqual(cache.get_or_load("ns", "a", load), b"a" * 10)
+            self.assertEqual(loaded, ["a"])
+
+            cache.get_or_load("ns", "b", load)
+            os.utime(os.path.join(path, "ns", "a"), (0, 0))  # Make 'a' the least recently used
+            cache.get_or_load("ns", "c", load)
+            self.assertEqual(sorted(os.listdir(os.path.join(path, "ns"))), ["b", "c"])
+            self.assertEqual(cache.size, 20)
+
+            cache.get_or_load("ns", "b", load)
+            cache.get_or_load("ns", "a", load)
+            self.assertEqual(loaded, ["a", "b", "c", "a"])
+
+    def test_get_path(self) -> None:
+        def download(key: str, path: str) -> None:
+            with open(path, "w") as file:
+                file.write(key * 30)
+
+        with tempfile.TemporaryDirectory() as path:
+            cache = DiskCache(path, max_bytes=25)
+
+            a_path = cache.get_path("ns", "a", download)
+            self.assertEqual(a_path, os.path.join(path, "ns", "a"))
+            self.assertEqual(cache.get_path("ns", "a", download), a_path)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            # Larger than the budget, but kept until something else is stored
+            self.assertTrue(os.path.exists(a_path))
+
+            cache.get_path("ns", "b", download)
+            self.assertEqual(sorted(os.listdir(os.path.join(path, "ns"))), ["b"])
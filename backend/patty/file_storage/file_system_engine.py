@@ -14,7 +14,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from collections.abc import Iterable
 import os
+import shutil
 import typing
 import urllib.parse
 
@@ -23,6 +25,7 @@ import jwt
 
 from .. import settings
 from ..api_utils import ApiModel
+from .concurrent_loading import load_concurrently
 
 
 class Token(ApiModel):
@@ -30,6 +33,7 @@ class Token(ApiModel):
     operation: typing.Literal["put", "get"]
     prefix: str
     key: str
+    content_disposition: str | None = None
 
 
 def make_path(prefix: str, key: str) -> str:
@@ -38,9 +42,13 @@ def make_path(prefix: str, key: str) -> str:
     return os.path.join(prefix, key)
 
 
-def make_url(operation: typing.Literal["put", "get"], prefix: str, key: str) -> str:
+def make_url(
+    operation: typing.Literal["put", "get"], prefix: str, key: str, content_disposition: str | None = None
+) -> str:
     token = jwt.encode(
-        Token(operation=operation, prefix=prefix, key=key).model_dump(mode="json"),
+        Token(operation=operation, prefix=prefix, key=key, content_disposition=content_disposition).model_dump(
+            mode="json"
+        ),
         settings.SECRET_JWT_KEY,
         algorithm="HS256",
     )
@@ -70,7 +78,15 @@ async def put_file(key: str, token: str, request: fastapi.Request) -> None:
 
 @router.get("/api/files/{key}")
 async def get_file(key: str, token: str) -> fastapi.responses.FileResponse:
-    return fastapi.responses.FileResponse(make_path(check_token(token, "get", key).prefix, key))
+    checked_token = check_token(token, "get", key)
+    return fastapi.responses.FileResponse(
+        make_path(checked_token.prefix, key),
+        headers=(
+            None
+            if checked_token.content_disposition is None
+            else {"Content-Disposition": checked_token.content_disposition}
+        ),
+    )
 
 
 class FileSystemStorageEngine:
@@ -86,6 +102,10 @@ class FileSystemStorageEngine:
         with open(self._make_path(key), "wb") as file:
             file.write(data)
 
+    def store_fileobj(self, key: str, data: typing.BinaryIO) -> None:
+        with open(self._make_path(key), "wb") as file:
+            shutil.copyfileobj(data, file)
+
     def get_put_url(self, key: str) -> str:
         return make_url("put", self.prefix, key)
 
@@ -96,8 +116,14 @@ class FileSystemStorageEngine:
         with open(self._make_path(key), "rb") as file:
             return file.read()
 
-    def get_get_url(self, key: str) -> str:
-        return make_url("get", self.prefix, key)
+    def load_many(self, keys: Iterable[str]) -> Iterable[tuple[str, bytes]]:
+        return load_concurrently(self.load, keys)
+
+    def get_local_path(self, key: str) -> str:
+        return self._make_path(key)
+
+    def get_get_url(self, key: str, *, content_disposition: str | None = None) -> str:
+        return make_url("get", self.prefix, key, content_disposition)
 
     def delete(self, key: str) -> None:
         try:
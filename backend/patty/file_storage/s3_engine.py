@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from collections.abc import Iterable
 import io
 import itertools
 import typing
@@ -22,21 +23,39 @@ import urllib.parse
 import boto3
 import botocore.client
 
-s3 = boto3.client("s3", config=botocore.client.Config(region_name="eu-west-3", signature_version="s3v4"))
+from .. import settings
+from .concurrent_loading import load_concurrently
+from .disk_cache import DiskCache, get_temporary_cache
+
+
+s3 = boto3.client(
+    "s3",
+    config=botocore.client.Config(
+        region_name="eu-west-3",
+        signature_version="s3v4",
+        # boto3's client is thread-safe, but it has only 10 connections by default
+        max_pool_connections=settings.FILE_STORAGE_LOAD_CONCURRENCY,
+    ),
+)
 
 
 class S3FileStorageEngine:
-    def __init__(self, target: urllib.parse.ParseResult) -> None:
+    def __init__(self, target: urllib.parse.ParseResult, cache: DiskCache | None = None) -> None:
         assert target.scheme == "s3"
         self.bucket = target.netloc
         assert target.path.startswith("/")
         assert not target.path.endswith("/")
         self.prefix = target.path[1:]
+        self.cache = cache
 
     def store(self, key: str, data: bytes) -> None:
         file = io.BytesIO(data)
         s3.put_object(Bucket=self.bucket, Key=self.__make_key(key), Body=file)
 
+    def store_fileobj(self, key: str, data: typing.BinaryIO) -> None:
+        # Uploaded in parts, so 'data' can be larger than the available memory
+        s3.upload_fileobj(data, Bucket=self.bucket, Key=self.__make_key(key))
+
     def get_put_url(self, key: str) -> str:
         return typing.cast(
             str,
@@ -56,16 +75,36 @@ class S3FileStorageEngine:
                 raise
 
     def load(self, key: str) -> bytes:
+        if self.cache is None:
+            return self.__load(key)
+        else:
+            return self.cache.get_or_load(self.__cache_namespace, key, self.__load)
+
+    def load_many(self, keys: Iterable[str]) -> Iterable[tuple[str, bytes]]:
+        return load_concurrently(self.load, keys)
+
+    def get_local_path(self, key: str) -> str:
+        # For tools that read files by path, without loading them in Python
+        cache = get_temporary_cache() if self.cache is None else self.cache
+        return cache.get_path(self.__cache_namespace, key, self.__download)
+
+    @property
+    def __cache_namespace(self) -> str:
+        return f"{self.bucket}/{self.prefix}"
+
+    def __download(self, key: str, path: str) -> None:
+        s3.download_file(Bucket=self.bucket, Key=self.__make_key(key), Filename=path)
+
+    def __load(self, key: str) -> bytes:
         object = s3.get_object(Bucket=self.bucket, Key=self.__make_key(key))
         return typing.cast(bytes, object["Body"].read())
 
-    def get_get_url(self, key: str) -> str:
-        return typing.cast(
-            str,
-            s3.generate_presigned_url(
-                "get_object", Params={"Bucket": self.bucket, "Key": self.__make_key(key)}, ExpiresIn=3600
-            ),
-        )
+    def get_get_url(self, key: str, *, content_disposition: str | None = None) -> str:
+        params = {"Bucket": self.bucket, "Key": self.__make_key(key)}
+        if content_disposition is not None:
+            # S3 then serves the object with this header, e.g. to download it under a given name
+            params["ResponseContentDisposition"] = content_disposition
+        return typing.cast(str, s3.generate_presigned_url("get_object", Params=params, ExpiresIn=3600))
 
     def delete(self, key: str) -> None:
         try:
@@ -1639,6 +1639,127 @@ class FixturesCreator:
             )
         )
 
+    def create_dummy_extraction_batch(self) -> None:
+        model_for_extraction = extraction.llm.DummyModel(provider="dummy", name="dummy-1")
+        model_for_adaptation = adaptation.llm.DummyModel(provider="dummy", name="dummy-1")
+
+        pdf_file = self.add(
+            extraction.PdfFile(
+                created_by="Patty",
+                created_at=created_at,
+                sha256="dummy_sha256_with_exercises",
+                bytes_count=123456,
+                pages_count=30,
+                known_file_names=["dummy_textbook.pdf"],
+            )
+        )
+        pdf_file_range = self.add(
+            extraction.PdfFileRange(
+                created_by="Patty", created_at=created_at, pdf_file=pdf_file, first_page_number=10, pages_count=1
+            )
+        )
+        settings = self.add(
+            extraction.ExtractionSettings(
+                created_by="Patty",
+                created_at=created_at,
+                prompt="Blah blah blah.",
+                output_schema_description=extraction.OutputSchemaDescriptionV2(version="v2"),
+            )
+        )
+        extraction_batch = self.add(
+            sandbox.extraction.SandboxExtractionBatch(
+                created_by="Patty",
+                created_at=created_at,
+                pdf_file_range=pdf_file_range,
+                settings=settings,
+                model=model_for_extraction,
+                run_classification=True,
+                model_for_adaptation=model_for_adaptation,
+            )
+        )
+        page_extraction = self.add(
+            extraction.PageExtraction(
+                created=sandbox.extraction.PageExtractionCreationBySandboxBatch(
+                    at=created_at, sandbox_extraction_batch=extraction_batch
+                ),
+                pdf_file_range=pdf_file_range,
+                pdf_page_number=10,
+                settings=settings,
+                model=model_for_extraction,
+                run_classification=True,
+                model_for_adaptation=model_for_adaptation,
+                extracted_text_and_styles=None,
+                assistant_response=extraction.assistant_responses.SuccessV2(
+                    kind="success",
+                    version="v2",
+                    exercises=[
+                        extraction.extracted.ExerciseV2(
+                            id=f"p10_ex{number}",
+                            type="exercice",
+                            images=False,
+                            type_images="none",
+                            properties=extraction.extracted.ExerciseV2.Properties(
+                                numero=number,
+                                consignes=["Complète."],
+                                conseil=None,
+                                exemple=None,
+                                enonce="a. ...\nb. ...",
+                                references=None,
+                                autre=None,
+                            ),
+                        )
+                        for number in ["1", "2"]
+                    ],
+                ),
+                timing=None,
+            )
+        )
+        self.add(
+            exercises.ExerciseImage(
+                local_identifier="p10_c1",
+                created=extraction.ExerciseImageCreationByPageExtraction(
+                    at=created_at, page_extraction=page_extraction
+                ),
+            )
+        )
+        exercise_class = self.create_dummy_branch(name="QCM", system_prompt="Blah blah QCM.")
+        assert exercise_class.latest_strategy_settings is not None
+        classification_chunk = self.add(
+            classification.ClassificationChunk(
+                created=extraction.ClassificationChunkCreationByPageExtraction(
+                    at=created_at, page_extraction=page_extraction
+                ),
+                model_for_adaptation=model_for_adaptation,
+                timing=None,
+            )
+        )
+        for number in ["1", "2"]:
+            exercise = self.add(
+                adaptation.AdaptableExercise(
+                    created=extraction.ExerciseCreationByPageExtraction(at=created_at, page_extraction=page_extraction),
+                    location=exercises.ExerciseLocationMaybePageAndNumber(page_number=10, exercise_number=number),
+                    full_text="Complète.\na. ...\nb. ...",
+                    instruction_hint_example_text="Complète.",
+                    statement_text="a. ...\nb. ...",
+                )
+            )
+            self.add(
+                classification.ClassificationByChunk(
+                    exercise=exercise,
+                    at=created_at,
+                    classification_chunk=classification_chunk,
+                    exercise_class=exercise_class,
+                )
+            )
+            self.make_successful_adaptation(
+                created=self.add(
+                    classification.AdaptationCreationByChunk(at=created_at, classification_chunk=classification_chunk)
+                ),
+                settings=exercise_class.latest_strategy_settings,
+                model=model_for_adaptation,
+                exercise=exercise,
+            )
+
     def create_textbook_with_failed_adaptation(self) -> None:
         model_for_extraction = extraction.llm.DummyModel(provider="dummy", name="dummy-1")
         model_for_adaptation = adaptation.llm.DummyModel(provider="dummy", name="dummy-1")
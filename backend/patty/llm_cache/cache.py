@@ -0,0 +1,132 @@
+# MALIN Platform https://malin.cahiersfantastiques.fr/
+# Copyright 2025 Vincent Jacques <vincent@vincent-jacques.net>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import datetime
+import hashlib
+import json
+
+import sqlalchemy as sql
+
+from .. import database_utils
+from .. import logs
+from .. import settings
+from ..any_json import JsonDict, JsonType
+from .orm_models import CachedLlmResponse
+
+
+def make_key(*parts: JsonType) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class LlmResponsesCache:
+    # Entries are keyed by a hash of everything sent to the provider, so they never need to be invalidated.
+    # They expire after 'ttl', and the oldest ones are removed when their total size exceeds 'max_bytes'.
+
+    def __init__(self, engine: database_utils.Engine, ttl: datetime.timedelta, max_bytes: int) -> None:
+        self.engine = engine
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    async def get(self, key: str) -> CachedLlmResponse | None:
+        return await asyncio.to_thread(self.get_sync, key)
+
+    def get_sync(self, key: str) -> CachedLlmResponse | None:
+        with database_utils.Session(self.engine) as session:
+            cached = session.execute(
+                sql.select(CachedLlmResponse).where(
+                    CachedLlmResponse.key == key,
+                    CachedLlmResponse.stored_at >= datetime.datetime.now(datetime.timezone.utc) - self.ttl,
+                )
+            ).scalar_one_or_none()
+        if cached is not None:
+            logs.log(f"Reusing cached LLM response {key}")
+        return cached
+
+    async def store(self, key: str, value: JsonDict) -> None:
+        await asyncio.to_thread(self.store_sync, key, value)
+
+    def store_sync(self, key: str, value: JsonDict) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with database_utils.Session(self.engine) as session:
+            session.merge(
+                CachedLlmResponse(key=key, stored_at=now, value=value, bytes_count=len(json.dumps(value).encode()))
+            )
+            try:
+                session.flush()
+            except sql.exc.IntegrityError:  # Stored concurrently by another process, for the same request
+                session.rollback()
+
+            session.execute(sql.delete(CachedLlmResponse).where(CachedLlmResponse.stored_at < now - self.ttl))
+            cumulated_sizes = sql.select(
+                CachedLlmResponse.key,
+                sql.func.sum(CachedLlmResponse.bytes_count)
+                .over(order_by=(CachedLlmResponse.stored_at.desc(), CachedLlmResponse.key))
+                .label("cumulated_bytes_count"),
+            ).subquery()
+            session.execute(
+                sql.delete(CachedLlmResponse).where(
+                    CachedLlmResponse.key.in_(
+                        sql.select(cumulated_sizes.c.key).where(
+                            cumulated_sizes.c.cumulated_bytes_count > self.max_bytes
+                        )
+                    )
+                )
+            )
+            session.commit()
+
+
+responses_cache = (
+    None
+    if settings.LLM_RESPONSES_CACHE_TTL is None
+    else LlmResponsesCache(
+        database_utils.create_engine(settings.DATABASE_URL, pool_size=2),
+        settings.LLM_RESPONSES_CACHE_TTL,
+        settings.LLM_RESPONSES_CACHE_MAX_BYTES,
+    )
+)
+
+
+class LlmResponsesCacheTestCase(database_utils.TestCaseWithDatabase):
+    def test_get_and_store(self) -> None:
+        cache = LlmResponsesCache(self.engine, datetime.timedelta(hours=1), 1000)
+        key = make_key({"provider": "dummy", "name": "dummy-1"}, "Blah blah blah.")
+
+        self.assertIsNone(cache.get_sync(key))
+        cache.store_sync(key, {"response": "Blah"})
+        cached = cache.get_sync(key)
+        assert cached is not None
+        self.assertEqual(cached.value, {"response": "Blah"})
+        self.assertIsNone(cache.get_sync(make_key({"provider": "dummy", "name": "dummy-2"}, "Blah blah blah.")))
+
+    def test_expiration(self) -> None:
+        cache = LlmResponsesCache(self.engine, datetime.timedelta(hours=1), 1000)
+        cache.store_sync("a", {"response": "A"})
+        self.session.execute(
+            sql.update(CachedLlmResponse).values(stored_at=CachedLlmResponse.stored_at - datetime.timedelta(hours=2))
+        )
+        self.session.commit()
+
+        self.assertIsNone(cache.get_sync("a"))
+        cache.store_sync("b", {"response": "B"})
+        self.assertEqual(self.session.execute(sql.select(CachedLlmResponse.key)).scalars().all(), ["b"])
+
+    def test_size_cap(self) -> None:
+        cache = LlmResponsesCache(self.engine, datetime.timedelta(hours=1), 50)
+        for key in ["a", "b", "c"]:
+            cache.store_sync(key, {"response": key * 10})  # 26 bytes each
+
+        self.assertEqual(self.session.execute(sql.select(CachedLlmResponse.key)).scalars().all(), ["c"])
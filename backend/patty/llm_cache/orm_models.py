@@ -0,0 +1,47 @@
+# MALIN Platform https://malin.cahiersfantastiques.fr/
+# Copyright 2025 Vincent Jacques <vincent@vincent-jacques.net>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import datetime
+
+from sqlalchemy import orm
+import sqlalchemy as sql
+
+from ..any_json import JsonDict
+from ..database_utils import OrmBase, annotate_new_tables
+
+
+class CachedLlmResponse(OrmBase):
+    __tablename__ = "cached_llm_responses"
+
+    def __init__(self, *, key: str, stored_at: datetime.datetime, value: JsonDict, bytes_count: int) -> None:
+        super().__init__()
+        self.key = key
+        self.stored_at = stored_at
+        self.value = value
+        self.bytes_count = bytes_count
+
+    # Hash of everything sent to the provider, see 'make_key'
+    key: orm.Mapped[str] = orm.mapped_column(primary_key=True)
+
+    stored_at: orm.Mapped[datetime.datetime] = orm.mapped_column(sql.DateTime(timezone=True), index=True)
+
+    value: orm.Mapped[JsonDict] = orm.mapped_column(sql.JSON)
+    bytes_count: orm.Mapped[int]
+
+
+annotate_new_tables("llm_cache")
@@ -0,0 +1,95 @@
+# MALIN Platform https://malin.cahiersfantastiques.fr/
+# Copyright 2025 Vincent Jacques <vincent@vincent-jacques.net>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import traceback
+
+import sqlalchemy as sql
+
+from . import database_utils
+from . import logs
+
+
+# The API and the submission daemon itself notify this channel when they create pending page extractions,
+# classifications, adaptations or textbook exports. The submission daemon listens to it to start working without polling.
+CHANNEL = "patty_pending_work"
+
+
+def notify(session: database_utils.Session) -> None:
+    # PostgreSQL delivers notifications when (and only if) the transaction is committed,
+    # so the pending rows are visible to the listener when it wakes up.
+    session.execute(sql.text(f"NOTIFY {CHANNEL}"))
+
+
+class Listener:
+    def __init__(self, engine: database_utils.Engine) -> None:
+        self.engine = engine
+        self.wake_up_events: list[asyncio.Event] = []
+
+    def make_wake_up_event(self) -> asyncio.Event:
+        event = asyncio.Event()
+        self.wake_up_events.append(event)
+        return event
+
+    def wake_up(self) -> None:
+        for event in self.wake_up_events:
+            event.set()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.listen()
+            except Exception:  # Pokemon programming: gotta catch 'em all
+                logs.log("UNEXPECTED ERROR while listening for pending work")
+                traceback.print_exc()
+            # Notifications may have been missed while the connection was down
+            self.wake_up()
+            await asyncio.sleep(5)
+
+    async def listen(self) -> None:
+        loop = asyncio.get_running_loop()
+        connection = self.engine.raw_connection()
+        # This connection is dedicated to listening: never give it back to the pool
+        connection.detach()
+        try:
+            driver_connection = connection.driver_connection
+            assert driver_connection is not None
+            driver_connection.autocommit = True
+            with driver_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            logs.log(f"Listening for pending work on channel {CHANNEL}")
+
+            failed: asyncio.Future[None] = loop.create_future()
+
+            def on_readable() -> None:
+                try:
+                    driver_connection.poll()
+                except Exception as error:
+                    if not failed.done():
+                        failed.set_exception(error)
+                else:
+                    if driver_connection.notifies:
+                        driver_connection.notifies.clear()
+                        self.wake_up()
+
+            fileno = driver_connection.fileno()
+            loop.add_reader(fileno, on_readable)
+            try:
+                await failed
+            finally:
+                loop.remove_reader(fileno)
+        finally:
+            connection.close()
@@ -0,0 +1,314 @@
+# MALIN Platform https://malin.cahiersfantastiques.fr/
+# Copyright 2025 Vincent Jacques <vincent@vincent-jacques.net>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Client-side rate limiting of LLM calls, per provider and model.
+# Each model gets a token bucket (configured per provider in 'settings.LLM_RATE_LIMITS')
+# and an AIMD concurrency limit: halved on each throttling, increased by about one every 'limit' successes.
+# After a rate limit error, the model is throttled for the time the provider asked for ('Retry-After' and similar),
+# or with exponential back-off. Meanwhile, the submission daemon keeps working for other models.
+# Errors from calls that were already in flight when the model got throttled belong to the same throttling:
+# they extend it if needed, but don't count as more throttlings (in particular against '--max-retries').
+
+from typing import Any, AsyncIterator, Mapping
+import asyncio
+import contextlib
+import datetime
+import email.utils
+import re
+import time
+import unittest
+
+from . import logs
+from . import settings
+from .retry import RetryableError
+
+
+class ModelRateLimiter:
+    def __init__(self, limits: settings.LlmRateLimitSettings) -> None:
+        self.max_concurrency = limits.max_concurrency
+        self.concurrency = float(limits.max_concurrency)
+        self.in_flight = 0
+        if limits.requests_per_minute is None:
+            self.tokens_per_second = None
+        else:
+            self.tokens_per_second = limits.requests_per_minute / 60
+        self.tokens = float(limits.max_concurrency)
+        self.refilled_at = time.monotonic()
+        self.throttled_until = 0.0
+        self.consecutive_throttles = 0
+
+    async def acquire(self) -> None:
+        # Polling keeps this usable from several event loops (the API, the daemon, tests)
+        while True:
+            now = time.monotonic()
+            if self.tokens_per_second is not None:
+                self.tokens = min(
+                    float(self.max_concurrency), self.tokens + (now - self.refilled_at) * self.tokens_per_second
+                )
+                self.refilled_at = now
+            if now < self.throttled_until:
+                delay = self.throttled_until - now
+            elif self.in_flight >= int(self.concurrency):
+                delay = 0.05
+            elif self.tokens_per_second is not None and self.tokens < 1:
+                delay = (1 - self.tokens) / self.tokens_per_second
+            else:
+                if self.tokens_per_second is not None:
+                    self.tokens -= 1
+                self.in_flight += 1
+                return
+            await asyncio.sleep(delay)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def succeeded(self) -> None:
+        self.consecutive_throttles = 0
+        self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+
+    def throttled(self, retry_after: float | None) -> float:
+        if time.monotonic() >= self.throttled_until:
+            self.consecutive_throttles += 1
+            self.concurrency = max(1.0, self.concurrency / 2)
+        # A zero delay (e.g. 'Retry-After: 0', or a date already past) would retry right away and exhaust the retries
+        if retry_after is None or retry_after <= 0:
+            retry_after = min(2**self.consecutive_throttles, 60)
+        self.throttled_until = max(self.throttled_until, time.monotonic() + retry_after)
+        return retry_after
+
+
+class RateLimiter:
+    def __init__(self, limits: dict[str, settings.LlmRateLimitSettings]) -> None:
+        self.limits = limits
+        self.models: dict[tuple[str, str], ModelRateLimiter] = {}
+
+    def get(self, provider: str, model: str) -> ModelRateLimiter:
+        key = (provider, model)
+        if key not in self.models:
+            self.models[key] = ModelRateLimiter(self.limits.get(provider, settings.LlmRateLimitSettings()))
+        return self.models[key]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, provider: str, model: str) -> AsyncIterator[None]:
+        model_limiter = self.get(provider, model)
+        await model_limiter.acquire()
+        try:
+            yield
+        except RetryableError as error:
+            retry_after = model_limiter.throttled(error.retry_after)
+            logs.log(
+                f"Throttling {provider} {model} for {retry_after:.1f}s"
+                f" (concurrency limit: {int(model_limiter.concurrency)})"
+            )
+            raise
+        else:
+            model_limiter.succeeded()
+        finally:
+            model_limiter.release()
+
+    def consecutive_throttles(self, provider: str, model: str) -> int:
+        return self.get(provider, model).consecutive_throttles
+
+    def throttled_models(self) -> list[tuple[str, str]]:
+        now = time.monotonic()
+        return [key for (key, model_limiter) in self.models.items() if model_limiter.throttled_until > now]
+
+    def seconds_until_unthrottled(self) -> float | None:
+        now = time.monotonic()
+        delays = [
+            model_limiter.throttled_until - now
+            for model_limiter in self.models.values()
+            if model_limiter.throttled_until > now
+        ]
+        return min(delays, default=None)
+
+
+limiter = RateLimiter(settings.LLM_RATE_LIMITS)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> float | None:
+    headers = {name.lower(): value for (name, value) in headers.items()}
+
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+
+    if "retry-after" in headers:
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(headers["retry-after"])
+            except (TypeError, ValueError):
+                pass
+            else:
+                return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+    # OpenAI-style rate limit headers, e.g. 'x-ratelimit-remaining-requests: 0' and 'x-ratelimit-reset-requests: 6m0s'
+    resets = [
+        parse_duration(headers[f"x-ratelimit-reset-{kind}"])
+        for kind in ("requests", "tokens")
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0" and f"x-ratelimit-reset-{kind}" in headers
+    ]
+    return max((reset for reset in resets if reset is not None), default=None)
+
+
+def parse_google_retry_delay(error_json: Any) -> float | None:
+    # Gemini's 429 responses detail a 'google.rpc.RetryInfo', e.g. '{"retryDelay": "37s"}'
+    try:
+        details = error_json["error"]["details"]
+    except (KeyError, TypeError):
+        return None
+    for detail in details:
+        if isinstance(detail, dict) and detail.get("@type") == "type.googleapis.com/google.rpc.RetryInfo":
+            return parse_duration(str(detail.get("retryDelay", "")))
+    return None
+
+
+duration_part_pattern = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+duration_units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+
+
+def parse_duration(duration: str) -> float | None:
+    parts = duration_part_pattern.findall(duration)
+    if len(parts) == 0 or "".join(value + unit for (value, unit) in parts) != duration:
+        return None
+    else:
+        return sum(float(value) * duration_units[unit] for (value, unit) in parts)
+
+
+class ParseRetryAfterTestCase(unittest.TestCase):
+    def test_seconds(self) -> None:
+        self.assertEqual(parse_retry_after({"Retry-After": "12"}), 12)
+        self.assertEqual(parse_retry_after({"retry-after-ms": "1500", "retry-after": "2"}), 1.5)
+
+    def test_http_date(self) -> None:
+        retry_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+        retry_after = parse_retry_after({"Retry-After": email.utils.format_datetime(retry_at)})
+        assert retry_after is not None
+        self.assertAlmostEqual(retry_after, 30, delta=1.5)
+
+    def test_rate_limit_headers(self) -> None:
+        self.assertEqual(
+            parse_retry_after(
+                {
+                    "x-ratelimit-remaining-requests": "0",
+                    "x-ratelimit-reset-requests": "1m30s",
+                    "x-ratelimit-remaining-tokens": "1000",
+                    "x-ratelimit-reset-tokens": "20ms",
+                }
+            ),
+            90,
+        )
+        self.assertIsNone(parse_retry_after({"x-ratelimit-remaining-requests": "3"}))
+        self.assertIsNone(parse_retry_after({}))
+
+    def test_google_retry_delay(self) -> None:
+        error_json = {
+            "error": {
+                "code": 429,
+                "details": [
+                    {"@type": "type.googleapis.com/google.rpc.QuotaFailure", "violations": []},
+                    {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "37s"},
+                ],
+            }
+        }
+        self.assertEqual(parse_google_retry_delay(error_json), 37)
+        self.assertIsNone(parse_google_retry_delay({"error": {"code": 429}}))
+        self.assertIsNone(parse_google_retry_delay(None))
+
+
+class RateLimiterTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_throttling_is_per_model(self) -> None:
+        rate_limiter = RateLimiter({"dummy": settings.LlmRateLimitSettings(max_concurrency=4)})
+
+        with self.assertRaises(RetryableError):
+            async with rate_limiter.slot("dummy", "dummy-1"):
+                raise RetryableError(retry_after=0.2)
+        self.assertEqual(rate_limiter.throttled_models(), [("dummy", "dummy-1")])
+        self.assertEqual(rate_limiter.consecutive_throttles("dummy", "dummy-1"), 1)
+        self.assertEqual(rate_limiter.get("dummy", "dummy-1").concurrency, 2)
+
+        # Other models are not affected
+        started = time.monotonic()
+        async with rate_limiter.slot("dummy", "dummy-2"):
+            pass
+        self.assertLess(time.monotonic() - started, 0.1)
+
+        # The throttled model waits for the delay asked by the provider
+        async with rate_limiter.slot("dummy", "dummy-1"):
+            self.assertGreater(time.monotonic() - started, 0.15)
+        self.assertEqual(rate_limiter.throttled_models(), [])
+        self.assertEqual(rate_limiter.consecutive_throttles("dummy", "dummy-1"), 0)
+        self.assertEqual(rate_limiter.get("dummy", "dummy-1").concurrency, 2.5)
+
+    async def test_zero_delay_backs_off(self) -> None:
+        model_limiter = RateLimiter({}).get("dummy", "dummy-1")
+        self.assertEqual(model_limiter.throttled(0.05), 0.05)
+        await asyncio.sleep(0.1)
+        self.assertEqual(model_limiter.throttled(0), 4)
+        self.assertEqual(model_limiter.throttled(0.0), 4)
+        self.assertEqual(model_limiter.throttled(0.5), 0.5)
+        self.assertEqual(model_limiter.consecutive_throttles, 2)
+
+    async def test_concurrent_errors_count_once(self) -> None:
+        rate_limiter = RateLimiter({"dummy": settings.LlmRateLimitSettings(max_concurrency=8)})
+
+        async def call() -> None:
+            async with rate_limiter.slot("dummy", "dummy-1"):
+                await asyncio.sleep(0.05)
+                raise RetryableError(retry_after=0.1)
+
+        results = await asyncio.gather(*(call() for _ in range(8)), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, RetryableError) for result in results))
+        self.assertEqual(rate_limiter.consecutive_throttles("dummy", "dummy-1"), 1)
+        self.assertEqual(rate_limiter.get("dummy", "dummy-1").concurrency, 4)
+
+        # Once the throttling is over, a new error is a new throttling
+        with self.assertRaises(RetryableError):
+            async with rate_limiter.slot("dummy", "dummy-1"):
+                raise RetryableError(retry_after=0.1)
+        self.assertEqual(rate_limiter.consecutive_throttles("dummy", "dummy-1"), 2)
+        self.assertEqual(rate_limiter.get("dummy", "dummy-1").concurrency, 2)
+
+    async def test_concurrency(self) -> None:
+        rate_limiter = RateLimiter({"dummy": settings.LlmRateLimitSettings(max_concurrency=2)})
+        in_flight = 0
+        max_in_flight = 0
+
+        async def call() -> None:
+            nonlocal in_flight, max_in_flight
+            async with rate_limiter.slot("dummy", "dummy-1"):
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+                await asyncio.sleep(0.05)
+                in_flight -= 1
+
+        await asyncio.gather(*(call() for _ in range(6)))
+        self.assertEqual(max_in_flight, 2)
+
+    async def test_requests_per_minute(self) -> None:
+        rate_limiter = RateLimiter({"dummy": settings.LlmRateLimitSettings(requests_per_minute=600, max_concurrency=2)})
+
+        started = time.monotonic()
+        for _ in range(4):
+            async with rate_limiter.slot("dummy", "dummy-1"):
+                pass
+        # Two requests from the initial burst, then one every 0.1s
+        self.assertAlmostEqual(time.monotonic() - started, 0.2, delta=0.05)
@@ -16,4 +16,7 @@
 
 
 class RetryableError(Exception):
-    pass
+    def __init__(self, *args: object, retry_after: float | None = None) -> None:
+        super().__init__(*args)
+        # In seconds, when the provider told how long to wait before retrying
+        self.retry_after = retry_after
@@ -17,6 +17,7 @@
 import dataclasses
 import datetime
 import os
+import typing
 
 import pydantic
 
@@ -55,6 +56,48 @@ OPENAI_API_KEY = os.environ["PATTY_OPENAI_API_KEY"]
 # Looks like: an opaque string.
 GEMINIAI_KEY = os.environ["PATTY_GEMINIAI_KEY"]
 
+# How long LLM responses are cached in the database, to answer identical requests (same provider, model, messages,
+# image and response schema) without calling the provider again, e.g. when re-running the same settings in the sandbox.
+# Optional. If unset, LLM responses are not cached.
+# In [ISO 8601 duration format](https://en.wikipedia.org/wiki/ISO_8601#Durations).
+# Looks like: `P7D` (one week).
+LLM_RESPONSES_CACHE_TTL = (
+    None
+    if "PATTY_LLM_RESPONSES_CACHE_TTL" not in os.environ
+    else pydantic.RootModel[datetime.timedelta].model_validate(os.environ["PATTY_LLM_RESPONSES_CACHE_TTL"]).root
+)
+
+# Maximum total size of the cached LLM responses above, in bytes. Oldest responses are removed beyond that.
+# Optional, defaults to 268435456 (256 MiB).
+# Looks like: `268435456`.
+LLM_RESPONSES_CACHE_MAX_BYTES = int(os.environ.get("PATTY_LLM_RESPONSES_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+assert LLM_RESPONSES_CACHE_MAX_BYTES > 0
+
+
+@dataclasses.dataclass
+class LlmRateLimitSettings:
+    # Sustained number of requests per minute sent to each model of the provider. None means no limit.
+    requests_per_minute: float | None = None
+    # Maximum number of concurrent requests to each model of the provider.
+    # The actual limit is halved each time the model gets throttled, and grows back slowly on successes.
+    max_concurrency: int = 16
+
+
+# Client-side rate limits for each LLM provider, applied per model.
+# Providers not listed here get the defaults above.
+# Optional, defaults to `{}`.
+# In JSON, with provider names as keys.
+# Looks like: `{"gemini": {"requests_per_minute": 15, "max_concurrency": 2}}`.
+LLM_RATE_LIMITS = (
+    pydantic.RootModel[dict[str, LlmRateLimitSettings]]
+    .model_validate_json(os.environ.get("PATTY_LLM_RATE_LIMITS", "{}"))
+    .root
+)
+assert all(
+    (limit.requests_per_minute is None or limit.requests_per_minute > 0) and limit.max_concurrency > 0
+    for limit in LLM_RATE_LIMITS.values()
+)
+
 
 #######################
 # Models used locally #
@@ -72,6 +115,22 @@ IMAGES_DETECTION_MODEL_2025_09_15_PATH = os.environ["PATTY_2025_09_15_IMAGES_DET
 # You must put this file there yourself.
 CLASSIFICATION_CAMEMBERT_2025_05_20_PATH = os.environ["PATTY_2025_05_20_CLASSIFICATION_CAMEMBERT_PT_PATH"]
 
+# Maximum number of tokens in each batch of exercises sent to the classification model.
+# Optional, defaults to 8192 (i.e. 32 exercises per batch).
+# Looks like: `8192`.
+CLASSIFICATION_TOKENS_PER_BATCH = int(os.environ.get("PATTY_CLASSIFICATION_TOKENS_PER_BATCH", "8192"))
+assert CLASSIFICATION_TOKENS_PER_BATCH > 0
+
+# Backend used to run the classification model: 'fp32' runs the model as is,
+# 'int8' quantizes its linear layers dynamically, which is faster and uses less memory on CPU.
+# Optional, defaults to `fp32`.
+# Looks like: `fp32` or `int8`.
+CLASSIFICATION_BACKEND = (
+    pydantic.RootModel[typing.Literal["fp32", "int8"]]
+    .model_validate(os.environ.get("PATTY_CLASSIFICATION_BACKEND", "fp32"))
+    .root
+)
+
 
 ################
 # Data storage #
@@ -112,6 +171,38 @@ assert not PDF_FILES_URL.endswith("/")
 EXERCISE_IMAGES_URL = os.environ["PATTY_EXERCISE_IMAGES_URL"]
 assert not EXERCISE_IMAGES_URL.endswith("/")
 
+# URL prefix where Patty will store textbook exports rendered in the background.
+# Required.
+# Looks like: `s3://bucket/path/to/textbook-exports` or `file:///absolute/path/to/textbook-exports`.
+TEXTBOOK_EXPORTS_URL = os.environ["PATTY_TEXTBOOK_EXPORTS_URL"]
+assert not TEXTBOOK_EXPORTS_URL.endswith("/")
+
+# URL prefix where Patty will cache rasterized PDF pages, to avoid rasterizing them again when re-extracting.
+# Optional. If unset, rasterized pages are only cached locally by the submission daemon (see 'extraction.preprocessing').
+# Looks like: `s3://bucket/path/to/page-images` or `file:///absolute/path/to/page-images`.
+PDF_PAGE_IMAGES_URL = os.environ.get("PATTY_PDF_PAGE_IMAGES_URL")
+assert PDF_PAGE_IMAGES_URL != ""
+assert PDF_PAGE_IMAGES_URL is None or not PDF_PAGE_IMAGES_URL.endswith("/")
+
+# Maximum number of files loaded concurrently from storage, e.g. when exporting a textbook.
+# Optional, defaults to 16.
+# Looks like: `16`.
+FILE_STORAGE_LOAD_CONCURRENCY = int(os.environ.get("PATTY_FILE_STORAGE_LOAD_CONCURRENCY", "16"))
+assert FILE_STORAGE_LOAD_CONCURRENCY > 0
+
+# Path where Patty will cache immutable files (exercise images and PDF files) loaded from S3.
+# Optional. If unset, these files are loaded from S3 each time they are used.
+# Looks like: `/absolute/path/to/file-storage-cache`.
+# Useless with `file://` URLs above.
+FILE_STORAGE_CACHE_PATH = os.environ.get("PATTY_FILE_STORAGE_CACHE_PATH")
+assert FILE_STORAGE_CACHE_PATH != ""
+
+# Maximum total size of the files in the cache above, in bytes. Least recently used files are removed beyond that.
+# Optional, defaults to 1073741824 (1 GiB).
+# Looks like: `1073741824`.
+FILE_STORAGE_CACHE_MAX_BYTES = int(os.environ.get("PATTY_FILE_STORAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+assert FILE_STORAGE_CACHE_MAX_BYTES > 0
+
 # Path where Patty will save detected images and annotated pages, for debugging purposes.
 # Optional.
 # Looks like: `/absolute/path/to/detected/images`.
@@ -120,8 +211,15 @@ DETECTED_IMAGES_SAVE_PATH = os.environ.get("PATTY_DETECTED_IMAGES_SAVE_PATH")
 assert DETECTED_IMAGES_SAVE_PATH != ""
 
 if any(
-    url.startswith("s3://")
-    for url in [DATABASE_BACKUPS_URL, EXTERNAL_EXERCISES_URL, PDF_FILES_URL, EXERCISE_IMAGES_URL]
+    url is not None and url.startswith("s3://")
+    for url in [
+        DATABASE_BACKUPS_URL,
+        EXTERNAL_EXERCISES_URL,
+        PDF_FILES_URL,
+        EXERCISE_IMAGES_URL,
+        TEXTBOOK_EXPORTS_URL,
+        PDF_PAGE_IMAGES_URL,
+    ]
 ):
     # Key to an AWS IAM user with permissions to write to any S3 bucket used above.
     # Required if an s3:// URL has been configured above.
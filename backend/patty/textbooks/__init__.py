@@ -21,4 +21,6 @@ from .orm_models import (
     Textbook as Textbook,
     Lesson as Lesson,
     AdaptationCreationByTextbook as AdaptationCreationByTextbook,
+    TextbookExport as TextbookExport,
+    TextbookExportFormat as TextbookExportFormat,
 )
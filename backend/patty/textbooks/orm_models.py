@@ -17,6 +17,7 @@
 from __future__ import annotations
 
 import datetime
+import typing
 
 from sqlalchemy import orm
 import sqlalchemy as sql
@@ -249,4 +250,49 @@ class AdaptationCreationByTextbook(adaptation.AdaptationCreation):
     textbook: orm.Mapped[Textbook] = orm.relationship(foreign_keys=[textbook_id], remote_side=[Textbook.id])
 
 
+TextbookExportFormat = typing.Literal["html", "zip"]
+
+
+class TextbookExport(OrmBase, CreatedByUserMixin):
+    __tablename__ = "textbook_exports"
+    __table_args__ = (
+        # For the submission daemon to find pending exports in FIFO order
+        sql.Index("ix_textbook_exports__pending", "id", postgresql_where=sql.text("finished_at IS NULL")),
+    )
+
+    def __init__(
+        self,
+        *,
+        created_at: datetime.datetime,
+        created_by: str,
+        textbook: Textbook,
+        format: TextbookExportFormat,
+        content_hash: str,
+    ) -> None:
+        super().__init__()
+        self.created_at = created_at
+        self.created_by = created_by
+        self.textbook = textbook
+        self.format = format
+        self.content_hash = content_hash
+        self.finished_at = None
+        self.succeeded = None
+
+    id: orm.Mapped[int] = orm.mapped_column(primary_key=True, autoincrement=True)
+
+    textbook_id: orm.Mapped[int] = orm.mapped_column(sql.ForeignKey(Textbook.id))
+    textbook: orm.Mapped[Textbook] = orm.relationship(foreign_keys=[textbook_id], remote_side=[Textbook.id])
+
+    format: orm.Mapped[TextbookExportFormat] = orm.mapped_column(sql.String)
+    # Hash of everything that goes in the export: exports with the same hash have the same content
+    content_hash: orm.Mapped[str] = orm.mapped_column(index=True)
+
+    finished_at: orm.Mapped[datetime.datetime | None] = orm.mapped_column(sql.DateTime(timezone=True))
+    succeeded: orm.Mapped[bool | None]
+
+    @property
+    def artifact_key(self) -> str:
+        return f"{self.content_hash}.{self.format}"
+
+
 annotate_new_tables("textbooks")
@@ -468,6 +468,23 @@ export interface paths {
     patch?: never
     trace?: never
   }
+  '/api/textbook-exports/{id}': {
+    parameters: {
+      query?: never
+      header?: never
+      path?: never
+      cookie?: never
+    }
+    /** Get Textbook Export */
+    get: operations['get_textbook_export_api_textbook_exports__id__get']
+    put?: never
+    post?: never
+    delete?: never
+    options?: never
+    head?: never
+    patch?: never
+    trace?: never
+  }
   '/api/textbooks': {
     parameters: {
       query?: never
@@ -554,6 +571,23 @@ export interface paths {
     patch?: never
     trace?: never
   }
+  '/api/textbooks/{textbook_id}/exports': {
+    parameters: {
+      query?: never
+      header?: never
+      path?: never
+      cookie?: never
+    }
+    get?: never
+    put?: never
+    /** Post Textbook Export */
+    post: operations['post_textbook_export_api_textbooks__textbook_id__exports_post']
+    delete?: never
+    options?: never
+    head?: never
+    patch?: never
+    trace?: never
+  }
   '/api/textbooks/{textbook_id}/external-exercises': {
     parameters: {
       query?: never
@@ -1052,6 +1086,23 @@ export interface components {
       /** Systemprompt */
       systemPrompt: string
     }
+    /** ApiTextbookExport */
+    ApiTextbookExport: {
+      /**
+       * Format
+       * @enum {string}
+       */
+      format: 'html' | 'zip'
+      /** Id */
+      id: string
+      /**
+       * Status
+       * @enum {string}
+       */
+      status: 'inProgress' | 'success' | 'error'
+      /** Url */
+      url: string | null
+    }
     /** ApprovalRequest */
     ApprovalRequest: {
       /** Approved */
@@ -2252,6 +2303,16 @@ export interface components {
       /** Id */
       id: string
     }
+    /** PostTextbookExportRequest */
+    PostTextbookExportRequest: {
+      /** Creator */
+      creator: string
+      /**
+       * Format
+       * @enum {string}
+       */
+      format: 'html' | 'zip'
+    }
     /** PostTextbookExternalExercisesRequest */
     PostTextbookExternalExercisesRequest: {
       /** Creator */
@@ -4024,6 +4085,37 @@ export interface operations {
       }
     }
   }
+  get_textbook_export_api_textbook_exports__id__get: {
+    parameters: {
+      query?: never
+      header?: never
+      path: {
+        id: string
+      }
+      cookie?: never
+    }
+    requestBody?: never
+    responses: {
+      /** @description Successful Response */
+      200: {
+        headers: {
+          [name: string]: unknown
+        }
+        content: {
+          'application/json': components['schemas']['ApiTextbookExport']
+        }
+      }
+      /** @description Validation Error */
+      422: {
+        headers: {
+          [name: string]: unknown
+        }
+        content: {
+          'application/json': components['schemas']['HTTPValidationError']
+        }
+      }
+    }
+  }
   get_textbooks_api_textbooks_get: {
     parameters: {
       query?: never
@@ -4209,6 +4301,41 @@ export interface operations {
       }
     }
   }
+  post_textbook_export_api_textbooks__textbook_id__exports_post: {
+    parameters: {
+      query?: never
+      header?: never
+      path: {
+        textbook_id: string
+      }
+      cookie?: never
+    }
+    requestBody: {
+      content: {
+        'application/json': components['schemas']['PostTextbookExportRequest']
+      }
+    }
+    responses: {
+      /** @description Successful Response */
+      200: {
+        headers: {
+          [name: string]: unknown
+        }
+        content: {
+          'application/json': components['schemas']['ApiTextbookExport']
+        }
+      }
+      /** @description Validation Error */
+      422: {
+        headers: {
+          [name: string]: unknown
+        }
+        content: {
+          'application/json': components['schemas']['HTTPValidationError']
+        }
+      }
+    }
+  }
   post_textbook_external_exercises_api_textbooks__textbook_id__external_exercises_post: {
     parameters: {
       query?: never
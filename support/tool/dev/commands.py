@@ -54,6 +54,7 @@ def clean(force: bool) -> None:
                 "support/dev-env/backend/home-config/",
                 "support/dev-env/backend/home-local/",
                 "support/dev-env/backend/pdf-files/",
+                "support/dev-env/backend/textbook-exports/",
                 "support/dev-env/db/backups/",
                 "support/dev-env/db/dumps/",
                 "support/dev-env/frontend/cache/",
@@ -61,6 +62,7 @@ def clean(force: bool) -> None:
                 "support/prod/backend/external-exercises/",
                 "support/prod/backend/lessons/",
                 "support/prod/backend/pdf-files/",
+                "support/prod/backend/textbook-exports/",
                 "support/prod/db/backups/",
             ]
         ):